@@ -0,0 +1,170 @@
+'''
+65C02 opcode tables and vectorized instruction decoding, ported from dis65c02.h.
+
+`OPCODES` is the header's `a65C02_ops` table: (mnemonic, address mode, operand bytes) for
+each opcode. The NumPy arrays derived from it (`ARG_SIZE`, `MODE`, `MNEMONIC_ID`) decode
+whole columns of opcodes at once; `format_instruction` renders one instruction the way the
+analyze65 sketch prints it, with branch targets resolved.
+'''
+from typing import Sequence
+
+import numpy as np
+
+# Address modes, numbered as in dis65c02.h (only the 6502/65C02 ones occur in OPCODES)
+AM_ZP_REL_X = 0x00      # ($12,x)
+AM_ZP = 0x01            # $12
+AM_IMM = 0x02           # #$12
+AM_ABS = 0x03           # $1234
+AM_ZP_Y_REL = 0x04      # ($12),y
+AM_ZP_X = 0x05          # $12,x
+AM_ABS_Y = 0x06         # $1234,y
+AM_ABS_X = 0x07         # $1234,x
+AM_REL = 0x08           # ($1234)
+AM_ACC = 0x09           # A
+AM_NON = 0x0a
+AM_ZP_REL = 0x0b        # ($12)
+AM_REL_X = 0x0c         # ($1234,x)
+AM_ZP_ABS = 0x0d        # $12, branch target (BBR/BBS)
+AM_ZP_Y = 0x16          # $12,y
+AM_BRANCH = 0x1a        # branch target
+
+MODE_FORMATS = {
+    AM_ZP_REL_X: '{} (${:02x},x)',
+    AM_ZP: '{} ${:02x}',
+    AM_IMM: '{} #${:02x}',
+    AM_ABS: '{} ${:04x}',
+    AM_ZP_Y_REL: '{} (${:02x}),y',
+    AM_ZP_X: '{} ${:02x},x',
+    AM_ABS_Y: '{} ${:04x},y',
+    AM_ABS_X: '{} ${:04x},x',
+    AM_REL: '{} (${:04x})',
+    AM_ACC: '{} A',
+    AM_NON: '{}',
+    AM_ZP_REL: '{} (${:02x})',
+    AM_REL_X: '{} (${:04x},x)',
+    AM_ZP_ABS: '{} ${:02x}, ${:04x}',
+    AM_ZP_Y: '{} ${:02x},y',
+    AM_BRANCH: '{} ${:04x}',
+}
+
+# a65C02_ops: (mnemonic, address mode, operand bytes); undefined opcodes are '???'
+OPCODES = (
+    ('brk', AM_NON, 0), ('ora', AM_ZP_REL_X, 1), ('???', AM_NON, 0), ('???', AM_NON, 0),  # $00
+    ('tsb', AM_ZP, 1), ('ora', AM_ZP, 1), ('asl', AM_ZP, 1), ('???', AM_NON, 0),
+    ('php', AM_NON, 0), ('ora', AM_IMM, 1), ('asl', AM_NON, 0), ('???', AM_NON, 0),
+    ('tsb', AM_ABS, 2), ('ora', AM_ABS, 2), ('asl', AM_ABS, 2), ('bbr0', AM_ZP_ABS, 2),
+    ('bpl', AM_BRANCH, 1), ('ora', AM_ZP_Y_REL, 1), ('ora', AM_ZP_REL, 1), ('???', AM_NON, 0),  # $10
+    ('trb', AM_ZP, 1), ('ora', AM_ZP_X, 1), ('asl', AM_ZP_X, 1), ('???', AM_NON, 0),
+    ('clc', AM_NON, 0), ('ora', AM_ABS_Y, 2), ('inc', AM_NON, 0), ('???', AM_NON, 0),
+    ('trb', AM_ABS, 2), ('ora', AM_ABS_X, 2), ('asl', AM_ABS_X, 2), ('bbr1', AM_ZP_ABS, 2),
+    ('jsr', AM_ABS, 2), ('and', AM_ZP_REL_X, 1), ('???', AM_NON, 0), ('???', AM_NON, 0),  # $20
+    ('bit', AM_ZP, 1), ('and', AM_ZP, 1), ('rol', AM_ZP, 1), ('???', AM_NON, 0),
+    ('plp', AM_NON, 0), ('and', AM_IMM, 1), ('rol', AM_NON, 0), ('???', AM_NON, 0),
+    ('bit', AM_ABS, 2), ('and', AM_ABS, 2), ('rol', AM_ABS, 2), ('bbr2', AM_ZP_ABS, 2),
+    ('bmi', AM_BRANCH, 1), ('and', AM_ZP_Y_REL, 1), ('and', AM_ZP_REL, 1), ('???', AM_NON, 0),  # $30
+    ('bit', AM_ZP_X, 1), ('and', AM_ZP_X, 1), ('rol', AM_ZP_X, 1), ('???', AM_NON, 0),
+    ('sec', AM_NON, 0), ('and', AM_ABS_Y, 2), ('dec', AM_NON, 0), ('???', AM_NON, 0),
+    ('bit', AM_ABS_X, 2), ('and', AM_ABS_X, 2), ('rol', AM_ABS_X, 2), ('bbr3', AM_ZP_ABS, 2),
+    ('rti', AM_NON, 0), ('eor', AM_ZP_REL_X, 1), ('???', AM_NON, 0), ('???', AM_NON, 0),  # $40
+    ('???', AM_NON, 0), ('eor', AM_ZP, 1), ('lsr', AM_ZP, 1), ('???', AM_NON, 0),
+    ('pha', AM_NON, 0), ('eor', AM_IMM, 1), ('lsr', AM_NON, 0), ('???', AM_NON, 0),
+    ('jmp', AM_ABS, 2), ('eor', AM_ABS, 2), ('lsr', AM_ABS, 2), ('bbr4', AM_ZP_ABS, 2),
+    ('bvc', AM_BRANCH, 1), ('eor', AM_ZP_Y_REL, 1), ('eor', AM_ZP_REL, 1), ('???', AM_NON, 0),  # $50
+    ('???', AM_NON, 0), ('eor', AM_ZP_X, 1), ('lsr', AM_ZP_X, 1), ('???', AM_NON, 0),
+    ('cli', AM_NON, 0), ('eor', AM_ABS_Y, 2), ('phy', AM_NON, 0), ('???', AM_NON, 0),
+    ('???', AM_NON, 0), ('eor', AM_ABS_X, 2), ('lsr', AM_ABS_X, 2), ('bbr5', AM_ZP_ABS, 2),
+    ('rts', AM_NON, 0), ('adc', AM_ZP_REL_X, 1), ('???', AM_NON, 0), ('???', AM_NON, 0),  # $60
+    ('stz', AM_ZP, 1), ('adc', AM_ZP, 1), ('ror', AM_ZP, 1), ('???', AM_NON, 0),
+    ('pla', AM_NON, 0), ('adc', AM_IMM, 1), ('ror', AM_NON, 0), ('???', AM_NON, 0),
+    ('jmp', AM_REL, 2), ('adc', AM_ABS, 2), ('ror', AM_ABS, 2), ('bbr6', AM_ZP_ABS, 2),
+    ('bvs', AM_BRANCH, 1), ('adc', AM_ZP_Y_REL, 1), ('adc', AM_ZP_REL, 1), ('???', AM_NON, 0),  # $70
+    ('stz', AM_ZP_X, 1), ('adc', AM_ZP_X, 1), ('ror', AM_ZP_X, 1), ('???', AM_NON, 0),
+    ('sei', AM_NON, 0), ('adc', AM_ABS_Y, 2), ('ply', AM_NON, 0), ('???', AM_NON, 0),
+    ('jmp', AM_REL_X, 2), ('adc', AM_ABS_X, 2), ('ror', AM_ABS_X, 2), ('bbr7', AM_ZP_ABS, 2),
+    ('bra', AM_BRANCH, 1), ('sta', AM_ZP_REL_X, 1), ('???', AM_NON, 0), ('???', AM_NON, 0),  # $80
+    ('sty', AM_ZP, 1), ('sta', AM_ZP, 1), ('stx', AM_ZP, 1), ('???', AM_NON, 0),
+    ('dey', AM_NON, 0), ('bit', AM_IMM, 1), ('txa', AM_NON, 0), ('???', AM_NON, 0),
+    ('sty', AM_ABS, 2), ('sta', AM_ABS, 2), ('stx', AM_ABS, 2), ('bbs0', AM_ZP_ABS, 2),
+    ('bcc', AM_BRANCH, 1), ('sta', AM_ZP_Y_REL, 1), ('sta', AM_ZP_REL, 1), ('???', AM_NON, 0),  # $90
+    ('sty', AM_ZP_X, 1), ('sta', AM_ZP_X, 1), ('stx', AM_ZP_Y, 1), ('???', AM_NON, 0),
+    ('tya', AM_NON, 0), ('sta', AM_ABS_Y, 2), ('txs', AM_NON, 0), ('???', AM_NON, 0),
+    ('stz', AM_ABS, 2), ('sta', AM_ABS_X, 2), ('stz', AM_ABS_X, 2), ('bbs1', AM_ZP_ABS, 2),
+    ('ldy', AM_IMM, 1), ('lda', AM_ZP_REL_X, 1), ('ldx', AM_IMM, 1), ('???', AM_NON, 0),  # $a0
+    ('ldy', AM_ZP, 1), ('lda', AM_ZP, 1), ('ldx', AM_ZP, 1), ('???', AM_NON, 0),
+    ('tay', AM_NON, 0), ('lda', AM_IMM, 1), ('tax', AM_NON, 0), ('???', AM_NON, 0),
+    ('ldy', AM_ABS, 2), ('lda', AM_ABS, 2), ('ldx', AM_ABS, 2), ('bbs2', AM_ZP_ABS, 2),
+    ('bcs', AM_BRANCH, 1), ('lda', AM_ZP_Y_REL, 1), ('lda', AM_ZP_REL, 1), ('???', AM_NON, 0),  # $b0
+    ('ldy', AM_ZP_X, 1), ('lda', AM_ZP_X, 1), ('ldx', AM_ZP_Y, 1), ('???', AM_NON, 0),
+    ('clv', AM_NON, 0), ('lda', AM_ABS_Y, 2), ('tsx', AM_NON, 0), ('???', AM_NON, 0),
+    ('ldy', AM_ABS_X, 2), ('lda', AM_ABS_X, 2), ('ldx', AM_ABS_Y, 2), ('bbs3', AM_ZP_ABS, 2),
+    ('cpy', AM_IMM, 1), ('cmp', AM_ZP_REL_X, 1), ('???', AM_NON, 0), ('???', AM_NON, 0),  # $c0
+    ('cpy', AM_ZP, 1), ('cmp', AM_ZP, 1), ('dec', AM_ZP, 1), ('???', AM_NON, 0),
+    ('iny', AM_NON, 0), ('cmp', AM_IMM, 1), ('dex', AM_NON, 0), ('wai', AM_NON, 0),
+    ('cpy', AM_ABS, 2), ('cmp', AM_ABS, 2), ('dec', AM_ABS, 2), ('bbs4', AM_ZP_ABS, 2),
+    ('bne', AM_BRANCH, 1), ('cmp', AM_ZP_Y_REL, 1), ('cmp', AM_ZP_REL, 1), ('???', AM_NON, 0),  # $d0
+    ('???', AM_NON, 0), ('cmp', AM_ZP_X, 1), ('dec', AM_ZP_X, 1), ('???', AM_NON, 0),
+    ('cld', AM_NON, 0), ('cmp', AM_ABS_Y, 2), ('phx', AM_NON, 0), ('stp', AM_NON, 0),
+    ('???', AM_NON, 0), ('cmp', AM_ABS_X, 2), ('dec', AM_ABS_X, 2), ('bbs5', AM_ZP_ABS, 2),
+    ('cpx', AM_IMM, 1), ('sbc', AM_ZP_REL_X, 1), ('???', AM_NON, 0), ('???', AM_NON, 0),  # $e0
+    ('cpx', AM_ZP, 1), ('sbc', AM_ZP, 1), ('inc', AM_ZP, 1), ('???', AM_NON, 0),
+    ('inx', AM_NON, 0), ('sbc', AM_IMM, 1), ('nop', AM_NON, 0), ('???', AM_NON, 0),
+    ('cpx', AM_ABS, 2), ('sbc', AM_ABS, 2), ('inc', AM_ABS, 2), ('bbs6', AM_ZP_ABS, 2),
+    ('beq', AM_BRANCH, 1), ('sbc', AM_ZP_Y_REL, 1), ('sbc', AM_ZP_REL, 1), ('???', AM_NON, 0),  # $f0
+    ('???', AM_NON, 0), ('sbc', AM_ZP_X, 1), ('inc', AM_ZP_X, 1), ('???', AM_NON, 0),
+    ('sed', AM_NON, 0), ('sbc', AM_ABS_Y, 2), ('plx', AM_NON, 0), ('???', AM_NON, 0),
+    ('???', AM_NON, 0), ('sbc', AM_ABS_X, 2), ('inc', AM_ABS_X, 2), ('bbs7', AM_ZP_ABS, 2),
+)
+
+MNEMONICS = tuple(sorted({mnemonic for mnemonic, _, _ in OPCODES}))
+
+ARG_SIZE = np.array([size for _, _, size in OPCODES], dtype=np.uint8)
+MODE = np.array([mode for _, mode, _ in OPCODES], dtype=np.uint8)
+MNEMONIC_ID = np.array([MNEMONICS.index(mnemonic) for mnemonic, _, _ in OPCODES], dtype=np.uint8)
+
+def opcodes_for(mnemonic: str) -> np.ndarray:
+    '''All opcodes with the given mnemonic, e.g. every addressing mode of 'lda'.'''
+    return np.flatnonzero(MNEMONIC_ID == MNEMONICS.index(mnemonic.lower()))
+
+def operand_values(opcodes: np.ndarray, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    '''
+    Combine the bytes after each opcode into operand values.
+
+    Args:
+        opcodes (np.ndarray): Opcode bytes
+        low (np.ndarray): Byte after each opcode
+        high (np.ndarray): Second byte after each opcode
+
+    Returns:
+        np.ndarray: uint16 operands; 0 for instructions without one
+    '''
+    size = ARG_SIZE[opcodes]
+    low = np.asarray(low, dtype=np.uint16)
+    value = np.where(size == 2, low | (np.asarray(high, dtype=np.uint16) << 8), low)
+    return np.where(size == 0, 0, value).astype(np.uint16)
+
+def branch_targets(pcs: np.ndarray, opcodes: np.ndarray, operands: np.ndarray) -> np.ndarray:
+    '''
+    Destinations of relative branches (including BBR/BBS), as uint16; -1 for other instructions.
+    '''
+    pcs = np.asarray(pcs, dtype=np.int32)
+    operands = np.asarray(operands, dtype=np.int32)
+    mode = MODE[opcodes]
+    offset = np.where(mode == AM_ZP_ABS, operands >> 8, operands & 0xff)
+    offset = offset - ((offset & 0x80) << 1)        # Sign extend
+    target = (pcs + 1 + ARG_SIZE[opcodes] + offset) & 0xffff
+    return np.where((mode == AM_BRANCH) | (mode == AM_ZP_ABS), target, -1)
+
+def format_instruction(pc: int, opcode: int, operand: int) -> str:
+    '''Disassemble one instruction.'''
+    mnemonic, mode, _ = OPCODES[opcode]
+    if mode == AM_BRANCH or mode == AM_ZP_ABS:
+        target = int(branch_targets(np.array([pc]), np.array([opcode]), np.array([operand]))[0])
+        if mode == AM_ZP_ABS:
+            return MODE_FORMATS[mode].format(mnemonic, operand & 0xff, target)
+        return MODE_FORMATS[mode].format(mnemonic, target)
+    return MODE_FORMATS[mode].format(mnemonic, operand)
+
+def disassemble(pcs: Sequence[int], opcodes: Sequence[int], operands: Sequence[int]) -> list:
+    '''Disassemble columns of instructions into strings.'''
+    return [format_instruction(int(pc), int(opcode), int(operand))
+            for pc, opcode, operand in zip(pcs, opcodes, operands)]
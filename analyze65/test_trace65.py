@@ -0,0 +1,75 @@
+'''
+Parsing analyze65 output into a trace and querying it.
+
+Run with `python -m pytest` from this folder.
+'''
+import os
+
+import numpy as np
+import pytest
+
+from trace65 import FLAG_IRQ, INDEX_DIR, Trace, TraceWriter, parse_log
+
+# LDA #$42 / STA $D000 / BNE $0200 at $0200, one bus cycle per entry: (address, data, pins)
+LOOP = [
+    (0x0200, 0xa9, ',  Sync'), (0x0201, 0x42, ''),
+    (0x0202, 0x8d, ',  Sync'), (0x0203, 0x00, ''), (0x0204, 0xd0, ''), (0xd000, 0x42, ',  Write'),
+    (0x0205, 0xd0, ',  Sync'), (0x0206, 0xf9, ''), (0x0207, 0xa9, ''),
+]
+
+def bus_line(address: int, data: int, pins: str) -> bytes:
+    return f'. $({address:04x}) : {data:02x}{pins}\r\n'.encode('ascii')
+
+@pytest.fixture
+def trace(tmp_path):
+    path = str(tmp_path / 'loop.trace')
+    log = b'ready\r\n* Sync\r\n'
+    for _ in range(3):
+        log += b''.join(bus_line(*cycle) for cycle in LOOP)
+    log += bus_line(0xfffe, 0x00, ',  VectorPull, *IRQ')
+    # Feed in uneven pieces, so lines are split between calls
+    parser = parse_log((log[start:start + 7] for start in range(0, len(log), 7)), path)
+    assert parser.records == 3 * len(LOOP) + 1
+    assert list(parser.messages) == ['ready']
+    return Trace(path)
+
+def test_columns(trace):
+    assert len(trace) == 3 * len(LOOP) + 1
+    assert trace.address[:3].tolist() == [0x0200, 0x0201, 0x0202]
+    assert trace.rwb[5] == 0 and trace.rwb[4] == 1
+    assert trace.flags[-1] & FLAG_IRQ
+
+def test_instructions(trace):
+    assert trace.pcs.tolist() == [0x0200, 0x0202, 0x0205] * 3
+    assert trace.operands[:3].tolist() == [0x42, 0xd000, 0xf9]
+    assert trace.branch_targets()[2] == 0x0200
+    assert trace.instructions('sta').tolist() == [2, 11, 20]
+    assert trace.instructions(0xa9).tolist() == [0, 9, 18]
+    lines = trace.disassemble(0, 9)
+    assert len(lines) == 3 and '$0202' in lines[1]
+
+def test_queries_and_saved_indexes(trace):
+    assert trace.accesses(0xd000, write=True).tolist() == [5, 14, 23]
+    assert trace.accesses(0x0200, 0x0201).tolist() == [0, 1, 9, 10, 18, 19]
+    assert trace.executions(0x0205).tolist() == [6, 15, 24]
+    assert dict(trace.pc_histogram(5)) == {0x0200: 3, 0x0202: 3, 0x0205: 3}
+    assert os.listdir(os.path.join(trace.path, INDEX_DIR))
+    reopened = Trace(trace.path)
+    assert isinstance(reopened.fetches, np.memmap)
+    assert reopened.accesses(0xd000).tolist() == [5, 14, 23]
+
+def test_log_mode_keeps_one_phase(tmp_path):
+    path = str(tmp_path / 'log.trace')
+    lines = [bus_line(0x0200, 0xa9, ',  Sync, -Clock'), bus_line(0x0200, 0xa9, ',  Sync, +Clock'),
+             bus_line(0xd000, 0x42, ',  Write, -Clock'), bus_line(0xd000, 0x42, ',  Write, +Clock')]
+    parser = parse_log(lines, path)
+    assert (parser.records, parser.skipped) == (2, 2)
+    assert Trace(path).rwb.tolist() == [1, 0]
+
+def test_writer_appends(tmp_path):
+    path = str(tmp_path / 'append.trace')
+    with TraceWriter(path) as writer:
+        writer.append(1, 2, 1, 0, 0)
+    with TraceWriter(path) as writer:
+        writer.append(3, 4, 0, 0, 0)
+    assert Trace(path).address.tolist() == [1, 3]
@@ -0,0 +1,425 @@
+'''
+Capture and analysis of analyze65 bus traces.
+
+analyze65.ino prints one line per bus cycle, `. $(addr) : data` followed by the active
+input pins (`Write`, `VectorPull`, `Sync`) and the output pins it drives active (`*Reset`,
+`*IRQ`, `*NMI`, `*Bus Enable`). A `TraceParser` turns that text, fed in arbitrary pieces
+from the serial port or a recorded log, into records for a `TraceWriter`, which appends them
+to a trace directory with one raw file per column:
+
+    address.u16     Address bus
+    data.u8         Data bus
+    rwb.u8          RWB pin: 1 read, 0 write
+    sync.u8         SYNC pin: 1 on opcode fetches
+    flags.u8        FLAG_* bits for the other pins
+
+A `Trace` memory-maps those columns. Instructions are decoded from them in one vectorized
+pass (opcode fetches are the SYNC cycles, operands the cycles right after), and indexes by
+address, by PC and by opcode are built on first use and saved next to the columns, so
+queries over millions of cycles are array slices.
+
+With `bus.log` set, the sketch prints both clock phases of every cycle; the parser keeps the
+phase the default mode would print (reads with the clock low, writes with it high), so a
+trace holds one record per cycle either way. The `* Sync` and `->` lines the sketch adds are
+redundant with the columns and are skipped.
+
+Example:
+    capture('/dev/ttyACM0', 'boot.trace', cycles=1_000_000)
+    trace = Trace('boot.trace')
+    writes = trace.accesses(0xd000, 0xd0ff, write=True)
+    for pc, count in trace.pc_histogram(10):
+        print(f'${pc:04x} {count}')
+'''
+import json
+import os
+import re
+from array import array
+from collections import deque
+from typing import Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from dis65c02 import branch_targets, disassemble, opcodes_for, operand_values
+
+COLUMNS = (
+    ('address', np.uint16, 'H'),
+    ('data', np.uint8, 'B'),
+    ('rwb', np.uint8, 'B'),
+    ('sync', np.uint8, 'B'),
+    ('flags', np.uint8, 'B'),
+)
+
+FLAG_VECTOR_PULL = 0x01
+FLAG_RESET = 0x02
+FLAG_IRQ = 0x04
+FLAG_NMI = 0x08
+FLAG_BUS_DISABLED = 0x10
+
+# Pin markers in a bus line and the flag each one sets
+_PIN_FLAGS = (
+    (b',  VectorPull', FLAG_VECTOR_PULL),
+    (b'*Reset', FLAG_RESET),
+    (b'*IRQ', FLAG_IRQ),
+    (b'*NMI', FLAG_NMI),
+    (b'*Bus Enable', FLAG_BUS_DISABLED),
+)
+
+_BUS_LINE = re.compile(rb'\. \$\(([0-9a-fA-F]{4})\) : ([0-9a-fA-F]{2})(.*)')
+
+META_FILE = 'meta.json'
+INDEX_DIR = 'index'
+
+def _column_path(path: str, name: str, dtype) -> str:
+    return os.path.join(path, f'{name}.u{np.dtype(dtype).itemsize * 8}')
+
+class TraceWriter(object):
+    '''
+    Appends records to a trace directory, creating it if needed.
+
+    Args:
+        path (str): Trace directory
+        buffer (int): Records kept in memory between writes to the column files
+    '''
+
+    def __init__(self, path: str, buffer: int = 65536):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.buffer = buffer
+        self.count = Trace.stored_count(path)
+        self._files = []
+        for name, dtype, _ in COLUMNS:
+            column = _column_path(path, name, dtype)
+            f = open(column, 'ab')
+            # Drop records past the count in the metadata (an interrupted write)
+            f.truncate(self.count * np.dtype(dtype).itemsize)
+            self._files.append(f)
+        self._columns = [array(code) for _, _, code in COLUMNS]
+
+    def append(self, address: int, data: int, rwb: int, sync: int, flags: int) -> None:
+        for column, value in zip(self._columns, (address, data, rwb, sync, flags)):
+            column.append(value)
+        if len(self._columns[0]) >= self.buffer:
+            self.flush()
+
+    def flush(self) -> None:
+        '''Write the buffered records and update the record count.'''
+        added = len(self._columns[0])
+        if added:
+            for f, column in zip(self._files, self._columns):
+                column.tofile(f)
+                f.flush()
+                del column[:]
+            self.count += added
+        with open(os.path.join(self.path, META_FILE), 'w') as f:
+            json.dump({'count': self.count}, f)
+
+    def close(self) -> None:
+        self.flush()
+        for f in self._files:
+            f.close()
+        self._files = []
+
+    def __enter__(self) -> 'TraceWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+class TraceParser(object):
+    '''
+    Incremental parser for analyze65 serial output.
+
+    Args:
+        writer: Receives each bus cycle through `append(address, data, rwb, sync, flags)`
+        history (int): Number of non-bus lines (command echoes, status messages) kept in `messages`
+
+    Attributes:
+        records (int): Bus cycles passed to the writer
+        skipped (int): Bus lines dropped: the second clock phase of `bus.log` output
+        messages (deque): The most recent other lines, decoded
+    '''
+
+    def __init__(self, writer, history: int = 100):
+        self.writer = writer
+        self.records = 0
+        self.skipped = 0
+        self.messages = deque(maxlen=history)
+        self._partial = b''
+
+    def feed(self, data: bytes) -> int:
+        '''
+        Parse a piece of output; an incomplete last line is kept for the next call.
+
+        Returns:
+            int: Number of records produced
+        '''
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        before = self.records
+        for line in lines:
+            self.parse_line(line)
+        return self.records - before
+
+    def finish(self) -> None:
+        '''Parse a last line that had no newline.'''
+        if self._partial:
+            line, self._partial = self._partial, b''
+            self.parse_line(line)
+
+    def parse_line(self, line: bytes) -> None:
+        line = line.rstrip(b'\r')
+        match = _BUS_LINE.match(line)
+        if match is None:
+            text = line.strip()
+            if text and not text.startswith((b'* Sync', b'->')):
+                self.messages.append(text.decode('ascii', 'replace'))
+            return
+        rest = match.group(3)
+        write = b',  Write' in rest
+        if b', +Clock' in rest:
+            keep = write            # Clock high: only writes are valid
+        elif b', -Clock' in rest:
+            keep = not write        # Clock low: only reads are valid
+        else:
+            keep = True
+        if not keep:
+            self.skipped += 1
+            return
+        flags = 0
+        for marker, flag in _PIN_FLAGS:
+            if marker in rest:
+                flags |= flag
+        self.writer.append(int(match.group(1), 16), int(match.group(2), 16), 0 if write else 1,
+                           1 if b',  Sync' in rest else 0, flags)
+        self.records += 1
+
+def parse_log(lines: Union[str, Iterable[bytes]], path: str) -> TraceParser:
+    '''
+    Parse a recorded log into a trace directory, appending to it.
+
+    Args:
+        lines: Log file name, or an iterable of chunks or lines of bytes (with their newlines)
+        path (str): Trace directory
+
+    Returns:
+        TraceParser: The parser, for its counters and messages
+    '''
+    with TraceWriter(path) as writer:
+        parser = TraceParser(writer)
+        if isinstance(lines, str):
+            with open(lines, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    parser.feed(chunk)
+        else:
+            for chunk in lines:
+                parser.feed(chunk)
+        parser.finish()
+    return parser
+
+def capture(port, path: str, cycles: int, setup: Iterable[str] = ('bus.log=0',), step: int = 16000,
+            baudrate: int = 115200, timeout: float = 2.0) -> TraceParser:
+    '''
+    Step the CPU through analyze65 and record the bus cycles into a trace directory.
+
+    Args:
+        port: Serial device name (opened with pyserial), or an open object with `read(n)`,
+            `write(data)` and `in_waiting`
+        path (str): Trace directory, appended to
+        cycles (int): Number of cycles to record
+        setup: Commands sent first, e.g. to reset the CPU
+        step (int): Cycles requested per `step` command; the sketch's counter is 16 bits
+            of half cycles, so at most 32767
+        baudrate (int): Baud rate when opening `port` by name
+        timeout (float): Seconds without output after which the capture stops early
+
+    Returns:
+        TraceParser: The parser, for its counters and messages
+    '''
+    if isinstance(port, str):
+        import serial
+        port = serial.Serial(port, baudrate, timeout=timeout)
+    with TraceWriter(path) as writer:
+        parser = TraceParser(writer)
+        for command in setup:
+            port.write(command.encode('ascii') + b'\n')
+        while parser.records < cycles:
+            goal = parser.records + min(step, cycles - parser.records)
+            port.write(b'step=%d\n' % (goal - parser.records))
+            while parser.records < goal:
+                data = port.read(max(1, port.in_waiting))
+                if not data:
+                    break
+                parser.feed(data)
+            else:
+                continue
+            break       # Timed out
+        parser.finish()
+    return parser
+
+class Trace(object):
+    '''
+    A recorded trace, memory-mapped.
+
+    Args:
+        path (str): Trace directory
+
+    Attributes:
+        address, data, rwb, sync, flags (np.ndarray): The columns, one entry per cycle
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = self.stored_count(path)
+        for name, dtype, _ in COLUMNS:
+            if self.count:
+                column = np.memmap(_column_path(path, name, dtype), dtype=dtype, mode='r', shape=(self.count,))
+            else:
+                column = np.zeros(0, dtype=dtype)
+            setattr(self, name, column)
+        self._indexes = {}
+
+    @staticmethod
+    def stored_count(path: str) -> int:
+        '''Number of records in a trace directory, 0 if there is none.'''
+        try:
+            with open(os.path.join(path, META_FILE)) as f:
+                return json.load(f)['count']
+        except FileNotFoundError:
+            return 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _index(self, name: str, build) -> np.ndarray:
+        '''Load an index saved for the current record count, or build and save it.'''
+        index = self._indexes.get(name)
+        if index is not None:
+            return index
+        directory = os.path.join(self.path, INDEX_DIR)
+        file = os.path.join(directory, f'{name}.{self.count}.npy')
+        if os.path.exists(file):
+            index = np.load(file, mmap_mode='r')
+        else:
+            index = build()
+            os.makedirs(directory, exist_ok=True)
+            for old in os.listdir(directory):
+                if old.startswith(name + '.'):
+                    os.remove(os.path.join(directory, old))
+            np.save(file, index)
+        self._indexes[name] = index
+        return index
+
+    def _groups(self, name: str, keys, size: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Index of positions grouped by key (CSR layout): the positions sorted by key, and where
+        each of the `size` keys' group starts in that order.
+        '''
+        built = []
+        def build(part):
+            if not built:
+                values = keys()
+                built.append(np.argsort(values, kind='stable').astype(np.uint32))
+                starts = np.zeros(size + 1, dtype=np.int64)
+                np.cumsum(np.bincount(values, minlength=size), out=starts[1:])
+                built.append(starts)
+            return built[part]
+        return self._index(f'{name}_order', lambda: build(0)), self._index(f'{name}_starts', lambda: build(1))
+
+    # Instructions
+
+    @property
+    def fetches(self) -> np.ndarray:
+        '''Cycle numbers of the opcode fetches (SYNC cycles).'''
+        return self._index('fetches', lambda: np.flatnonzero(self.sync).astype(np.uint32))
+
+    @property
+    def pcs(self) -> np.ndarray:
+        '''Address of each instruction, in the order of `fetches`.'''
+        if 'pcs' not in self._indexes:
+            self._indexes['pcs'] = np.asarray(self.address[self.fetches])
+        return self._indexes['pcs']
+
+    @property
+    def opcodes(self) -> np.ndarray:
+        if 'opcodes' not in self._indexes:
+            self._indexes['opcodes'] = np.asarray(self.data[self.fetches])
+        return self._indexes['opcodes']
+
+    @property
+    def operands(self) -> np.ndarray:
+        '''Operand of each instruction, from the one or two cycles after its fetch.'''
+        last = max(self.count - 1, 0)
+        fetches = self.fetches.astype(np.int64)
+        low = self.data[np.minimum(fetches + 1, last)]
+        high = self.data[np.minimum(fetches + 2, last)]
+        return operand_values(self.opcodes, low, high)
+
+    def disassemble(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        '''
+        Disassembly of the instructions fetched in cycles [start, stop), one line each:
+        cycle number, PC and instruction, with branch targets resolved.
+        '''
+        fetches = self.fetches
+        first, last = np.searchsorted(fetches, [start, self.count if stop is None else stop])
+        pcs = self.pcs[first:last]
+        lines = disassemble(pcs, self.opcodes[first:last], self.operands[first:last])
+        return [f'{cycle:>10}  ${pc:04x}  {text}' for cycle, pc, text in zip(fetches[first:last], pcs, lines)]
+
+    def branch_targets(self) -> np.ndarray:
+        '''Destination of each instruction that is a relative branch, -1 for the others.'''
+        return branch_targets(self.pcs, self.opcodes, self.operands)
+
+    # Queries
+
+    def accesses(self, low: int, high: Optional[int] = None, write: Optional[bool] = None) -> np.ndarray:
+        '''
+        Cycles that accessed addresses `low` to `high` (inclusive), in order.
+
+        Args:
+            low (int): First address
+            high (int): Last address. Default: `low`
+            write (bool): Only writes if True, only reads if False
+
+        Example:
+            trace.accesses(0xd000, 0xd0ff, write=True)
+        '''
+        high = low if high is None else high
+        order, starts = self._groups('address', lambda: self.address, 0x10000)
+        cycles = np.sort(order[starts[low]:starts[high + 1]])
+        if write is not None:
+            cycles = cycles[self.rwb[cycles] == (0 if write else 1)]
+        return cycles
+
+    def executions(self, pc: int) -> np.ndarray:
+        '''Cycles in which the instruction at `pc` was fetched, in order.'''
+        order, starts = self._groups('pc', lambda: self.pcs, 0x10000)
+        return self.fetches[np.sort(order[starts[pc]:starts[pc + 1]])]
+
+    def instructions(self, opcode: Union[int, str]) -> np.ndarray:
+        '''
+        Cycles in which an instruction with the given opcode was fetched, in order.
+
+        Args:
+            opcode: Opcode byte, or a mnemonic such as 'sta' for all its addressing modes
+        '''
+        order, starts = self._groups('opcode', lambda: self.opcodes, 0x100)
+        if isinstance(opcode, str):
+            opcodes = opcodes_for(opcode)
+        else:
+            opcodes = [opcode]
+        parts = [order[starts[op]:starts[op + 1]] for op in opcodes]
+        return self.fetches[np.sort(np.concatenate(parts))]
+
+    def pc_counts(self) -> np.ndarray:
+        '''Number of times each of the 65536 addresses was fetched as an instruction.'''
+        return self._index('pc_counts', lambda: np.bincount(self.pcs, minlength=0x10000).astype(np.uint32))
+
+    def pc_histogram(self, top: int = 20) -> List[Tuple[int, int]]:
+        '''The `top` most executed instruction addresses, as (pc, count), most frequent first.'''
+        counts = self.pc_counts()
+        top = min(top, int(np.count_nonzero(counts)))
+        if top <= 0:
+            return []
+        best = np.argpartition(counts, -top)[-top:]
+        best = best[np.argsort(counts[best], kind='stable')[::-1]]
+        return [(int(pc), int(counts[pc])) for pc in best]
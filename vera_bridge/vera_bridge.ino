@@ -0,0 +1,268 @@
+/*
+
+Serial bridge to the VERA register bus, for vypera/vera_serial.py.
+The protocol is specified there; vypera/vera_sim.py (SimSerialBridge) is a
+byte-for-byte software model of this sketch.
+
+Arduino Mega 2560. The VERA bus uses two whole ports, laid out like the
+MCP23017 port B of vypera/vera_intf.py:
+
+Port  Bit   Mega pin  VERA
+PA    0-7   22-29     D0-D7
+PC    0-4   37-33     A0-A4 (register index)
+PC    5     32        RE#
+PC    6     31        WE#
+PC    7     30        CS#
+
+ */
+
+#define BAUD_RATE 1000000
+
+#define SYNC_REQUEST 0xA5
+#define SYNC_RESPONSE 0x5A
+#define PROTOCOL_VERSION 2
+
+#define OP_PING 0x00
+#define OP_WRITE 0x01
+#define OP_READ 0x02
+#define OP_STREAM 0x03
+#define OP_FILL 0x04
+#define OP_READ_STREAM 0x05
+#define OP_EXCHANGE 0x06
+
+#define STATUS_OK 0
+#define STATUS_BAD_CRC 1
+#define STATUS_BAD_OPCODE 2
+#define STATUS_BAD_LENGTH 3
+
+#define MAX_PAYLOAD 512
+#define RX_WINDOW 1024      // Must be a power of two
+
+#define CS_N (1 << 7)
+#define WE_N (1 << 6)
+#define RE_N (1 << 5)
+#define IDLE (CS_N | WE_N | RE_N)
+
+#define VERA_SPI_DATA 0x1E
+#define VERA_SPI_CTRL 0x1F
+#define SPI_BUSY 0x80
+
+// Serial data is moved from the 64 byte hardware buffer into this ring whenever the
+// sketch is waiting or busy, so the host can keep RX_WINDOW bytes of requests in flight.
+byte rxRing[RX_WINDOW];
+uint16_t rxHead = 0;
+uint16_t rxTail = 0;
+
+byte payload[MAX_PAYLOAD];
+
+inline void pump() {
+  while (Serial.available() && ((rxHead + 1) & (RX_WINDOW - 1)) != rxTail) {
+    rxRing[rxHead] = Serial.read();
+    rxHead = (rxHead + 1) & (RX_WINDOW - 1);
+  }
+}
+
+byte nextByte() {
+  while (rxHead == rxTail) {
+    pump();
+  }
+  byte b = rxRing[rxTail];
+  rxTail = (rxTail + 1) & (RX_WINDOW - 1);
+  return b;
+}
+
+// CRC-16/CCITT-FALSE
+uint16_t crcUpdate(uint16_t crc, byte b) {
+  crc ^= ((uint16_t)b) << 8;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+  }
+  return crc;
+}
+
+// Responses are written a byte at a time, draining the receive side in between
+uint16_t sendByte(byte b, uint16_t crc) {
+  Serial.write(b);
+  pump();
+  return crcUpdate(crc, b);
+}
+
+uint16_t sendHeader(byte seq, byte status, uint16_t length) {
+  Serial.write(SYNC_RESPONSE);
+  uint16_t crc = 0xFFFF;
+  crc = sendByte(seq, crc);
+  crc = sendByte(status, crc);
+  crc = sendByte(length & 0xFF, crc);
+  crc = sendByte(length >> 8, crc);
+  return crc;
+}
+
+void sendCrc(uint16_t crc) {
+  Serial.write(crc & 0xFF);
+  Serial.write(crc >> 8);
+}
+
+void sendStatus(byte seq, byte status) {
+  sendCrc(sendHeader(seq, status, 0));
+}
+
+inline void veraWrite(byte reg, byte value) {
+  DDRA = 0xFF;
+  PORTA = value;
+  PORTC = RE_N | reg;   // Assert CS# and WE#
+  PORTC = IDLE | reg;   // Data is sampled on the rising edge
+}
+
+inline byte veraRead(byte reg) {
+  DDRA = 0x00;
+  PORTC = WE_N | reg;   // Assert CS# and RE#
+  __asm__ __volatile__ ("nop\n\tnop\n\tnop\n\tnop\n\t");
+  byte value = PINA;
+  PORTC = IDLE | reg;
+  return value;
+}
+
+// An SPI byte takes about 20 us at VERA's slow clock, while bus writes here are about
+// 1 us apart: every access to SPI_DATA first waits for the transfer in progress.
+inline void spiWait(byte reg) {
+  if (reg == VERA_SPI_DATA) {
+    while (veraRead(VERA_SPI_CTRL) & SPI_BUSY) {
+      pump();
+    }
+  }
+}
+
+void execute(byte seq, byte op, uint16_t length) {
+  switch (op) {
+    case OP_PING:
+    {
+      if (length != 0) break;
+      uint16_t crc = sendHeader(seq, STATUS_OK, 1);
+      sendCrc(sendByte(PROTOCOL_VERSION, crc));
+      return;
+    }
+
+    case OP_WRITE:
+      if (length & 1) break;
+      for (uint16_t i = 0; i < length; i += 2) {
+        byte reg = payload[i] & 0x1F;
+        spiWait(reg);
+        veraWrite(reg, payload[i + 1]);
+      }
+      sendStatus(seq, STATUS_OK);
+      return;
+
+    case OP_READ:
+    {
+      if (length != 1) break;
+      byte reg = payload[0] & 0x1F;
+      spiWait(reg);
+      uint16_t crc = sendHeader(seq, STATUS_OK, 1);
+      sendCrc(sendByte(veraRead(reg), crc));
+      return;
+    }
+
+    case OP_STREAM:
+    {
+      if (length < 1) break;
+      byte reg = payload[0] & 0x1F;
+      for (uint16_t i = 1; i < length; i++) {
+        spiWait(reg);
+        veraWrite(reg, payload[i]);
+        if ((i & 0x0F) == 0) pump();
+      }
+      sendStatus(seq, STATUS_OK);
+      return;
+    }
+
+    case OP_FILL:
+    {
+      if (length != 6) break;
+      byte reg = payload[0] & 0x1F;
+      uint32_t count = payload[2] | ((uint32_t)payload[3] << 8) | ((uint32_t)payload[4] << 16) | ((uint32_t)payload[5] << 24);
+      for (uint32_t i = 0; i < count; i++) {
+        spiWait(reg);
+        veraWrite(reg, payload[1]);
+        if ((i & 0x0F) == 0) pump();
+      }
+      sendStatus(seq, STATUS_OK);
+      return;
+    }
+
+    case OP_READ_STREAM:
+    {
+      if (length != 3) break;
+      byte reg = payload[0] & 0x1F;
+      uint16_t count = payload[1] | ((uint16_t)payload[2] << 8);
+      uint16_t crc = sendHeader(seq, STATUS_OK, count);
+      for (uint16_t i = 0; i < count; i++) {
+        spiWait(reg);
+        crc = sendByte(veraRead(reg), crc);
+      }
+      sendCrc(crc);
+      return;
+    }
+
+    case OP_EXCHANGE:
+    {
+      if (length != 4) break;
+      byte reg = payload[0] & 0x1F;
+      uint16_t count = payload[2] | ((uint16_t)payload[3] << 8);
+      uint16_t crc = sendHeader(seq, STATUS_OK, count);
+      for (uint16_t i = 0; i < count; i++) {
+        spiWait(reg);
+        veraWrite(reg, payload[1]);
+        spiWait(reg);
+        crc = sendByte(veraRead(reg), crc);
+      }
+      sendCrc(crc);
+      return;
+    }
+
+    default:
+      sendStatus(seq, STATUS_BAD_OPCODE);
+      return;
+  }
+  sendStatus(seq, STATUS_BAD_LENGTH);
+}
+
+void setup() {
+  PORTC = IDLE;
+  DDRC = 0xFF;
+  DDRA = 0x00;
+  Serial.begin(BAUD_RATE);
+}
+
+void loop() {
+  // Hunt for the start of a request
+  if (nextByte() != SYNC_REQUEST) return;
+
+  uint16_t crc = 0xFFFF;
+  byte seq = nextByte();
+  crc = crcUpdate(crc, seq);
+  byte op = nextByte();
+  crc = crcUpdate(crc, op);
+  byte lengthLow = nextByte();
+  crc = crcUpdate(crc, lengthLow);
+  byte lengthHigh = nextByte();
+  crc = crcUpdate(crc, lengthHigh);
+  uint16_t length = lengthLow | ((uint16_t)lengthHigh << 8);
+
+  if (length > MAX_PAYLOAD) {
+    sendStatus(seq, STATUS_BAD_LENGTH);
+    return;
+  }
+
+  for (uint16_t i = 0; i < length; i++) {
+    payload[i] = nextByte();
+    crc = crcUpdate(crc, payload[i]);
+  }
+  uint16_t received = nextByte();
+  received |= ((uint16_t)nextByte()) << 8;
+
+  if (received != crc) {
+    sendStatus(seq, STATUS_BAD_CRC);
+    return;
+  }
+  execute(seq, op, length);
+}
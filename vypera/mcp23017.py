@@ -1,4 +1,3 @@
-import smbus
 from enum import Enum
 
 class MCP23017(object):
@@ -30,12 +29,36 @@ class MCP23017(object):
     OLAT_A      = 0x14          # Provides access to the port A output latches.
     OLAT_B      = 0x15          # Provides access to the port B output latches.
 
-    def __init__(self, address: int, bus: int):
+    # IOCON.SEQOP=1 with IOCON.BANK=0: the address pointer does not increment, it toggles
+    # between the A/B register pair on each byte of a block transfer.
+    IOCON_BYTE_MODE = 0b00100000
+    IOCON_BANK = 0b10000000
+
+    # With IOCON.BANK=1 the registers of each port are grouped: port A at 0x00-0x0A, port B
+    # at 0x10-0x1A. With SEQOP=1 as well, the address pointer stays on one register.
+    BANK1_IOCON = 0x05
+    BANK1_GPIO_B = 0x19
+
+    def __init__(self, address: int, bus, block_limit: int = 32):
+        '''
+        Args:
+            address (int): I2C address of the MCP23017
+            bus: I2C bus number, or an already open SMBus-compatible object (smbus2, or
+                `vera_sim.SimSMBus` to run without hardware)
+            block_limit (int): Maximum data bytes per block write. 32 is the SMBus limit; adapters
+                driven through smbus2's I2C_RDWR support much larger transfers. Must be even.
+        '''
+        if block_limit < 2 or block_limit & 1:
+            raise ValueError(block_limit)
+        if isinstance(bus, int):
+            import smbus
+            bus = smbus.SMBus(bus)
         self.address = address
-        self.bus = smbus.SMBus(bus)
+        self.bus = bus
+        self.block_limit = block_limit
         
     def init(self):
-        self.write_register(self.IOCON, 0b00100000)
+        self.write_register(self.IOCON, self.IOCON_BYTE_MODE)
         self.write_register(self.GPPU_A, 0xff)
         self.write_register(self.GPPU_B, 0xff)
     
@@ -58,3 +81,64 @@ class MCP23017(object):
     
     def read_register(self, register: int) -> int:
         return self.bus.read_byte_data(self.address, register)
+
+    def write_block(self, register: int, values) -> None:
+        '''
+        Write a run of bytes starting at `register`, one I2C transaction per `block_limit` bytes.
+        In byte mode each byte alternates between the A and B register of the pair, so
+        `values` is sent as A, B, A, B, ... when `register` is an A register. Every chunk
+        restarts at `register`, which keeps the alternation aligned because chunks are even.
+
+        Args:
+            register (int): First register of the A/B pair to write
+            values: bytes-like sequence of values
+        '''
+        limit = self.block_limit
+        view = memoryview(values).cast('B')
+        if hasattr(self.bus, 'i2c_rdwr'):
+            from smbus2 import i2c_msg
+            prefix = bytes((register,))
+            for start in range(0, len(view), limit):
+                self.bus.i2c_rdwr(i2c_msg.write(self.address, prefix + view[start:start + limit]))
+        else:
+            for start in range(0, len(view), limit):
+                self.bus.write_i2c_block_data(self.address, register, list(view[start:start + limit]))
+
+    # Messages per I2C_RDWR ioctl allowed by Linux (I2C_RDWR_IOCTL_MAX_MSGS)
+    MAX_COMBINED_MESSAGES = 42
+
+    @property
+    def supports_combined(self) -> bool:
+        '''True if the bus can run several messages as one combined transaction (smbus2's I2C_RDWR).'''
+        return hasattr(self.bus, 'i2c_rdwr')
+
+    def transfer(self, operations) -> list:
+        '''
+        Run a sequence of writes and reads as combined I2C transactions, with a repeated START
+        between messages and at most `MAX_COMBINED_MESSAGES` messages per transaction. Needs
+        `supports_combined`.
+
+        Args:
+            operations: sequence of (register, data) pairs. A bytes-like `data` is written
+                starting at `register`. An int `data` reads that many bytes starting at
+                `register`, or, if `register` is None, wherever the address pointer was left.
+
+        Returns:
+            list: The bytes of each read, in order
+        '''
+        from smbus2 import i2c_msg
+        messages = []
+        reads = []
+        for register, data in operations:
+            if isinstance(data, int):
+                if register is not None:
+                    messages.append(i2c_msg.write(self.address, bytes((register,))))
+                message = i2c_msg.read(self.address, data)
+                reads.append(message)
+            else:
+                message = i2c_msg.write(self.address, bytes((register,)) + bytes(data))
+            messages.append(message)
+        limit = self.MAX_COMBINED_MESSAGES
+        for start in range(0, len(messages), limit):
+            self.bus.i2c_rdwr(*messages[start:start + limit])
+        return [bytes(message) for message in reads]
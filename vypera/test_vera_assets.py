@@ -0,0 +1,82 @@
+'''
+Tests of the asset conversions in `vera_assets`.
+'''
+import numpy as np
+import pytest
+
+from vera_assets import MAP_HFLIP, MAP_VFLIP, AssetCache, build_tilemap, diff_runs, pack_pixels, unpack_pixels
+from vera_display import LayerState
+from vera_screenshot import render_layer
+from vera_sim import VeraSim
+from vypera import VERA
+
+def test_pack_round_trip():
+    pixels = np.random.default_rng(1).integers(0, 16, (4, 16), dtype=np.uint8)
+    packed = pack_pixels(pixels, 4)
+    assert packed.shape == (4, 8)
+    assert packed[0, 0] == pixels[0, 0] << 4 | pixels[0, 1]
+    assert np.array_equal(unpack_pixels(packed, 4), pixels)
+
+def test_tilemap_dedup_and_flips():
+    rng = np.random.default_rng(2)
+    tile = rng.integers(0, 16, (8, 8), dtype=np.uint8)
+    other = rng.integers(0, 16, (8, 8), dtype=np.uint8)
+    image = np.block([[tile, tile[:, ::-1], tile[::-1, :]], [other, tile[::-1, ::-1], other]])
+    tiles, tilemap = build_tilemap(image, 4)
+    assert len(tiles) == 2 * 32
+    assert tilemap[..., 0].tolist() == [[0, 0, 0], [1, 0, 1]]
+    # The stored copy may itself be a flipped variant, so check the flips relative to it
+    flips = tilemap[..., 1] & (MAP_HFLIP | MAP_VFLIP)
+    assert flips[0, 1] ^ flips[0, 0] == MAP_HFLIP
+    assert flips[0, 2] ^ flips[0, 0] == MAP_VFLIP
+    assert flips[1, 1] ^ flips[0, 0] == MAP_HFLIP | MAP_VFLIP
+    assert len(build_tilemap(image, 4, flips=False)[0]) == 5 * 32
+
+def test_tilemap_renders_back():
+    # Upload a converted image to the simulator and render it from VRAM again
+    rng = np.random.default_rng(3)
+    tiles = [rng.integers(0, 16, (8, 8), dtype=np.uint8) for _ in range(3)]
+    blocks = [tiles[0], tiles[1][:, ::-1], tiles[2][::-1, ::-1], tiles[0][::-1, :]]
+    image = np.block([[blocks[n % 4] for n in range(row, row + 8)] for row in range(4)])
+    tile_data, tilemap = build_tilemap(image, 4)
+    sim = VeraSim()
+    vera = VERA(sim)
+    vera.write_vram(0x4000, tile_data.tobytes())
+    for row in range(tilemap.shape[0]):
+        vera.write_vram(row * 64, tilemap[row].tobytes())
+    layer = LayerState(bpp=4, map_base=0, tile_base=0x4000)
+    rendered = render_layer(np.frombuffer(bytes(sim.vram), dtype=np.uint8), layer.registers(), 64, 32)
+    assert np.array_equal(rendered, image)
+
+def test_diff_runs():
+    old = np.zeros(32, dtype=np.uint8)
+    new = old.copy()
+    new[[2, 4, 20]] = 1
+    assert diff_runs(old, new) == [(2, 5), (20, 21)]
+    assert diff_runs(old, new, max_gap=0) == [(2, 3), (4, 5), (20, 21)]
+    assert diff_runs(old, old) == []
+
+def test_cache_hit(tmp_path):
+    cache = AssetCache(str(tmp_path))
+    image = np.random.default_rng(4).integers(0, 4, (16, 16), dtype=np.uint8)
+    tiles, tilemap = cache.build_tilemap(image, 2)
+    cached_tiles, cached_map = cache.build_tilemap(image, 2)
+    assert isinstance(cached_tiles, np.memmap)
+    assert np.array_equal(cached_tiles, tiles) and np.array_equal(cached_map, tilemap)
+
+def test_tilemap_1bpp_colours():
+    image = np.zeros((8, 16), dtype=np.uint8)
+    image[0, 8] = 1
+    tiles, tilemap = build_tilemap(image, 1, fg=5, bg=2)
+    assert tilemap[0, :, 0].tolist() == [0, 1]
+    assert tilemap[0, :, 1].tolist() == [0x25, 0x25]
+    _, tilemap = build_tilemap(image, 1, fg=200, t256c=True)
+    assert tilemap[0, :, 1].tolist() == [200, 200]
+
+def test_tilemap_1bpp_tile_limit():
+    # 257 distinct 8x8 1bpp tiles: the tile number no longer fits the first map byte
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 2, (8, 8 * 257), dtype=np.uint8)
+    with pytest.raises(ValueError):
+        build_tilemap(image, 1)
+    build_tilemap(image, 2)
@@ -0,0 +1,85 @@
+'''
+Tests of the write-behind bus and the asyncio facade, run against `VeraSim`.
+'''
+import asyncio
+
+import pytest
+
+from vera_async import AsyncVERA, WriteBehindBus, disable_write_behind, enable_write_behind
+from vera_sim import VeraSim
+from vypera import VERA, VERA_DC_BORDER, VERA_L1_CONFIG
+
+@pytest.fixture
+def avera():
+    sim = VeraSim()
+    avera = AsyncVERA(VERA(sim))
+    yield avera, sim
+    asyncio.run(avera.close())
+
+def test_read_register_fills_shadow(avera):
+    avera, sim = avera
+    sim.write_register(VERA_DC_BORDER, 0x21)
+
+    async def read_twice():
+        first = await avera.read_register(VERA_DC_BORDER)
+        reads = sim.reads
+        second = await avera.read_register(VERA_DC_BORDER)
+        return first, second, sim.reads - reads
+
+    assert asyncio.run(read_twice()) == (0x21, 0x21, 0)
+
+def test_masked_awrite_does_not_block(avera):
+    avera, sim = avera
+    sim.write_register(VERA_DC_BORDER, 0xa0)
+    avera.vera.invalidate()
+
+    def blocking_read(index):
+        raise AssertionError('blocking read on the event loop')
+
+    avera.bus.read_register = blocking_read
+
+    async def write():
+        await avera.awrite_register(VERA_DC_BORDER, 0x05, 0x0f)
+        await avera.drain()
+
+    asyncio.run(write())
+    assert sim.regs[VERA_DC_BORDER] == 0xa5
+
+class FailingSim(VeraSim):
+    '''VeraSim whose writes to one register raise.'''
+
+    def write_register(self, index: int, value: int) -> None:
+        if index == VERA_L1_CONFIG:
+            raise IOError('bus error')
+        super().write_register(index, value)
+
+def test_write_behind_order():
+    sim = VeraSim()
+    vera = VERA(sim)
+    bus = enable_write_behind(vera, maxsize=4)
+    data = bytes(range(100))
+    vera.write_vram(0x100, data)
+    for value in range(20):
+        vera.write_register(VERA_DC_BORDER, value)
+    vera.invalidate()
+    assert vera.read_register(VERA_DC_BORDER) == 19
+    assert vera.read_vram(0x100, 100) == data
+    disable_write_behind(vera)
+    assert vera.bus is sim
+    assert bus.pending == 0
+
+def test_write_behind_error_raised_once():
+    bus = WriteBehindBus(FailingSim())
+    bus.write_register(VERA_L1_CONFIG, 1)
+    with pytest.raises(IOError):
+        bus.sync()
+    bus.write_register(VERA_DC_BORDER, 2)           # The error is reported only once
+    bus.sync()
+    assert bus.bus.regs[VERA_DC_BORDER] == 2
+    bus.write_register(VERA_L1_CONFIG, 1)
+    bus.barrier().result()
+    with pytest.raises(IOError):
+        bus.write_register(VERA_DC_BORDER, 3)       # Raised by the next call on the bus
+    bus.close()
+    with pytest.raises(RuntimeError):
+        bus.write_register(VERA_DC_BORDER, 4)
@@ -0,0 +1,49 @@
+'''
+Audio conversion, and the FIFO feeder playing into the simulator.
+
+Run with `python -m pytest` from this folder.
+'''
+import time
+
+import numpy as np
+
+from vera_async import disable_write_behind
+from vera_audio import AUDIO_BASE_RATE, AudioFeeder, Resampler, encode_samples, rate_register, to_float
+from vera_sim import VeraSim
+from vypera import VERA
+
+def test_rate_register():
+    assert rate_register(AUDIO_BASE_RATE) == 128
+    assert rate_register(AUDIO_BASE_RATE / 2) == 64
+    assert rate_register(1) == 1
+
+def test_encode():
+    frames = to_float(np.array([0, 16384, -32768], dtype=np.int16), 1)
+    assert encode_samples(frames, 8, False) == bytes([0, 64, 0x81])
+    assert encode_samples(frames, 16, True)[:8] == bytes([0, 0, 0, 0, 0x00, 0x40, 0x00, 0x40])
+    assert to_float(bytes([128, 255]), 1, width=1)[:, 0].tolist() == [0.0, 127 / 128]
+
+def test_resampler_chunks_join():
+    ramp = np.arange(1000, dtype=np.float32)[:, np.newaxis]
+    resampler = Resampler(2.0, 1.0)
+    chunks = [resampler.process(ramp[start:start + 77]) for start in range(0, 1000, 77)]
+    assert np.allclose(np.concatenate(chunks)[:, 0], np.arange(0, 999, 2))
+
+def test_feeder_plays_everything():
+    source = (np.sin(np.arange(20000) / 10) * 20000).astype(np.int16)
+    sim = VeraSim()
+    vera = VERA(sim)
+    feeder = AudioFeeder(vera, source, bits=16, stereo=False)
+    feeder.start()
+    played = bytearray()
+    deadline = time.perf_counter() + 10
+    while not feeder.finished.is_set() and time.perf_counter() < deadline:
+        # Play on the I/O thread, so the FIFO is never touched by two threads at once
+        played += vera.bus.submit(sim.audio_consume, 512).result()
+        time.sleep(0.001)
+    assert feeder.wait(0)
+    feeder.stop()
+    disable_write_behind(vera)
+    assert bytes(played) == encode_samples(to_float(source, 1), 16, False)
+    assert feeder.bytes_written == 2 * len(source)
+    assert feeder.stats().refills > 1
@@ -0,0 +1,36 @@
+'''
+The bus benchmarks, run on a few of their workloads.
+
+Run with `python -m pytest` from this folder.
+'''
+import json
+
+from vera_bench import main, regressions, run, wire_time
+
+def test_run_counts_transactions():
+    results = {entry['name']: entry for entry in run(['configure_display', 'upload_1k'])}
+    assert set(results) == {'configure_display', 'upload_1k'}
+    upload = results['upload_1k']
+    assert upload['ops'] == 1024
+    assert 0 < upload['transactions'] < 1024        # Streamed in blocks, not a write per byte
+    assert upload['wire_bytes'] > 1024
+    assert upload['bus_seconds_400khz'] == wire_time(upload['transactions'], upload['wire_bytes'], 400_000)
+
+def test_regressions():
+    baseline = [{'name': 'a', 'transactions': 10, 'wire_bytes': 100}]
+    assert regressions([{'name': 'a', 'transactions': 10, 'wire_bytes': 100}], baseline) == []
+    assert regressions([{'name': 'a', 'transactions': 11, 'wire_bytes': 100}], baseline) == ['a: transactions 10 -> 11']
+    assert regressions([{'name': 'a', 'transactions': 11, 'wire_bytes': 100}], baseline, tolerance=0.2) == []
+    assert regressions([{'name': 'b', 'transactions': 99, 'wire_bytes': 999}], baseline) == []
+
+def test_main_baseline(tmp_path, capsys):
+    path = str(tmp_path / 'results.json')
+    assert main(['configure_display', '--json', path]) == 0
+    assert main(['configure_display', '--baseline', path]) == 0
+    with open(path) as f:
+        results = json.load(f)
+    results['results'][0]['transactions'] -= 1
+    with open(path, 'w') as f:
+        json.dump(results, f)
+    assert main(['configure_display', '--baseline', path]) == 1
+    assert 'REGRESSION configure_display' in capsys.readouterr().out
@@ -0,0 +1,74 @@
+'''
+Bitmap surface uploads, checked against the simulator's VRAM.
+
+Run with `python -m pytest` from this folder.
+'''
+import numpy as np
+import pytest
+
+from vera_assets import pack_pixels
+from vera_bitmap import BitmapSurface, load_font
+from vera_sim import VeraSim
+from vypera import VERA
+
+BITMAP_BASE = 0x4000
+
+def make_surface(bpp: int = 4, width: int = 320):
+    sim = VeraSim()
+    surface = BitmapSurface(VERA(sim), BITMAP_BASE, width, 100, bpp)
+    surface.commit()
+    return surface, sim
+
+def check_vram(surface: BitmapSurface, sim: VeraSim) -> None:
+    size = surface.pitch * surface.height
+    expected = pack_pixels(surface.pixels, surface.bpp).tobytes()
+    assert bytes(sim.vram[BITMAP_BASE:BITMAP_BASE + size]) == expected
+
+@pytest.mark.parametrize('bpp', [1, 2, 4, 8])
+def test_drawing_reaches_vram(bpp):
+    surface, sim = make_surface(bpp)
+    surface.fill(1)
+    surface.fill_rect(10, 10, 50, 20, 2)
+    surface.rect(-5, 40, 60, 30, 3)
+    surface.line(0, 99, 319, 0, 1)
+    surface.blit(np.arange(64, dtype=np.uint8).reshape(8, 8) & ((1 << bpp) - 1), 300, 95, key=0)
+    surface.commit()
+    check_vram(surface, sim)
+
+def test_stream_rows_and_columns():
+    surface, sim = make_surface(4)
+    surface.fill_rect(0, 0, 320, 3, 5)              # Whole rows: one stream
+    assert surface.commit() == 3 * surface.pitch
+    surface.hline(100, 50, 10, 6)                   # Part of one row
+    assert surface.commit() == 5
+    writes = sim.writes
+    surface.vline(101, 20, 60, 7)                   # One byte of many rows: a strided column
+    assert surface.commit() == 60
+    assert sim.writes - writes < 60 + 10
+    check_vram(surface, sim)
+
+def test_unchanged_pixels_not_sent():
+    surface, sim = make_surface(4)
+    surface.fill_rect(10, 10, 20, 20, 4)
+    surface.commit()
+    surface.fill_rect(10, 10, 20, 20, 4)
+    assert surface.commit() == 0
+    surface.fill_rect(10, 10, 20, 20, 0)
+    surface.pixels[50, 50] = 9                      # Changed without mark_dirty: not sent
+    surface.commit()
+    assert sim.vram[BITMAP_BASE + 50 * surface.pitch + 25] == 0
+    surface.mark_dirty(50, 50, 1, 1)
+    surface.commit()
+    check_vram(surface, sim)
+
+def test_text():
+    atlas = np.zeros((8, 16), dtype=np.uint8)
+    atlas[:, 8:] = np.eye(8, dtype=np.uint8)        # Glyph 'B' is a diagonal
+    font = load_font(atlas, first=ord('A'))
+    assert font.shape == (ord('A') + 2, 8, 8)
+    surface, sim = make_surface(8)
+    assert surface.text(4, 4, 'AB', 9, font, bg=1) == 16
+    assert surface.pixels[4:12, 4:12].tolist() == np.ones((8, 8)).tolist()
+    assert np.array_equal(surface.pixels[4:12, 12:20], np.where(np.eye(8), 9, 1))
+    surface.commit()
+    check_vram(surface, sim)
@@ -0,0 +1,71 @@
+'''
+The text console, read back from the simulator's VRAM.
+
+Run with `python -m pytest` from this folder.
+'''
+import pytest
+
+from vera_console import VeraConsole
+from vera_sim import VeraSim
+from vypera import VERA, VERA_L1_VSCROLL_L
+
+MAP_BASE = 0x1000
+
+@pytest.fixture
+def rig():
+    '''(VeraConsole with 20x5 visible cells on a 32x32 map, the VeraSim behind it)'''
+    sim = VeraSim()
+    console = VeraConsole(VERA(sim), 1, MAP_BASE, columns=20, rows=5, map_width=32, map_height=32)
+    console.commit()
+    return console, sim
+
+def screen(console: VeraConsole, sim: VeraSim):
+    '''The visible text rows, as the hardware would show them.'''
+    vscroll = sim.regs[VERA_L1_VSCROLL_L] | sim.regs[VERA_L1_VSCROLL_L + 1] << 8
+    top = vscroll // 8
+    lines = []
+    for y in range(console.rows):
+        row = MAP_BASE + ((top + y) % console.map_height) * console.pitch
+        lines.append(bytes(sim.vram[row:row + 2 * console.columns:2]).decode('latin-1').rstrip())
+    return lines
+
+def test_print_and_attributes(rig):
+    console, sim = rig
+    console.print('hello', fg=5)
+    console.write('a\tb\rA\bB')
+    console.commit()
+    assert screen(console, sim)[:2] == ['hello', 'B' + ' ' * 7 + 'b']
+    assert sim.vram[MAP_BASE + 1] == 0x65            # Background 6, foreground 5
+    assert sim.vram[MAP_BASE + console.pitch + 1] == 0x61
+
+def test_scroll_ring(rig):
+    console, sim = rig
+    lines = [f'line {n}' for n in range(23)]
+    for n, line in enumerate(lines):
+        console.print(line)
+        if n % 3 == 0:
+            console.commit()
+    console.commit()
+    assert screen(console, sim) == lines[-4:] + ['']
+
+def test_scroll_past_skips_rows(rig):
+    console, sim = rig
+    sent = console.bytes_sent
+    for n in range(200):
+        console.print(f'line {n}')
+    console.commit()
+    assert screen(console, sim) == [f'line {n}' for n in range(196, 200)] + ['']
+    assert console.bytes_sent - sent <= 2 * console.columns * console.rows
+
+def test_only_changed_span_sent(rig):
+    console, sim = rig
+    console.write_line(2, 'status: ok')
+    console.commit()
+    sent = console.bytes_sent
+    console.write_line(2, 'status: no')
+    console.commit()
+    assert console.bytes_sent - sent == 2 * 2
+    assert screen(console, sim)[2] == 'status: no'
+    console.write('x' * 45)                         # Wraps, over the status line too
+    console.commit()
+    assert screen(console, sim)[:3] == ['x' * 20, 'x' * 20, 'xxxxxs: no']
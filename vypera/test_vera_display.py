@@ -0,0 +1,37 @@
+'''
+Declarative display states applied to the simulator.
+
+Run with `python -m pytest` from this folder.
+'''
+from vera_display import DisplayState, LayerState, compile_program
+from vera_sim import VeraSim
+from vypera import VERA, VERA_CTRL, VERA_DC_BORDER, VERA_DC_HSTOP, VERA_DC_VIDEO, VERA_L1_CONFIG
+
+TEXT_MODE = DisplayState(border=4, hstop=600,
+                         layer1=LayerState(enabled=True, map_width=128, map_height=64,
+                                           map_base=0x1b000, tile_base=0x1f000))
+
+def test_apply_state():
+    sim = VeraSim()
+    vera = VERA(sim)
+    vera.apply_state(TEXT_MODE)
+    assert sim.regs[VERA_DC_VIDEO] & 0x7f == 0x21
+    assert sim.regs[VERA_DC_BORDER] == 4
+    assert sim.dc_bank1[VERA_DC_HSTOP - VERA_DC_VIDEO] == 600 >> 2
+    assert sim.regs[VERA_L1_CONFIG] == TEXT_MODE.layer1.registers()[0]
+    writes = sim.writes
+    vera.apply_state(TEXT_MODE)                     # Already in place: nothing to write
+    assert sim.writes == writes
+
+def test_program_order():
+    current = tuple(value for _, _, value in DisplayState().registers())
+    target = DisplayState(border=4, hstop=600, layer1=LayerState(enabled=False, hscroll=0x123))
+    ctrl = 0x02                                     # DCSEL 1 is selected
+    program = compile_program(target, current, ctrl)
+    assert program == (
+        (VERA_L1_CONFIG + 3, 0x23), (VERA_L1_CONFIG + 4, 0x01),
+        (VERA_DC_HSTOP, 600 >> 2),
+        (VERA_CTRL, 0x00),
+        (VERA_DC_BORDER, 4),
+    )
+    assert compile_program(target, current, ctrl) is program
@@ -0,0 +1,79 @@
+'''
+Tests of `FrameScheduler`, run against `VeraSim`.
+'''
+import pytest
+
+from vera_frame import PRIORITY_REGISTERS, PRIORITY_VRAM, FrameScheduler, IsrVsync
+from vera_sim import VeraSim
+from vypera import VERA, VERA_DC_BORDER, VERA_ISR, VERA_L1_HSCROLL_L
+
+@pytest.fixture
+def rig():
+    sim = VeraSim()
+    vera = VERA(sim)
+    return FrameScheduler(vera, vsync=object()), vera, sim
+
+def test_commit_mirror_plans_once_at_commit_time(rig):
+    frames, vera, sim = rig
+    mirror = vera.vram
+    plans = []
+    plan = mirror.plan
+    mirror.plan = lambda: plans.append(1) or plan()
+    frames.commit_mirror(mirror)
+    mirror.write(0x100, b'\x01' * 50)                # Written after scheduling
+    frames.commit()
+    assert len(plans) == 1
+    assert sim.vram[0x100:0x100 + 50] == b'\x01' * 50
+
+def test_commit_mirror_cost_follows_dirty_ranges(rig):
+    frames, vera, sim = rig
+    mirror = vera.vram
+    frames.commit_mirror(mirror)
+    mirror.write(0x100, bytes(50))
+    mirror.write(0x400, bytes(10))
+    update, = frames._pending.values()
+    assert update.cost() == 50 + 10 + 2 * mirror.SEEK_COST
+
+def test_priority_order(rig):
+    frames, vera, sim = rig
+    order = []
+    frames.schedule(lambda vera: order.append('vram'), PRIORITY_VRAM)
+    frames.schedule(lambda vera: order.append('register'), PRIORITY_REGISTERS)
+    frames.schedule(lambda vera: order.append('vram 2'), PRIORITY_VRAM)
+    stats = frames.commit()
+    assert order == ['register', 'vram', 'vram 2']
+    assert stats.committed == 3 and stats.spilled == 0
+
+def test_latest_value_replaces_pending(rig):
+    frames, vera, sim = rig
+    frames.set_scroll(1, hscroll=0x101)
+    frames.set_scroll(1, hscroll=0x202)
+    assert frames.pending == 2
+    frames.commit()
+    assert sim.regs[VERA_L1_HSCROLL_L:VERA_L1_HSCROLL_L + 2] == b'\x02\x02'
+
+def test_budget_spills_to_next_frame(rig):
+    frames, vera, sim = rig
+    frames.budget = 0.001
+    frames.seconds_per_write = 0.0001
+    frames.write_vram(0x1000, bytes(range(256)) * 2, chunk=8)
+    stats = frames.commit()
+    assert stats.committed == 1                     # The first update always goes
+    assert stats.spilled == 63
+    assert sim.vram[0x1000:0x1008] == bytes(range(8))
+    assert sim.vram[0x1008] == 0
+    while frames.pending:
+        frames.seconds_per_write = 0.0001
+        frames.commit()
+    assert sim.vram[0x1000:0x1200] == bytes(range(256)) * 2
+
+def test_isr_vsync(rig):
+    frames, vera, sim = rig
+    frames.vsync = IsrVsync(vera)
+    assert frames.run_frame(timeout=0.001) is None
+    sim.vsync()
+    frames.set_register(VERA_DC_BORDER, 9)
+    stats = frames.run_frame(timeout=0.1)
+    assert stats.committed == 1
+    assert sim.regs[VERA_DC_BORDER] == 9
+    assert not sim.read_register(VERA_ISR) & 0x01   # Acknowledged
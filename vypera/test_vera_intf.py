@@ -0,0 +1,83 @@
+'''
+Tests of the MCP23017 strobe protocol of `VeraIntf`, run against `SimSMBus`.
+'''
+import pytest
+
+from mcp23017 import MCP23017
+from vera_intf import VeraIntf
+from vera_sim import SimSdCard, SimSMBus, VeraSim
+from vera_spi import SdCard, VeraSpi
+from vypera import VERA, VERA_DATA_0, VERA_DC_BORDER, VERA_ISR
+
+@pytest.fixture(params=[False, True], ids=['smbus', 'combined'])
+def rig(request):
+    '''(VERA, SimSMBus, VeraSim) with the expander initialised.'''
+    sim = VeraSim()
+    smbus = SimSMBus(sim, combined=request.param)
+    mcp = MCP23017(0x20, smbus)
+    mcp.init()
+    return VERA(VeraIntf(mcp)), smbus, sim
+
+@pytest.mark.parametrize('count', [1, 7, 40, 1000])
+def test_fill(rig, count):
+    vera, smbus, sim = rig
+    sim.vram[0x3000 + count] = 0x11
+    vera.fill(0x3000, count, 0xc3)
+    assert sim.vram[0x3000:0x3000 + count] == b'\xc3' * count
+    assert sim.vram[0x3000 + count] == 0x11
+    # The expander is back in IOCON.BANK=0: ordinary accesses still work
+    vera.DC_BORDER = 9
+    vera.invalidate()
+    assert vera.read_register(VERA_DC_BORDER) == 9
+
+def test_long_fill_sends_strobes_only(rig):
+    vera, smbus, sim = rig
+    vera.set_address_and_increment(0, 1)
+    smbus.reset_counters()
+    vera.bus.fill(VERA_DATA_0, 0x77, 1600)
+    # Two bytes per write, 16 writes per 32-byte block, plus OLAT_A and two IOCON writes
+    assert smbus.transactions == 100 + 3
+    assert sim.vram[:1600] == b'\x77' * 1600
+
+def test_write_registers_masks_values(rig):
+    vera, smbus, sim = rig
+    vera.bus.write_registers([(VERA_DC_BORDER, 0x105)])
+    assert sim.regs[VERA_DC_BORDER] == 0x05
+
+@pytest.mark.parametrize('clock, paced', [(100_000, True), (400_000, True), (1_000_000, False), (1_700_000, False)])
+def test_spi_paced_follows_i2c_clock(clock, paced):
+    mcp = MCP23017(0x20, SimSMBus())
+    mcp.init()
+    assert VeraIntf(mcp, i2c_clock=clock).spi_paced == paced
+
+def test_fast_i2c_polls_spi_busy():
+    image = bytes(range(256)) * 16
+    sim = VeraSim(SimSdCard(image), spi_busy_accesses=2)
+    mcp = MCP23017(0x20, SimSMBus(sim))
+    mcp.init()
+    card = SdCard(VeraSpi(VERA(VeraIntf(mcp, i2c_clock=1_700_000))))
+    card.init()
+    assert card.block(2) == image[1024:1536]
+    assert sim.spi_overruns == 0
+
+def test_burst_read(rig):
+    vera, smbus, sim = rig
+    data = bytes(range(256)) * 2
+    sim.vram[0x800:0x800 + 512] = data
+    smbus.reset_counters()
+    assert vera.read_vram(0x800, 512) == data
+    # One toggle write and one GPIO_A read per byte; combined: packed into a few I2C_RDWR calls
+    combined = hasattr(smbus, 'i2c_rdwr')
+    assert smbus.transactions <= (40 if combined else 2 * 512 + 10)
+
+def test_input_direction_is_sticky(rig):
+    vera, smbus, sim = rig
+    vera.DC_BORDER = 1
+    smbus.reset_counters()
+    vera.read_register(VERA_ISR)                    # Switches port A to input
+    first = smbus.wire_bytes
+    smbus.reset_counters()
+    vera.read_register(VERA_ISR)
+    assert smbus.wire_bytes < first
+    vera.DC_BORDER = 2                              # Writes switch it back
+    assert sim.regs[VERA_DC_BORDER] == 2
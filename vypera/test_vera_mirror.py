@@ -0,0 +1,74 @@
+'''
+Tests of `VramMirror` delta commits, run against `VeraSim`.
+'''
+import pytest
+
+from vera_sim import VeraSim
+from vypera import VERA
+
+@pytest.fixture
+def rig():
+    sim = VeraSim()
+    return VERA(sim), sim
+
+def test_fresh_mirror_uploads_zeros(rig):
+    vera, sim = rig
+    vera.write_vram(0x1000, b'\xaa' * 16)
+    mirror = vera.vram
+    mirror[0x1000:0x1010] = bytes(16)               # Clear a region the mirror never saw
+    assert mirror.commit() == 16
+    assert vera.read_vram(0x1000, 16) == bytes(16)
+
+def test_committed_bytes_are_diffed(rig):
+    vera, sim = rig
+    mirror = vera.vram
+    mirror.write(0x2000, bytes(range(100)))
+    assert mirror.commit() == 100
+    mirror.write(0x2000, bytes(range(100)))
+    assert mirror.commit() == 0
+    mirror[0x2010] = 0xff
+    assert mirror.commit() == 1
+    assert sim.vram[0x2000:0x2064] == bytes(range(16)) + b'\xff' + bytes(range(17, 100))
+
+def test_fetch_makes_region_known(rig):
+    vera, sim = rig
+    sim.vram[0x3000:0x3100] = bytes(range(256))
+    mirror = vera.vram
+    mirror.fetch(0x3000, 0x100)
+    mirror.write(0x3000, bytes(range(256)))
+    assert mirror.commit() == 0
+    # Bytes just outside the fetched range are still unknown
+    mirror.write(0x2ffe, bytes(range(254, 256)) + bytes(range(2)))
+    assert mirror.commit() == 2
+
+def test_partly_known_block(rig):
+    vera, sim = rig
+    mirror = vera.vram
+    mirror.write(0x4000, b'\x01' * 8)
+    mirror.commit()
+    sim.vram[0x4008:0x4010] = b'\x55' * 8
+    mirror.write(0x4000, b'\x01' * 8 + bytes(8))   # Known and unchanged, then unknown
+    assert mirror.commit() == 8
+    assert sim.vram[0x4000:0x4010] == b'\x01' * 8 + bytes(8)
+
+def test_strided_plan(rig):
+    vera, sim = rig
+    mirror = vera.vram
+    mirror.fetch(0, 0x2000)
+    for n in range(10):
+        mirror[0x100 + 40 * n] = n + 1
+    assert mirror.plan() == [(0x100, 10, 40)]
+    assert mirror.commit() == 10
+    assert sim.vram[0x100:0x100 + 400:40] == bytes(range(1, 11))
+
+def test_adopt(rig):
+    vera, sim = rig
+    mirror = vera.vram
+    image = bytes(range(256)) * 512
+    sim.vram[:] = image
+    mirror[0] = 0x99
+    mirror.adopt(image)
+    assert mirror.dirty == []
+    assert mirror.data == image
+    mirror.write(0, image[:0x1000])
+    assert mirror.commit() == 0
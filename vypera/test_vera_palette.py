@@ -0,0 +1,47 @@
+'''
+Palette conversion and delta uploads to the simulator.
+
+Run with `python -m pytest` from this folder.
+'''
+import numpy as np
+
+from vera_palette import PALETTE_BASE, Palette, rgb_to_vera, vera_to_rgb
+from vera_sim import VeraSim
+from vypera import VERA
+
+def test_conversion():
+    assert rgb_to_vera([[255, 0, 136], [8, 9, 247]]).tolist() == [0xf08, 0x01f]
+    assert vera_to_rgb(0xf08).tolist() == [255, 0, 136]
+
+def test_commit_sends_changed_entries():
+    sim = VeraSim()
+    palette = Palette(VERA(sim))
+    palette.set_rgb([[255, 0, 136]], start=1)
+    assert palette.commit() == 256
+    assert sim.vram[PALETTE_BASE + 2:PALETTE_BASE + 4] == b'\x08\x0f'
+    palette.colors[200] = 0x123
+    assert palette.commit() == 1
+    assert sim.vram[PALETTE_BASE + 400:PALETTE_BASE + 402] == b'\x23\x01'
+    palette.colors[201] = 0x023                     # Only the low byte differs
+    assert palette.commit() == 1
+    assert palette.commit() == 0
+
+def test_fetch():
+    sim = VeraSim()
+    sim.vram[PALETTE_BASE + 20:PALETTE_BASE + 22] = b'\x34\x02'
+    palette = Palette(VERA(sim))
+    palette.fetch()
+    assert palette.colors[10] == 0x234
+    assert palette.commit() == 0
+
+def test_fade_and_cycle_tables():
+    palette = Palette(VERA(VeraSim()))
+    palette.load([0xfff, 0x800, 0x080, 0x008])
+    fade = palette.fade_table((0, 0, 0), 4, count=4)
+    assert fade.shape == (5, 4)
+    assert fade[0].tolist() == [0xfff, 0x800, 0x080, 0x008]
+    assert fade[-1].tolist() == [0, 0, 0, 0]
+    cycle = palette.cycle_table(1, 3)
+    assert cycle.tolist() == [[0x800, 0x080, 0x008], [0x080, 0x008, 0x800], [0x008, 0x800, 0x080]]
+    palette.load(cycle[1], 1)
+    assert palette.colors[:4].tolist() == [0xfff, 0x080, 0x008, 0x800]
@@ -0,0 +1,81 @@
+'''
+Pools of simulated boards behind simulated MCP23017s.
+
+Run with `python -m pytest` from this folder.
+'''
+import pytest
+
+from vera_pool import VeraPool
+from vera_sim import SimSMBus, VeraSim
+from vypera import VERA, VERA_DC_BORDER
+
+class DeadSim(VeraSim):
+    '''A board whose VERA does not answer: every register reads as 0xff.'''
+
+    def read_register(self, index: int) -> int:
+        return 0xff
+
+class SharedBus(object):
+    '''One I2C bus with several `SimSMBus` expanders on it, each at its own address.'''
+
+    def __init__(self, *expanders: SimSMBus):
+        self.expanders = {expander.address: expander for expander in expanders}
+
+    def _expander(self, address: int) -> SimSMBus:
+        if address not in self.expanders:
+            raise OSError(121, 'Remote I/O error')
+        return self.expanders[address]
+
+    def write_byte_data(self, address: int, register: int, value: int) -> None:
+        self._expander(address).write_byte_data(address, register, value)
+
+    def read_byte_data(self, address: int, register: int) -> int:
+        return self._expander(address).read_byte_data(address, register)
+
+    def write_i2c_block_data(self, address: int, register: int, values) -> None:
+        self._expander(address).write_i2c_block_data(address, register, values)
+
+@pytest.fixture
+def pool():
+    '''(VeraPool, {board name: VeraSim}): two boards on bus 1, one dead board on bus 3'''
+    sims = {'1:0x20': VeraSim(), '1:0x23': VeraSim(), '3:0x21': DeadSim()}
+    buses = {
+        1: SharedBus(SimSMBus(sims['1:0x20'], 0x20), SimSMBus(sims['1:0x23'], 0x23)),
+        3: SharedBus(SimSMBus(sims['3:0x21'], 0x21)),
+    }
+    with VeraPool.discover(buses) as pool:
+        yield pool, sims
+
+def test_discover(pool):
+    pool, sims = pool
+    assert [device.name for device in pool] == ['1:0x20', '1:0x23', '3:0x21']
+    assert [device.name for device in pool.healthy] == ['1:0x20', '1:0x23']
+    assert isinstance(pool.devices[2].error, IOError)
+
+def test_broadcast_skips_failed(pool):
+    pool, sims = pool
+    result = pool.broadcast(VERA.write_vram, 0x100, b'tiles')
+    assert result.ok
+    assert [r.device.name for r in result.results] == ['1:0x20', '1:0x23']
+    assert set(result.bus_seconds) == {1}
+    assert all(sims[name].vram[0x100:0x105] == b'tiles' for name in ('1:0x20', '1:0x23'))
+    assert sims['3:0x21'].vram[0x100:0x105] == bytes(5)
+
+def test_scatter_and_errors(pool):
+    pool, sims = pool
+    pool.clear_errors()
+    result = pool.scatter(VERA.write_register, [(VERA_DC_BORDER, 1), (VERA_DC_BORDER, 2), (VERA_DC_BORDER, 3)])
+    assert result.ok                                # Writes do not notice a dead board
+    assert [sims[name].regs[VERA_DC_BORDER] for name in ('1:0x20', '1:0x23')] == [1, 2]
+
+    def check(vera, expected):
+        vera.invalidate()
+        if vera.read_register(VERA_DC_BORDER) != expected:
+            raise IOError('mismatch')
+        return expected
+
+    result = pool.scatter(check, {device: (n + 1,) for n, device in enumerate(pool)})
+    assert result.values == {'1:0x20': 1, '1:0x23': 2}
+    assert list(result.errors) == ['3:0x21']
+    assert result.slowest_bus in (1, 3)
+    assert [device.name for device in pool.healthy] == ['1:0x20', '1:0x23']
@@ -0,0 +1,53 @@
+'''
+Rendering the simulator's display to images.
+
+Run with `python -m pytest` from this folder.
+'''
+import numpy as np
+
+from vera_palette import Palette
+from vera_screenshot import screenshot, write_ppm
+from vera_sim import VeraSim
+from vypera import VERA, VERA_L0_HSCROLL_H
+
+def make_vera():
+    sim = VeraSim()
+    vera = VERA(sim)
+    palette = Palette(vera)
+    palette.load([0x000, 0xf00, 0x0f0, 0x00f, 0xfff])
+    palette.colors[0x11] = 0xff0
+    palette.commit()
+    return vera, sim
+
+def test_tile_layer():
+    vera, sim = make_vera()
+    vera.configure_display(hscale=4, vscale=4)
+    vera.configure_layer(1, 32, 32, False, False, 1, 0x0000, 0x4000, 8, 8)
+    vera.write_vram(0x4008, b'\xff' * 8)            # Tile 1 is solid
+    vera.write_vram(0x0000, bytes([1, 0x02, 0, 0x30, 1, 0x41]))
+    vera.start_display(layer1_en=True)
+    image = screenshot(vera)
+    assert image.shape == (120, 160, 3)
+    assert image[0, 0].tolist() == [0, 255, 0]      # Tile 1 in foreground 2
+    assert image[0, 8].tolist() == [0, 0, 255]      # Tile 0 in background 3
+    assert image[0, 16].tolist() == [255, 0, 0]     # Tile 1 in foreground 1 over background 4
+
+def test_bitmap_layer_and_offset():
+    vera, sim = make_vera()
+    vera.configure_display(hscale=2, vscale=2)
+    vera.configure_layer(0, 32, 32, False, True, 4, 0, 0x8000, 8, 8)
+    vera.write_vram(0x8000, bytes([0x12, 0x34]))
+    vera.start_display(layer0_en=True)
+    image = screenshot(vera)
+    assert image.shape == (240, 320, 3)
+    assert image[0, :4].tolist() == [[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 255]]
+    vera.write_register(VERA_L0_HSCROLL_H, 1)       # Palette offset 1 in bitmap mode
+    assert screenshot(vera)[0, 0].tolist() == [255, 255, 0]
+
+def test_write_ppm(tmp_path):
+    image = np.zeros((2, 3, 3), dtype=np.uint8)
+    image[1, 2] = (1, 2, 3)
+    path = str(tmp_path / 'shot.ppm')
+    write_ppm(path, image)
+    with open(path, 'rb') as f:
+        assert f.read() == b'P6 3 2 255\n' + bytes(15) + b'\x01\x02\x03'
@@ -0,0 +1,70 @@
+'''
+Streaming a large world through a layer map in the simulator.
+
+Run with `python -m pytest` from this folder.
+'''
+import numpy as np
+import pytest
+
+from vera_scroller import TileScroller, open_world
+from vera_sim import VeraSim
+from vypera import VERA, VERA_L1_HSCROLL_L
+
+MAP_BASE = 0x2000
+BLANK = (0xee, 0x0e)
+
+@pytest.fixture
+def rig():
+    '''(TileScroller over a random 100x300-tile world, the VeraSim behind it)'''
+    world = np.random.default_rng(1).integers(0, 256, (100, 300, 2), dtype=np.uint8)
+    sim = VeraSim()
+    scroller = TileScroller(VERA(sim), 1, world, MAP_BASE, 64, 32, screen_width=320, screen_height=240,
+                            blank=BLANK)
+    return scroller, sim
+
+def check_view(scroller: TileScroller, sim: VeraSim) -> None:
+    '''Every tile the view can show is in its ring position, and the scroll registers match.'''
+    ring = np.frombuffer(bytes(sim.vram[MAP_BASE:MAP_BASE + 64 * 32 * 2]), dtype=np.uint8).reshape(32, 64, 2)
+    rows = np.arange(scroller.row, scroller.row + scroller.view_rows)
+    columns = np.arange(scroller.column, scroller.column + scroller.view_columns)
+    shown = ring[rows[:, np.newaxis] % 32, columns % 64]
+    assert np.array_equal(shown, scroller._entries(scroller.row, scroller.column, len(rows), len(columns)))
+    hscroll = sim.regs[VERA_L1_HSCROLL_L] | sim.regs[VERA_L1_HSCROLL_L + 1] << 8
+    vscroll = sim.regs[VERA_L1_HSCROLL_L + 2] | sim.regs[VERA_L1_HSCROLL_L + 3] << 8
+    assert (hscroll, vscroll) == (scroller.x % 512, scroller.y % 256)
+
+def test_scroll_wraps_ring(rig):
+    scroller, sim = rig
+    scroller.scroll_to(0, 0)
+    check_view(scroller, sim)
+    for dx, dy in [(3, 0), (9, 0), (0, 17), (-30, 5), (100, -20), (7, 7)] * 20:
+        scroller.scroll_by(dx, dy)
+        check_view(scroller, sim)
+
+def test_one_tile_costs_one_column(rig):
+    scroller, sim = rig
+    scroller.scroll_to(40, 40)
+    sent = scroller.tiles_sent
+    scroller.scroll_by(8, 0)
+    assert scroller.tiles_sent - sent == scroller.view_rows
+    scroller.scroll_by(3, 0)                        # Within the tile: only the scroll registers
+    assert scroller.tiles_sent - sent == scroller.view_rows
+
+def test_outside_world_is_blank(rig):
+    scroller, sim = rig
+    scroller.scroll_to(-16, -16)
+    check_view(scroller, sim)
+    entry = MAP_BASE + 2 * ((-1 % 32) * 64 + (-1 % 64))
+    assert tuple(sim.vram[entry:entry + 2]) == BLANK
+
+def test_map_too_small():
+    with pytest.raises(ValueError):
+        TileScroller(VERA(VeraSim()), 0, np.zeros((1, 1, 2), dtype=np.uint8), 0, 32, 32)
+
+def test_open_world(tmp_path):
+    path = str(tmp_path / 'world.npy')
+    np.save(path, np.zeros((4, 4), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        open_world(path)
+    np.save(path, np.zeros((4, 4, 2), dtype=np.uint8))
+    assert open_world(path).shape == (4, 4, 2)
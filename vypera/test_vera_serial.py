@@ -0,0 +1,94 @@
+'''
+The serial bridge protocol, against the simulated bridge.
+
+Run with `python -m pytest` from this folder.
+'''
+import pytest
+
+from vera_serial import (
+    MAX_PAYLOAD, OP_WRITE, STATUS_BAD_OPCODE, SYNC_REQUEST, SYNC_RESPONSE, SerialBridgeError, SerialBus,
+    crc16, encode_frame,
+)
+from vera_sim import SimSerialBridge, VeraSim
+from vypera import VERA, VERA_DATA_0, VERA_DC_BORDER
+
+class BridgePort(object):
+    '''Serial port whose other end is a `SimSerialBridge`; counts the reads and can corrupt replies.'''
+
+    def __init__(self, bridge: SimSerialBridge):
+        self.bridge = bridge
+        self.received = bytearray()
+        self.reads = 0
+        self.corrupt = False
+
+    def write(self, data) -> None:
+        reply = bytearray(self.bridge.feed(data))
+        if self.corrupt and reply:
+            reply[-1] ^= 0xff
+        self.received += reply
+
+    def read(self, count: int) -> bytes:
+        self.reads += 1
+        data = bytes(self.received[:count])
+        del self.received[:count]
+        return data
+
+@pytest.fixture
+def rig():
+    '''(SerialBus, BridgePort, VeraSim)'''
+    sim = VeraSim()
+    port = BridgePort(SimSerialBridge(sim))
+    return SerialBus(port), port, sim
+
+def test_crc_and_frame():
+    assert crc16(b'123456789') == 0x29b1               # CRC-16/CCITT-FALSE check value
+    frame = encode_frame(SYNC_REQUEST, 7, OP_WRITE, b'\x0c\x05')
+    assert frame[:6] == bytes((SYNC_REQUEST, 7, OP_WRITE, 2, 0, 0x0c))
+    assert int.from_bytes(frame[-2:], 'little') == crc16(frame[1:-2])
+
+def test_writes_are_pipelined(rig):
+    bus, port, sim = rig
+    for value in range(20):
+        bus.write_register(VERA_DC_BORDER, value)
+    assert port.reads == 0                          # No write waited for its reply
+    bus.sync()
+    assert sim.regs[VERA_DC_BORDER] == 19
+    assert bus.read_register(VERA_DC_BORDER) == 19
+
+def test_window_bounds_unanswered_bytes(rig):
+    bus, port, sim = rig
+    bus.window = 64
+    for value in range(50):
+        bus.write_register(VERA_DC_BORDER, value)
+        assert bus._outstanding_bytes <= 64
+    assert port.reads > 0
+
+def test_streams_split_into_frames(rig):
+    bus, port, sim = rig
+    vera = VERA(bus)
+    data = bytes(range(256)) * 5
+    vera.write_vram(0x100, data)
+    vera.fill(0x1000, 3000, 0x99)
+    assert vera.read_vram(0x100, len(data)) == data
+    assert sim.vram[0x1000:0x1000 + 3000] == b'\x99' * 3000
+    requests = bus.requests
+    bus.read_stream(VERA_DATA_0, 2 * MAX_PAYLOAD + 1)
+    assert bus.requests - requests == 3
+
+def test_rejected_request_raises(rig):
+    bus, port, sim = rig
+    bus._send(0x7f)                                 # Unknown opcode, no callback: reported later
+    bus.write_register(VERA_DC_BORDER, 1)
+    with pytest.raises(SerialBridgeError, match=f'status {STATUS_BAD_OPCODE}'):
+        bus.sync()
+    assert sim.regs[VERA_DC_BORDER] == 1            # Requests behind it were still executed
+
+def test_corrupted_response_raises(rig):
+    bus, port, sim = rig
+    port.corrupt = True
+    with pytest.raises(SerialBridgeError, match='corrupted'):
+        bus.read_register(VERA_DC_BORDER)
+
+def test_response_framing():
+    reply = SimSerialBridge(VeraSim()).feed(encode_frame(SYNC_REQUEST, 3, 0x00))
+    assert reply[0] == SYNC_RESPONSE and reply[1] == 3
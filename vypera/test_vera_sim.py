@@ -0,0 +1,176 @@
+'''
+Round trips through `VERA` against the simulator, over each bus: `VeraSim` directly, the
+MCP23017 strobe protocol (`SimSMBus`, with and without combined transactions) and the
+serial bridge protocol (`SimSerialBridge`).
+
+Run with `python -m pytest` from this folder.
+'''
+import os
+import random
+
+import pytest
+
+from mcp23017 import MCP23017
+from vera_intf import VeraIntf
+from vera_serial import PROTOCOL_VERSION, SerialBus
+from vera_sim import SimSdCard, SimSerialBridge, SimSMBus, VeraSim
+from vera_spi import SdCard, SdCardError, VeraSpi
+from vera_state import attach
+from vypera import VERA, VERA_DC_BORDER
+
+class LoopbackPort(object):
+    '''Serial port object for `SerialBus` whose other end is a `SimSerialBridge`.'''
+
+    def __init__(self, bridge: SimSerialBridge):
+        self.bridge = bridge
+        self.received = bytearray()
+
+    def write(self, data) -> None:
+        self.received += self.bridge.feed(data)
+
+    def read(self, count: int) -> bytes:
+        data = bytes(self.received[:count])
+        del self.received[:count]
+        return data
+
+def make_bus(kind: str, sim: VeraSim):
+    if kind == 'sim':
+        return sim
+    if kind == 'serial':
+        return SerialBus(LoopbackPort(SimSerialBridge(sim)))
+    mcp = MCP23017(0x20, SimSMBus(sim, combined=kind == 'i2c_combined'))
+    mcp.init()
+    return VeraIntf(mcp)
+
+@pytest.fixture(params=['sim', 'i2c', 'i2c_combined', 'serial'])
+def rig(request):
+    '''(VERA, the VeraSim behind it) for each bus.'''
+    sim = VeraSim()
+    return VERA(make_bus(request.param, sim)), sim
+
+def random_bytes(count: int, seed: int = 1) -> bytes:
+    return bytes(random.Random(seed).getrandbits(8) for _ in range(count))
+
+def test_write_read_vram(rig):
+    vera, sim = rig
+    data = random_bytes(700)
+    vera.write_vram(0x1fe00, data)
+    vera.sync()
+    assert sim.vram[0x1fe00:0x1fe00 + 512] == data[:512]
+    assert sim.vram[:188] == data[512:]             # The address wraps at 128 KB
+    assert vera.read_vram(0x1fe00, 512) == data[:512]
+    vera.write_vram(0x100, data[:30], increment=40, port=1)
+    assert vera.read_vram(0x100, 30, increment=40) == data[:30]
+    assert sim.vram[0x100:0x100 + 30 * 40:40] == data[:30]
+
+def test_register_round_trip(rig):
+    vera, sim = rig
+    vera.DC_BORDER = 7
+    vera.invalidate()
+    assert vera.read_register(VERA_DC_BORDER) == 7
+
+def test_fill(rig):
+    vera, sim = rig
+    vera.fill(0x400, 100, 0x5a, stride=2)
+    vera.fill(0x401, 100, 0xa5, stride=2, port=1)
+    vera.sync()
+    assert sim.vram[0x400:0x400 + 200] == b'\x5a\xa5' * 100
+    assert sim.vram[0x400 + 200] == 0
+    assert vera.read_vram(0x400, 4) == b'\x5a\xa5\x5a\xa5'
+
+def test_copy(rig):
+    vera, sim = rig
+    data = random_bytes(600)
+    sim.vram[0x1000:0x1000 + 600] = data
+    vera.copy(0x1000, 0x2000, 600)
+    vera.copy(0x1000, 0x1010, 600)                  # Overlapping, like memmove
+    vera.sync()
+    assert sim.vram[0x2000:0x2000 + 600] == data
+    assert sim.vram[0x1010:0x1010 + 600] == data
+
+def test_mirror_commit(rig):
+    vera, sim = rig
+    mirror = vera.vram
+    data = random_bytes(300)
+    mirror.write(0x800, data)
+    mirror[0x5000] = 0x42
+    assert mirror.commit() == 301
+    vera.sync()
+    assert sim.vram[0x800:0x800 + 300] == data
+    assert sim.vram[0x5000] == 0x42
+    mirror.write(0x800, data)                       # Unchanged: nothing to send
+    mirror[0x810] = data[0x10] ^ 0xff
+    assert mirror.commit() == 1
+    vera.sync()
+    assert sim.vram[0x810] == data[0x10] ^ 0xff
+
+def test_serial_ping():
+    bus = SerialBus(LoopbackPort(SimSerialBridge()))
+    assert bus.ping() == PROTOCOL_VERSION
+
+@pytest.mark.parametrize('kind', ['sim', 'i2c', 'i2c_combined', 'serial'])
+def test_sd_card(kind):
+    image = random_bytes(64 * 512)
+    sim = VeraSim(SimSdCard(image), spi_busy_accesses=0 if kind.startswith('i2c') else 4)
+    card = SdCard(VeraSpi(VERA(make_bus(kind, sim))))
+    card.init()
+    assert card.block(3) == image[3 * 512:4 * 512]
+    buffer = bytearray(4 * 512)
+    card.readinto(10, buffer)
+    assert buffer == image[10 * 512:14 * 512]
+    assert sim.spi_overruns == 0
+
+def test_unpaced_bridge_overruns_spi():
+    sim = VeraSim(SimSdCard(bytes(512)), spi_busy_accesses=4)
+    card = SdCard(VeraSpi(VERA(SerialBus(LoopbackPort(SimSerialBridge(sim, pace_spi=False))))))
+    with pytest.raises(SdCardError):
+        card.init()
+    assert sim.spi_overruns > 0
+
+@pytest.fixture
+def board():
+    '''A configured VeraSim and the VERA that set it up.'''
+    sim = VeraSim()
+    vera = VERA(sim)
+    vera.configure_display(hscale=2, vscale=2, bordercol=3)
+    vera.configure_layer(1, 32, 64, False, False, 4, 0x0000, 0x4000, 8, 8)
+    vera.start_display(layer1_en=True)
+    vera.write_vram(0x4000, random_bytes(0x2000))
+    return vera, sim
+
+def test_attach_warm(board, tmp_path):
+    vera, sim = board
+    path = os.fspath(tmp_path / 'vera.state')
+    vera.save_state(path)
+    writes = sim.writes
+    report = attach(VERA(sim), path, seed=1)
+    assert report.warm
+    assert report.bytes_uploaded == 0
+    assert sim.writes - writes < 10                 # The responsiveness check and pointer setup only
+
+def test_attach_repairs(board, tmp_path):
+    vera, sim = board
+    path = os.fspath(tmp_path / 'vera.state')
+    vera.save_state(path)
+    expected = bytes(sim.vram)
+    sim.reset()
+    sim.vram[0x5000:0x6000] = bytes(0x1000)
+    fresh = VERA(sim)
+    report = attach(fresh, path, seed=1)
+    assert not report.registers_matched
+    assert report.registers_written > 0
+    assert report.stale_regions == [0x5000]
+    assert sim.vram == expected
+    assert fresh.read_register(VERA_DC_BORDER) == 3
+    assert attach(VERA(sim), path, seed=2).warm
+
+def test_attach_adopts_mirror(board, tmp_path):
+    vera, sim = board
+    path = os.fspath(tmp_path / 'vera.state')
+    vera.save_state(path)
+    fresh = VERA(sim)
+    mirror = fresh.vram
+    attach(fresh, path, seed=1)
+    assert mirror.data == sim.vram
+    mirror.write(0x4000, bytes(sim.vram[0x4000:0x6000]))
+    assert mirror.commit() == 0
@@ -0,0 +1,75 @@
+'''
+The SD card block device, on a simulated card behind the simulator's SPI port.
+
+Run with `python -m pytest` from this folder.
+'''
+import io
+import random
+
+import pytest
+
+from vera_sim import SimSdCard, VeraSim
+from vera_spi import SdCard, SdCardError, SdFile, VeraSpi
+from vypera import VERA
+
+IMAGE = bytes(random.Random(1).getrandbits(8) for _ in range(64 * 512))
+
+def make_card(high_capacity: bool = True, **options):
+    '''(SdCard, the SimSdCard behind it), initialised'''
+    device = SimSdCard(IMAGE, high_capacity=high_capacity)
+    card = SdCard(VeraSpi(VERA(VeraSim(device))), **options)
+    card.init()
+    return card, device
+
+@pytest.mark.parametrize('high_capacity', [True, False])
+def test_addressing(high_capacity):
+    card, device = make_card(high_capacity)
+    assert card.block_addressing == high_capacity
+    assert (16 in device.commands) != high_capacity  # CMD16 only for byte-addressed cards
+    assert card.block(5) == IMAGE[5 * 512:6 * 512]
+
+def test_lru_cache():
+    card, device = make_card(cache_blocks=2, read_ahead=1)
+    card.block(1)
+    card.block(3)
+    card.block(1)                                   # Hit: block 1 becomes the newest
+    card.block(7)                                   # Evicts block 3
+    assert (card.hits, card.misses) == (1, 3)
+    commands = len(device.commands)
+    card.block(1)
+    assert len(device.commands) == commands
+    card.block(3)
+    assert len(device.commands) == commands + 1
+
+def test_sequential_reads_ahead():
+    card, device = make_card(read_ahead=4)
+    card.block(10)
+    card.block(11)                                  # Sequential: reads 11-14 with one CMD18
+    assert device.commands[-2:] == [18, 12]
+    commands = len(device.commands)
+    assert [card.block(n) for n in (12, 13, 14)] == [IMAGE[n * 512:(n + 1) * 512] for n in (12, 13, 14)]
+    assert len(device.commands) == commands
+
+def test_readinto_reads_uncached_runs():
+    card, device = make_card()
+    card.block(21)
+    commands = len(device.commands)
+    buffer = bytearray(4 * 512)
+    card.readinto(20, buffer)                       # 20, then 21 from the cache, then 22-23
+    assert buffer == IMAGE[20 * 512:24 * 512]
+    assert device.commands[commands:] == [17, 18, 12]
+
+def test_read_past_end():
+    card, device = make_card()
+    with pytest.raises(SdCardError):
+        card.block(64)
+
+def test_sd_file():
+    card, device = make_card()
+    with SdFile(card, offset=3 * 512 + 100, length=2000) as f:
+        assert f.read(10) == IMAGE[1636:1646]
+        f.seek(500)
+        assert f.read(1200) == IMAGE[2136:3336]
+        f.seek(-5, io.SEEK_END)
+        assert f.read() == IMAGE[3631:3636]
+        assert f.read() == b''
@@ -0,0 +1,60 @@
+'''
+Sprite attribute uploads to the simulator.
+
+Run with `python -m pytest` from this folder.
+'''
+import numpy as np
+import pytest
+
+from vera_sim import VeraSim
+from vera_sprites import SPRITE_ATTRIBUTES, Z_FRONT, SpriteTable
+from vypera import VERA
+
+@pytest.fixture
+def rig():
+    '''(SpriteTable, the VeraSim behind it), with the first commit done'''
+    sim = VeraSim()
+    sprites = SpriteTable(VERA(sim))
+    assert sprites.commit() == 128 * 8
+    return sprites, sim
+
+def attributes(sim: VeraSim, sprite: int) -> bytes:
+    return bytes(sim.vram[SPRITE_ATTRIBUTES + 8 * sprite:SPRITE_ATTRIBUTES + 8 * sprite + 8])
+
+def test_encoding(rig):
+    sprites, sim = rig
+    sprites.update(3, address=0x12340, mode8bpp=True, z=Z_FRONT, collision=0x5, hflip=True,
+                   width=32, height=64, palette_offset=7)
+    sprites.move(3, -2, 300)
+    sprites.commit()
+    assert attributes(sim, 3) == bytes([0x1a, 0x89, 0xfe, 0x03, 0x2c, 0x01, 0x5d, 0xe7])
+
+def test_only_changes_sent(rig):
+    sprites, sim = rig
+    sprites.move(5, 10, 0)
+    writes = sim.writes
+    assert sprites.commit() == 1                    # Only the X low byte changed
+    assert attributes(sim, 5)[2] == 10
+    sprites.move(5, 10, 0)
+    assert sprites.commit() == 0
+    assert sim.writes - writes < 10
+
+def test_strided_upload(rig):
+    sprites, sim = rig
+    sprites.update(np.arange(0, 64, 2), z=Z_FRONT)  # Byte 6 of every other sprite
+    writes = sim.writes
+    assert sprites.commit() == 32
+    assert sim.writes - writes < 32 + 10
+    assert all(attributes(sim, n)[6] == Z_FRONT << 2 for n in range(0, 64, 2))
+    assert attributes(sim, 1)[6] == 0
+
+def test_fetch():
+    sim = VeraSim()
+    sim.vram[SPRITE_ATTRIBUTES + 8 * 7 + 2] = 20
+    sprites = SpriteTable(VERA(sim))
+    sprites.fetch()
+    sprites.move(7, 20, 0)
+    assert sprites.commit() == 0                    # The hardware already holds it
+    sprites.move(7, 21, 0)
+    assert sprites.commit() == 1
+    assert attributes(sim, 7)[2] == 21
@@ -0,0 +1,60 @@
+'''
+Register tracing of `VERA` against the simulator.
+
+Run with `python -m pytest` from this folder.
+'''
+import os
+
+from vera_sim import VeraSim
+from vera_trace import READ, WRITE, TracedBus, Tracer, read_trace
+from vypera import VERA, VERA_DC_BORDER, VERA_ISR, VERA_L1_CONFIG
+
+def test_counts_and_records():
+    vera = VERA(VeraSim())
+    tracer = Tracer(capacity=4)
+    tracer.attach(vera)
+    vera.write_register(VERA_L1_CONFIG, 0x12)
+    vera.write_register(VERA_L1_CONFIG, 0x05, 0x0f)
+    vera.read_register(VERA_ISR)
+    assert tracer.writes[VERA_L1_CONFIG] == 2
+    assert tracer.reads[VERA_ISR] == 1
+    records = [record[1:] for record in tracer.records()]
+    assert records == [(VERA_L1_CONFIG, 0x12, 0, WRITE), (VERA_L1_CONFIG, 0x05, 0x0f, WRITE), (VERA_ISR, 0x08, 0, READ)]
+    assert sum(tracer.histograms['write_register']) == 2
+    assert sum(tracer.histograms['read_register']) == 1
+
+def test_ring_keeps_newest():
+    vera = VERA(VeraSim())
+    tracer = Tracer(capacity=4)
+    tracer.attach(vera)
+    for value in range(10):
+        vera.write_register(VERA_DC_BORDER, value)
+    assert [record[2] for record in tracer.records()] == [6, 7, 8, 9]
+    assert tracer.writes[VERA_DC_BORDER] == 10
+    tracer.reset()
+    assert list(tracer.records()) == []
+
+def test_detach():
+    sim = VeraSim()
+    vera = VERA(sim)
+    tracer = Tracer()
+    tracer.attach(vera)
+    assert isinstance(vera.bus, TracedBus)
+    tracer.detach(vera)
+    assert vera.bus is sim
+    assert 'write_register' not in vera.__dict__
+    vera.write_register(VERA_DC_BORDER, 1)
+    assert tracer.writes[VERA_DC_BORDER] == 0
+
+def test_trace_file(tmp_path):
+    path = os.fspath(tmp_path / 'vera.trace')
+    vera = VERA(VeraSim())
+    tracer = Tracer(capacity=2, path=path)
+    tracer.attach(vera)
+    for value in range(5):
+        vera.write_register(VERA_DC_BORDER, value)
+    tracer.detach(vera)
+    tracer.close()
+    records = list(read_trace(path))
+    assert [record[2] for record in records] == [0, 1, 2, 3, 4]
+    assert all(record[1] == VERA_DC_BORDER and record[4] == WRITE for record in records)
@@ -0,0 +1,192 @@
+'''
+The register shadow of `VERA`, checked against the simulator's access counters.
+
+Run with `python -m pytest` from this folder.
+'''
+from array import array
+
+import pytest
+
+from vera_sim import VeraSim
+from vypera import (
+    VERA, VERA_AUDIO_CTRL, VERA_AUDIO_DATA, VERA_CTRL, VERA_DC_BORDER, VERA_DC_HSCALE, VERA_DC_VIDEO,
+    VERA_DC_VSTOP, VERA_ISR, VERA_L1_CONFIG,
+)
+
+@pytest.fixture
+def rig():
+    '''(VERA, the VeraSim behind it)'''
+    sim = VeraSim()
+    return VERA(sim), sim
+
+def test_unchanged_write_skipped(rig):
+    vera, sim = rig
+    vera.write_register(VERA_L1_CONFIG, 0x12)
+    writes = sim.writes
+    vera.write_register(VERA_L1_CONFIG, 0x12)
+    assert sim.writes == writes
+    vera.write_register(VERA_L1_CONFIG, 0x13)
+    assert sim.writes == writes + 1
+
+def test_reads_from_shadow(rig):
+    vera, sim = rig
+    vera.write_register(VERA_L1_CONFIG, 0x12)
+    reads = sim.reads
+    assert vera.read_register(VERA_L1_CONFIG) == 0x12
+    vera.write_register(VERA_L1_CONFIG, 0x05, 0x0f)      # Other bits come from the shadow
+    assert sim.reads == reads
+    assert sim.regs[VERA_L1_CONFIG] == 0x15
+
+def test_volatile_reads_go_to_bus(rig):
+    vera, sim = rig
+    assert vera.read_register(VERA_ISR) & 0x01 == 0
+    sim.vsync()
+    reads = sim.reads
+    assert vera.read_register(VERA_ISR) & 0x01
+    assert sim.reads == reads + 1
+
+def test_masked_write_skips_volatile_strobe_bits(rig):
+    vera, sim = rig
+    vera.write_register(VERA_DC_VIDEO, 0x21)
+    reads = sim.reads
+    sim.field = 1                                       # Bit 7 reads as the field, not as written
+    vera.update_register_bits(VERA_DC_VIDEO, bit4=1)
+    assert sim.reads == reads
+    assert sim.regs[VERA_DC_VIDEO] == 0x31
+
+def test_strobe_bits_always_written(rig):
+    vera, sim = rig
+    vera.write_register(VERA_AUDIO_DATA, 0x40)
+    vera.write_register(VERA_AUDIO_CTRL, 0x80)
+    vera.write_register(VERA_AUDIO_DATA, 0x40)
+    writes = sim.writes
+    vera.write_register(VERA_AUDIO_CTRL, 0x80)
+    assert sim.writes == writes + 1
+    assert not sim.audio_fifo
+
+def test_dcsel_banks(rig):
+    vera, sim = rig
+    vera.write_register(VERA_DC_BORDER, 7)
+    vera.write_register(VERA_CTRL, 0x02, 0x02)
+    vera.write_register(VERA_DC_VSTOP, 200)
+    assert sim.dc_bank1[3] == 200
+    vera.write_register(VERA_CTRL, 0x00, 0x02)
+    reads = sim.reads
+    assert vera.read_register(VERA_DC_BORDER) == 7
+    vera.write_register(VERA_CTRL, 0x02, 0x02)
+    assert vera.read_register(VERA_DC_VSTOP) == 200
+    assert sim.reads == reads
+    writes = sim.writes
+    vera.write_register(VERA_DC_VSTOP, 200)
+    assert sim.writes == writes
+
+def test_reset_invalidates(rig):
+    vera, sim = rig
+    vera.write_register(VERA_DC_HSCALE, 64)
+    vera.write_register(VERA_CTRL, 0x80)
+    reads = sim.reads
+    assert vera.read_register(VERA_DC_HSCALE) == 128
+    assert sim.reads > reads
+
+class ProgramSim(VeraSim):
+    '''VeraSim that keeps each `write_registers` program it is sent.'''
+
+    def __init__(self):
+        super().__init__()
+        self.programs = []
+
+    def write_registers(self, writes) -> None:
+        self.programs.append(list(writes))
+        super().write_registers(writes)
+
+def test_batch_merges_repeated_writes():
+    sim = ProgramSim()
+    vera = VERA(sim)
+    vera.read_register(VERA_CTRL)                       # Banked registers need CTRL
+    with vera.batch():
+        vera.write_register(VERA_L1_CONFIG, 0x01)
+        vera.write_register(VERA_DC_BORDER, 3)
+        vera.write_register(VERA_L1_CONFIG, 0x02)
+        assert sim.programs == []
+    assert sim.programs == [[(VERA_L1_CONFIG, 0x02), (VERA_DC_BORDER, 3)]]
+    assert sim.regs[VERA_L1_CONFIG] == 0x02
+
+def test_batch_keeps_order_across_side_effects():
+    sim = ProgramSim()
+    vera = VERA(sim)
+    vera.read_register(VERA_CTRL)
+    with vera.batch():
+        vera.write_register(VERA_DC_BORDER, 1)
+        vera.write_register(VERA_CTRL, 0x02)            # DCSEL 1: the next write is DC_VSTOP
+        vera.write_register(VERA_DC_VSTOP, 100)
+        vera.write_register(VERA_CTRL, 0x00)
+        vera.write_register(VERA_DC_BORDER, 2)
+    assert sim.programs == [[
+        (VERA_DC_BORDER, 1), (VERA_CTRL, 0x02), (VERA_DC_VSTOP, 100), (VERA_CTRL, 0x00), (VERA_DC_BORDER, 2),
+    ]]
+    assert sim.dc_bank1[3] == 100
+    assert sim.regs[VERA_DC_BORDER] == 2
+
+def test_batch_flushes_before_read():
+    sim = ProgramSim()
+    vera = VERA(sim)
+    with vera.batch():
+        vera.write_register(VERA_DC_BORDER, 5)
+        sim.vsync()
+        assert vera.read_register(VERA_ISR) & 0x01
+        assert sim.programs == [[(VERA_DC_BORDER, 5)]]
+        vera.write_register(VERA_DC_BORDER, 6)
+    assert sim.programs[1:] == [[(VERA_DC_BORDER, 6)]]
+
+def test_write_vram_streams_buffers(rig):
+    vera, sim = rig
+    vera.write_vram(0x100, array('H', [0x1234, 0xabcd]))    # Multi-byte items in memory order
+    assert sim.vram[0x100:0x104] == bytes(array('H', [0x1234, 0xabcd]))
+    writes = sim.writes
+    vera.write_vram(0x1000, bytes(range(200)))
+    assert sim.writes - writes == 200 + 3                   # Pointer setup, then the data
+    assert sim.vram[0x1000:0x1000 + 200] == bytes(range(200))
+
+def test_vram_increments(rig):
+    vera, sim = rig
+    vera.write_vram(0x20f, b'abcd', increment=-1)
+    assert sim.vram[0x20c:0x210] == b'dcba'
+    vera.write_vram(0x300, b'xyz', increment=320, port=1)
+    assert sim.vram[0x300 + 640] == ord('z')
+    assert vera.read_vram(0x300, 3, increment=320) == b'xyz'
+    assert vera.read_vram(0x20f, 4, increment=-1, port=1) == b'abcd'
+
+def test_snapshot_vram(rig):
+    vera, sim = rig
+    sim.vram[0x1ffff] = 0x5a
+    snapshot = vera.snapshot_vram()
+    assert len(snapshot) == 1 << 17
+    assert snapshot == sim.vram
+
+def vram_rect(sim: VeraSim, base: int, width: int, height: int, pitch: int) -> list:
+    return [bytes(sim.vram[base + y * pitch:base + y * pitch + width]) for y in range(height)]
+
+@pytest.mark.parametrize('width, height', [(3, 50), (50, 3), (320, 2)])
+def test_fill_rect(rig, width, height):
+    vera, sim = rig
+    vera.fill_rect(0x1000, width, height, 320, 0x77)
+    assert vram_rect(sim, 0x1000, width, height, 320) == [b'\x77' * width] * height
+    assert sim.vram[0x1000 + width] == (0x77 if width == 320 else 0)
+    assert sim.vram[0x1000 + height * 320] == 0
+
+def test_copy_strided(rig):
+    vera, sim = rig
+    sim.vram[0x100:0x110] = bytes(range(16))
+    vera.copy(0x100, 0x2000, 16, 1, 40)             # A row into a column
+    assert bytes(sim.vram[0x2000:0x2000 + 16 * 40:40]) == bytes(range(16))
+    vera.copy(0x2000, 0x3000, 16, 40, 1)
+    assert sim.vram[0x3000:0x3010] == bytes(range(16))
+
+@pytest.mark.parametrize('width, height', [(4, 30), (30, 4)])
+def test_copy_rect(rig, width, height):
+    vera, sim = rig
+    for y in range(height):
+        sim.vram[0x400 + y * 160:0x400 + y * 160 + width] = bytes((y + x) & 0xff for x in range(width))
+    vera.copy_rect(0x400, 0x8000, width, height, 160, 320)
+    assert vram_rect(sim, 0x8000, width, height, 320) == vram_rect(sim, 0x400, width, height, 160)
+    assert sim.vram[0x8000 + width] == 0
@@ -0,0 +1,264 @@
+'''
+Conversion of images into VERA's packed graphics formats, using NumPy.
+
+Images are 2-D arrays of palette indices (uint8). They can be packed into:
+    - bitmap data for a bitmap layer (`bitmap_data`)
+    - tile data plus a tilemap, with duplicate tiles removed and H/V-flipped copies of
+      a tile sharing one tile (`build_tilemap`)
+    - sprite data (`sprite_data`)
+at any depth VERA supports. In every format the leftmost pixel of a byte is in its most
+significant bits.
+
+Conversions can go through an `AssetCache`, a content-addressed directory of .npy files keyed
+by a hash of the source image and the conversion parameters. Cached results are memory-mapped,
+so reloading a level does not redo the conversion.
+'''
+import hashlib
+import json
+import os
+from typing import Callable, Sequence, Tuple
+
+import numpy as np
+
+from vypera import depth_map
+
+MAX_TILES = 1024
+MAX_TILES_1BPP = 256        # At 1 bpp the second map byte holds colours, not tile index bits
+SPRITE_SIZES = (8, 16, 32, 64)
+
+# Flip flags in the second tilemap byte
+MAP_HFLIP = 0x04
+MAP_VFLIP = 0x08
+
+def pack_pixels(pixels: np.ndarray, bpp: int) -> np.ndarray:
+    '''
+    Pack palette indices along the last axis into bytes, leftmost pixel in the high bits.
+
+    Args:
+        pixels (np.ndarray): Indices, last axis a multiple of 8 // bpp long
+        bpp (int): 1, 2, 4 or 8
+
+    Returns:
+        np.ndarray: uint8 array with the last axis divided by the pixels per byte
+    '''
+    if bpp not in depth_map:
+        raise ValueError(bpp)
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    if bpp == 8:
+        return pixels
+    per_byte = 8 // bpp
+    if pixels.shape[-1] % per_byte:
+        raise ValueError(f'width {pixels.shape[-1]} is not a multiple of {per_byte}')
+    grouped = (pixels & ((1 << bpp) - 1)).reshape(pixels.shape[:-1] + (-1, per_byte))
+    shifts = np.arange(8 - bpp, -1, -bpp, dtype=np.uint8)
+    return np.bitwise_or.reduce(grouped << shifts, axis=-1).astype(np.uint8)
+
+def unpack_pixels(packed: np.ndarray, bpp: int) -> np.ndarray:
+    '''Inverse of `pack_pixels`.'''
+    if bpp not in depth_map:
+        raise ValueError(bpp)
+    packed = np.asarray(packed, dtype=np.uint8)
+    if bpp == 8:
+        return packed
+    shifts = np.arange(8 - bpp, -1, -bpp, dtype=np.uint8)
+    pixels = (packed[..., np.newaxis] >> shifts) & ((1 << bpp) - 1)
+    return pixels.reshape(packed.shape[:-1] + (-1,))
+
+def bitmap_data(image: np.ndarray, bpp: int) -> np.ndarray:
+    '''Pack an image for a bitmap layer: rows packed at `bpp`, concatenated.'''
+    return pack_pixels(image, bpp).reshape(-1)
+
+def split_tiles(image: np.ndarray, tile_width: int = 8, tile_height: int = 8) -> np.ndarray:
+    '''
+    Cut an image into tiles.
+
+    Returns:
+        np.ndarray: (rows, columns, tile_height, tile_width) array
+    '''
+    image = np.asarray(image, dtype=np.uint8)
+    height, width = image.shape
+    if height % tile_height or width % tile_width:
+        raise ValueError(f'{width}x{height} image is not a whole number of {tile_width}x{tile_height} tiles')
+    tiles = image.reshape(height // tile_height, tile_height, width // tile_width, tile_width)
+    return tiles.swapaxes(1, 2)
+
+def _row_ids(rows: np.ndarray) -> np.ndarray:
+    '''Give equal rows of a 2-D uint8 array equal small integer ids.'''
+    rows = np.ascontiguousarray(rows)
+    keys = rows.view(np.dtype((np.void, rows.shape[1]))).ravel()
+    _, ids = np.unique(keys, return_inverse=True)
+    return ids.ravel()
+
+def build_tilemap(image: np.ndarray, bpp: int, tile_width: int = 8, tile_height: int = 8,
+                  flips: bool = True, palette_offset: int = 0, fg: int = 1, bg: int = 0,
+                  t256c: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Convert an image into deduplicated tile data and a tilemap.
+
+    Args:
+        image (np.ndarray): 2-D array of palette indices
+        bpp (int): Tile colour depth (1, 2, 4 or 8)
+        tile_width (int): 8 or 16
+        tile_height (int): 8 or 16
+        flips (bool): Let H/V-flipped copies of a tile reuse it (not available at 1 bpp,
+            where the second map byte holds colours)
+        palette_offset (int): Palette offset stored in every map entry (bits 7:4), above 1 bpp
+        fg (int): Foreground colour of every map entry at 1 bpp: 0-15, or 0-255 with `t256c`
+        bg (int): Background colour of every map entry at 1 bpp, 0-15; unused with `t256c`
+        t256c (bool): The layer is 1 bpp with T256C set, so the second map byte is the
+            foreground colour alone
+
+    Returns:
+        tuple: (tile data as a flat uint8 array, map as a (rows, columns, 2) uint8 array)
+
+    Raises:
+        ValueError: More than 1024 distinct tiles, or more than 256 at 1 bpp
+    '''
+    tiles = split_tiles(image, tile_width, tile_height)
+    rows, columns = tiles.shape[:2]
+    tiles = tiles.reshape(rows * columns, tile_height, tile_width)
+    count = len(tiles)
+    pixels = tile_height * tile_width
+
+    if flips and bpp > 1:
+        variants = np.stack([tiles, tiles[:, :, ::-1], tiles[:, ::-1, :], tiles[:, ::-1, ::-1]])
+    else:
+        variants = tiles[np.newaxis]
+    ids = _row_ids(variants.reshape(-1, pixels)).reshape(len(variants), count)
+    # Each tile is stored as whichever of its variants has the lowest id; the map entry's flip
+    # bits (variant 1 = H, 2 = V, 3 = both) turn the stored tile back into the original.
+    flip = np.argmin(ids, axis=0)
+    canonical = ids[flip, np.arange(count)]
+
+    unique, first, index = np.unique(canonical, return_index=True, return_inverse=True)
+    order = np.argsort(first)                       # Number tiles in order of first use
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    tile_index = rank[index.ravel()]
+    limit = MAX_TILES_1BPP if bpp == 1 else MAX_TILES
+    if len(unique) > limit:
+        raise ValueError(f'{len(unique)} distinct tiles, VERA addresses at most {limit} at {bpp} bpp')
+
+    stored = variants[flip[first[order]], first[order]]
+    tile_data = pack_pixels(stored, bpp).reshape(-1)
+
+    entries = np.empty((count, 2), dtype=np.uint8)
+    entries[:, 0] = tile_index & 0xff
+    if bpp == 1:
+        entries[:, 1] = fg & 0xff if t256c else (bg & 0x0f) << 4 | (fg & 0x0f)
+    else:
+        flip_bits = np.where(flip & 1, MAP_HFLIP, 0) | np.where(flip & 2, MAP_VFLIP, 0)
+        entries[:, 1] = ((palette_offset & 0x0f) << 4) | flip_bits | (tile_index >> 8)
+    return tile_data, entries.reshape(rows, columns, 2)
+
+def sprite_data(image: np.ndarray, bpp: int) -> np.ndarray:
+    '''
+    Pack a sprite image. Sprites are 4 or 8 bpp and 8, 16, 32 or 64 pixels on each side.
+
+    Returns:
+        np.ndarray: Flat uint8 array
+    '''
+    image = np.asarray(image, dtype=np.uint8)
+    if bpp not in (4, 8):
+        raise ValueError(bpp)
+    if image.ndim != 2 or image.shape[0] not in SPRITE_SIZES or image.shape[1] not in SPRITE_SIZES:
+        raise ValueError(f'sprite size {image.shape}')
+    return pack_pixels(image, bpp).reshape(-1)
+
+def index_image(rgb: np.ndarray, palette: np.ndarray, chunk: int = 4096) -> np.ndarray:
+    '''
+    Map an (H, W, 3) RGB image to the nearest entries of an (N, 3) palette.
+
+    Returns:
+        np.ndarray: (H, W) uint8 array of palette indices
+    '''
+    pixels = np.asarray(rgb, dtype=np.int32).reshape(-1, 3)
+    palette = np.asarray(palette, dtype=np.int32)
+    result = np.empty(len(pixels), dtype=np.uint8)
+    for start in range(0, len(pixels), chunk):
+        block = pixels[start:start + chunk]
+        distance = ((block[:, np.newaxis, :] - palette[np.newaxis, :, :]) ** 2).sum(axis=2)
+        result[start:start + chunk] = np.argmin(distance, axis=1)
+    return result.reshape(np.asarray(rgb).shape[:2])
+
+def diff_runs(old: np.ndarray, new: np.ndarray, max_gap: int = 3) -> Sequence[Tuple[int, int]]:
+    '''
+    Find the byte ranges where two equally sized uint8 arrays differ, for delta uploads.
+
+    Args:
+        old (np.ndarray): What the hardware holds
+        new (np.ndarray): What it should hold
+        max_gap (int): Unchanged gaps up to this long are included in a run rather than
+            splitting it, as rewriting them is cheaper than re-seeking the address pointer
+
+    Returns:
+        list: (start, end) ranges of the flattened arrays, in order
+    '''
+    changed = np.flatnonzero(np.asarray(old).reshape(-1) != np.asarray(new).reshape(-1))
+    if len(changed) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(changed) > max_gap + 1)
+    starts = np.concatenate(([changed[0]], changed[breaks + 1]))
+    ends = np.concatenate((changed[breaks], [changed[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+class AssetCache(object):
+    '''
+    Content-addressed on-disk cache of conversion results.
+
+    Each result is a tuple of arrays stored as `<key>.<n>.npy`, where the key hashes the source
+    array (contents, shape, dtype), the conversion name and its parameters. Hits are opened
+    with `mmap_mode='r'`, so only the pages that are used are read.
+
+    Example:
+        cache = AssetCache('~/.cache/vypera')
+        tiles, tilemap = cache.build_tilemap(level_image, bpp=4)
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(source: np.ndarray, kind: str, params: dict) -> str:
+        source = np.ascontiguousarray(source)
+        digest = hashlib.sha256()
+        digest.update(json.dumps([kind, source.shape, source.dtype.str, params], sort_keys=True).encode())
+        digest.update(memoryview(source).cast('B'))
+        return digest.hexdigest()
+
+    def _paths(self, key: str, count: int) -> Sequence[str]:
+        return [os.path.join(self.directory, f'{key}.{n}.npy') for n in range(count)]
+
+    def fetch(self, source: np.ndarray, kind: str, params: dict, count: int,
+              build: Callable[[], Tuple[np.ndarray, ...]]) -> Tuple[np.ndarray, ...]:
+        '''
+        Return the cached result for (`source`, `kind`, `params`), building and storing it on a miss.
+
+        Args:
+            count (int): Number of arrays the conversion returns
+            build: Performs the conversion
+        '''
+        paths = self._paths(self.key(source, kind, params), count)
+        if all(os.path.exists(path) for path in paths):
+            return tuple(np.load(path, mmap_mode='r') for path in paths)
+        result = build()
+        for path, array in zip(paths, result):
+            temporary = f'{path}.{os.getpid()}.tmp'
+            with open(temporary, 'wb') as f:
+                np.save(f, array)
+            os.replace(temporary, path)
+        return result
+
+    def build_tilemap(self, image: np.ndarray, bpp: int, tile_width: int = 8, tile_height: int = 8,
+                      flips: bool = True, palette_offset: int = 0, fg: int = 1, bg: int = 0,
+                      t256c: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        params = dict(bpp=bpp, tile_width=tile_width, tile_height=tile_height, flips=flips,
+                      palette_offset=palette_offset, fg=fg, bg=bg, t256c=t256c)
+        return self.fetch(image, 'tilemap', params, 2, lambda: build_tilemap(image, **params))
+
+    def bitmap_data(self, image: np.ndarray, bpp: int) -> np.ndarray:
+        return self.fetch(image, 'bitmap', dict(bpp=bpp), 1, lambda: (bitmap_data(image, bpp),))[0]
+
+    def sprite_data(self, image: np.ndarray, bpp: int) -> np.ndarray:
+        return self.fetch(image, 'sprite', dict(bpp=bpp), 1, lambda: (sprite_data(image, bpp),))[0]
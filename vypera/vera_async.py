@@ -0,0 +1,259 @@
+'''
+Write-behind access to VERA, so application code can keep running while the bus is busy.
+
+`WriteBehindBus` wraps a register bus (`VeraIntf`, `VeraSim`, ...). Writes are queued and
+performed by a dedicated I/O thread; reads and `sync()` wait for everything queued before
+them. The queue is bounded, so a producer that outruns the bus blocks instead of growing
+the backlog without limit.
+
+`AsyncVERA` puts an asyncio-friendly face on the same mechanism: hardware reads and draining
+are awaitable, so an event loop never waits on the bus.
+
+Example:
+    bus = enable_write_behind(vera)
+    vera.configure_display()        # returns as soon as the writes are queued
+    ...
+    vera.sync()                     # wait for the hardware to catch up
+'''
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional
+
+from vypera import VERA, VERA_CTRL, VERA_DATA_0, VERA_DATA_1, read_stream, strobe_bits, volatile_bits
+
+DEFAULT_QUEUE_SIZE = 1024
+
+def _noop():
+    return None
+
+class WriteBehindBus(object):
+    '''
+    Register bus wrapper that performs writes on a background I/O thread.
+
+    The queue is a deque shared with the I/O thread without a lock around it; two semaphores
+    count queued commands and free slots. Errors raised by queued writes are re-raised by
+    the next call made on the bus.
+
+    Args:
+        bus: The register bus that performs the accesses
+        maxsize (int): Maximum number of queued commands before callers block
+    '''
+
+    def __init__(self, bus, maxsize: int = DEFAULT_QUEUE_SIZE):
+        self.bus = bus
+        self.maxsize = maxsize
+        self._queue = deque()
+        self._items = threading.Semaphore(0)
+        self._slots = threading.Semaphore(maxsize)
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='vera-io', daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        '''Number of commands queued and not yet started.'''
+        return len(self._queue)
+
+    def _run(self) -> None:
+        while True:
+            self._items.acquire()
+            method, args, future = self._queue.popleft()
+            self._slots.release()
+            if method is None:
+                future.set_result(None)
+                return
+            try:
+                result = method(*args)
+            except BaseException as e:
+                if future is None:
+                    self._error = e
+                else:
+                    future.set_exception(e)
+            else:
+                if future is not None:
+                    future.set_result(result)
+
+    def raise_pending_error(self) -> None:
+        '''Raise, once, the error of a queued write that failed since the last check.'''
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _put(self, method, args, future: Optional[Future] = None) -> None:
+        if self._closed:
+            raise RuntimeError('write-behind bus is closed')
+        self.raise_pending_error()
+        self._slots.acquire()
+        self._queue.append((method, args, future))
+        self._items.release()
+
+    def submit(self, method, *args) -> Future:
+        '''
+        Queue a call to be made on the I/O thread after everything queued before it.
+
+        Returns:
+            Future: Resolves to the call's return value
+        '''
+        future = Future()
+        self._put(method, args, future)
+        return future
+
+    def write_register(self, index: int, value: int) -> None:
+        self._put(self.bus.write_register, (index, value))
+
+    def write_registers(self, writes) -> None:
+        self._put(self.bus.write_registers, (tuple(writes),))
+
+    def write_stream(self, index: int, data) -> None:
+        # The caller may reuse its buffer as soon as this returns, so the data is copied
+        self._put(self.bus.write_stream, (index, bytes(memoryview(data).cast('B'))))
+
+    def fill(self, index: int, value: int, count: int) -> None:
+        self._put(self.bus.fill, (index, value, count))
+
+    def read_stream(self, index: int, length: int) -> bytearray:
+        return self.submit(read_stream, self.bus, index, length).result()
+
+    def submit_read(self, index: int) -> Future:
+        '''Queue a register read and return a Future for its value.'''
+        return self.submit(self.bus.read_register, index)
+
+    def read_register(self, index: int) -> int:
+        return self.submit_read(index).result()
+
+    def barrier(self) -> Future:
+        '''Return a Future that resolves once everything queued so far has been performed.'''
+        return self.submit(_noop)
+
+    def sync(self) -> None:
+        '''Block until the queue is empty, then raise any error from a queued write.'''
+        self.barrier().result()
+        self.raise_pending_error()
+
+    def close(self) -> None:
+        '''Finish the queued work and stop the I/O thread.'''
+        if self._closed:
+            return
+        future = Future()
+        self._put(None, (), future)
+        self._closed = True
+        future.result()
+        self._thread.join()
+        self.raise_pending_error()
+
+    def __getattr__(self, name):
+        # Other bus calls (transport-specific calls) run in order on the I/O thread
+        method = getattr(self.bus, name)
+        if not callable(method):
+            return method
+        def call(*args):
+            return self.submit(method, *args).result()
+        return call
+
+def enable_write_behind(vera: VERA, maxsize: int = DEFAULT_QUEUE_SIZE) -> WriteBehindBus:
+    '''Switch `vera` to write-behind mode and return the new bus.'''
+    bus = WriteBehindBus(vera.bus, maxsize)
+    vera.bus = bus
+    return bus
+
+def disable_write_behind(vera: VERA) -> None:
+    '''Drain the queue, stop the I/O thread and give `vera` its original bus back.'''
+    if isinstance(vera.bus, WriteBehindBus):
+        bus = vera.bus
+        bus.close()
+        vera.bus = bus.bus
+
+class AsyncVERA(object):
+    '''
+    asyncio facade over a `VERA` in write-behind mode.
+
+    Attribute access is forwarded to the wrapped `VERA`, so properties and methods that only
+    write (`avera.L1_EN = 1`, `avera.configure_layer(...)`) queue their writes and return at
+    once. Hardware reads go through the awaitable methods below, and `await avera.drain()`
+    waits for the queue to empty. Use `awrite_register` in tight loops, where it waits for
+    queue space without blocking the event loop, and for masked writes, whose other bits it
+    reads with an awaitable read when the shadow does not hold them.
+
+    Example:
+        avera = AsyncVERA(vera)
+        avera.configure_display()
+        isr = await avera.read_register(VERA_ISR)
+        await avera.drain()
+    '''
+
+    def __init__(self, vera: VERA, maxsize: int = DEFAULT_QUEUE_SIZE):
+        # Learn CTRL now, so later shadow lookups never have to block on the bus
+        vera.read_register(VERA_CTRL)
+        object.__setattr__(self, 'vera', vera)
+        object.__setattr__(self, 'bus', enable_write_behind(vera, maxsize))
+
+    def __getattr__(self, name):
+        return getattr(self.vera, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.vera, name, value)
+
+    async def _bank(self, register: int) -> int:
+        '''The DCSEL/ADDRSEL bank `register` is in, reading CTRL (awaitably) if it is not shadowed.'''
+        if 0x02 < register < 0x09 or register > 0x0c:
+            return 0
+        ctrl = self.vera.cached_register(VERA_CTRL)
+        if ctrl is None:
+            ctrl = await self.read_register(VERA_CTRL)
+        if 0x09 <= register <= 0x0c:
+            return (ctrl >> 1) & 1
+        if register <= 0x02:
+            return ctrl & 1
+        return 0
+
+    async def read_register(self, register: int) -> int:
+        '''
+        Read a register, from the shadow when possible, otherwise after the queued writes. A
+        value read from the hardware is stored in the shadow, as `VERA.read_register` does.
+        '''
+        bank = await self._bank(register)
+        key = register + 32 * bank
+        value = self.vera.cached_register(register, bank)
+        if value is not None and not volatile_bits[key]:
+            return value
+        value = await asyncio.wrap_future(self.bus.submit_read(register))
+        self.vera._shadow[key] = value
+        return value
+
+    async def awrite_register(self, register: int, value: int, mask: int = 0) -> None:
+        '''
+        Write a register, first waiting (without blocking the loop) for space in the queue.
+        For a masked write, bits outside `mask` that the shadow does not hold are read with
+        `read_register` rather than a blocking read.
+        '''
+        if mask != 0 and mask != 0xff:
+            bank = await self._bank(register)
+            key = register + 32 * bank
+            keep = ~mask & ~strobe_bits[key] & 0xff
+            current = self.vera.cached_register(register, bank)
+            if current is None or volatile_bits[key] & keep:
+                current = await self.read_register(register)
+            value = (current & keep) | (value & mask)
+            mask = 0
+        if self.bus.pending >= self.bus.maxsize:
+            await self.drain()
+        self.vera.write_register(register, value, mask)
+
+    async def read_vram(self, address: int, length: int, increment: int = 1, port: int = 0) -> bytearray:
+        '''Read a block of VRAM once the queued writes have been performed.'''
+        self.vera.set_address_and_increment(address, increment, port)
+        data_register = VERA_DATA_1 if port else VERA_DATA_0
+        return await asyncio.wrap_future(self.bus.submit(read_stream, self.bus.bus, data_register, length))
+
+    async def drain(self) -> None:
+        '''Wait until every queued write has reached the hardware.'''
+        await asyncio.wrap_future(self.bus.barrier())
+        self.bus.raise_pending_error()
+
+    async def close(self) -> None:
+        '''Drain the queue and return the wrapped `VERA` to synchronous operation.'''
+        await self.drain()
+        await asyncio.get_running_loop().run_in_executor(None, disable_write_behind, self.vera)
@@ -0,0 +1,320 @@
+'''
+Streaming PCM playback through VERA's audio FIFO.
+
+An `AudioFeeder` takes samples from a NumPy array, an iterator of arrays or bytes chunks, or a
+WAV file, converts them in chunks with NumPy (mixing to the output channel count, linear
+resampling to a rate VERA can play, encoding to signed 8 or 16 bit) and keeps the 4 KB FIFO
+topped up from its own thread. The thread polls the AFLOW (FIFO below 1/4) flag and refills
+the FIFO with one burst write to AUDIO_DATA each time it is set.
+
+The feeder shares the bus with the rest of the program, so it is driven through a
+`vera_async.WriteBehindBus`, whose I/O thread serialises the accesses of both threads;
+`start()` switches the `VERA` to write-behind mode if it is not already.
+
+Example:
+    feeder = AudioFeeder(vera, 'music.wav', bits=8, stereo=False)
+    feeder.start()
+    ...
+    print(feeder.stats())
+'''
+import os
+import threading
+import time
+import wave
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import numpy as np
+
+from vera_async import WriteBehindBus, enable_write_behind
+from vypera import VERA, VERA_AUDIO_CTRL, VERA_AUDIO_DATA, VERA_AUDIO_RATE, VERA_ISR
+
+AUDIO_FIFO_SIZE = 4096
+AUDIO_LOW_WATER = AUDIO_FIFO_SIZE // 4  # AFLOW is set while the FIFO holds less than this
+
+# AUDIO_CTRL bits
+AUDIO_FIFO_RESET = 0x80     # write
+AUDIO_FIFO_FULL = 0x80      # read
+AUDIO_FIFO_EMPTY = 0x40     # read
+AUDIO_16BIT = 0x20
+AUDIO_STEREO = 0x10
+AUDIO_VOLUME = 0x0f
+
+ISR_AFLOW = 0x08
+
+# AUDIO_RATE 128 plays at the full 25 MHz / 512 rate
+AUDIO_RATE_MAX = 128
+AUDIO_BASE_RATE = 25_000_000 / 512
+
+def rate_register(sample_rate: float) -> int:
+    '''Return the AUDIO_RATE value that plays closest to `sample_rate` Hz.'''
+    return max(1, min(AUDIO_RATE_MAX, round(sample_rate * AUDIO_RATE_MAX / AUDIO_BASE_RATE)))
+
+def register_rate(rate: int) -> float:
+    '''Return the sample rate in Hz that an AUDIO_RATE value plays at.'''
+    return AUDIO_BASE_RATE * rate / AUDIO_RATE_MAX
+
+def to_float(samples, channels: int, width: int = 2) -> np.ndarray:
+    '''
+    Convert samples to a (frames, channels) float32 array in [-1, 1].
+
+    Args:
+        samples: NumPy array of int8, uint8 (offset binary, as in WAV), int16, int32 or float
+            samples, or a bytes-like object of interleaved little-endian samples
+        channels (int): Number of interleaved channels
+        width (int): Bytes per sample of bytes-like input. 1 byte samples are unsigned.
+    '''
+    if not isinstance(samples, np.ndarray):
+        samples = np.frombuffer(samples, dtype=np.uint8 if width == 1 else np.dtype(f'<i{width}'))
+    if samples.dtype == np.uint8:
+        result = (samples.astype(np.float32) - 128) / 128
+    elif samples.dtype.kind == 'i':
+        result = samples.astype(np.float32) / float(1 << (8 * samples.dtype.itemsize - 1))
+    else:
+        result = samples.astype(np.float32)
+    return result.reshape(-1, channels)
+
+def encode_samples(frames: np.ndarray, bits: int, stereo: bool) -> bytes:
+    '''Encode float frames into VERA's FIFO format: signed 8 or 16 bit, stereo interleaved L, R.'''
+    if stereo and frames.shape[1] == 1:
+        frames = np.repeat(frames, 2, axis=1)
+    elif not stereo and frames.shape[1] > 1:
+        frames = frames.mean(axis=1, keepdims=True)
+    else:
+        frames = frames[:, :2]
+    frames = np.clip(frames, -1.0, 1.0)
+    if bits == 16:
+        return np.rint(frames * 32767).astype('<i2').tobytes()
+    return np.rint(frames * 127).astype(np.int8).tobytes()
+
+class Resampler(object):
+    '''
+    Linear-interpolation resampler for a stream processed in chunks. The last input frame of
+    each chunk is carried over, so chunk boundaries do not produce clicks.
+    '''
+
+    def __init__(self, input_rate: float, output_rate: float):
+        self.step = input_rate / output_rate
+        self.position = 0.0     # Next output position, relative to the carried frame
+        self._previous: Optional[np.ndarray] = None
+
+    def process(self, frames: np.ndarray) -> np.ndarray:
+        if abs(self.step - 1.0) < 1e-9 or len(frames) == 0:
+            return frames
+        if self._previous is not None:
+            frames = np.concatenate((self._previous, frames))
+        last = len(frames) - 1
+        count = max(0, int(np.ceil((last - self.position) / self.step)))
+        positions = self.position + self.step * np.arange(count)
+        indices = np.arange(len(frames))
+        result = np.empty((count, frames.shape[1]), dtype=np.float32)
+        for channel in range(frames.shape[1]):
+            result[:, channel] = np.interp(positions, indices, frames[:, channel])
+        self.position += self.step * count - last
+        self._previous = frames[-1:]
+        return result
+
+def _wav_chunks(path, frames: int) -> Iterator[bytes]:
+    with wave.open(os.fspath(path), 'rb') as f:
+        while True:
+            data = f.readframes(frames)
+            if not data:
+                return
+            yield data
+
+@dataclass
+class AudioStats:
+    '''Feeder counters. `margin` below zero means refills take longer than the FIFO lasts.'''
+    sample_rate: float
+    byte_rate: float
+    refills: int
+    bytes_written: int
+    underruns: int
+    polls: int
+    mean_refill_bytes: float
+    mean_write_seconds: float
+    max_write_seconds: float
+    mean_fill: float        # Estimated FIFO fill fraction right after a refill
+    low_water_seconds: float
+
+    @property
+    def margin(self) -> float:
+        return self.low_water_seconds - self.max_write_seconds
+
+class AudioFeeder(object):
+    '''
+    Plays a PCM stream through VERA's audio FIFO from a background thread.
+
+    Args:
+        vera (VERA): Device
+        source: NumPy array of samples, iterator of arrays or bytes chunks, or a WAV file path
+        sample_rate (float): Rate of the source. Taken from the file for WAV sources.
+        channels (int): Channels of the source. Taken from the file for WAV sources.
+        width (int): Bytes per sample of bytes chunks. Taken from the file for WAV sources.
+        bits (int): Output sample size, 8 or 16
+        stereo (bool): Play in stereo
+        volume (int): 0-15
+        chunk (int): Source frames converted at a time
+        poll_interval (float): Seconds between AFLOW polls. Default: an eighth of the time the
+            FIFO takes to drain from the low-water mark.
+    '''
+
+    def __init__(self, vera: VERA, source, sample_rate: float = AUDIO_BASE_RATE, channels: int = 1,
+                 width: int = 2, bits: int = 16, stereo: bool = True, volume: int = 15,
+                 chunk: int = 4096, poll_interval: Optional[float] = None, history: int = 256):
+        if bits not in (8, 16):
+            raise ValueError(bits)
+        if isinstance(source, (str, os.PathLike)):
+            with wave.open(os.fspath(source), 'rb') as f:
+                sample_rate, channels, width = f.getframerate(), f.getnchannels(), f.getsampwidth()
+            source = _wav_chunks(source, chunk)
+        elif isinstance(source, np.ndarray):
+            if source.ndim == 2:
+                channels = source.shape[1]
+            samples = source
+            source = (samples[start:start + chunk] for start in range(0, len(samples), chunk))
+        self.vera = vera
+        self.bits = bits
+        self.stereo = stereo
+        self.volume = volume & AUDIO_VOLUME
+        self.rate = rate_register(min(sample_rate, AUDIO_BASE_RATE))
+        self.sample_rate = register_rate(self.rate)
+        self.frame_bytes = (bits // 8) * (2 if stereo else 1)
+        self.byte_rate = self.sample_rate * self.frame_bytes
+        self.poll_interval = (poll_interval if poll_interval is not None
+                              else AUDIO_LOW_WATER / self.byte_rate / 8)
+        self._source = iter(source)
+        self._channels = channels
+        self._width = width
+        self._resampler = Resampler(sample_rate, self.sample_rate)
+        self._pending = bytearray()
+        self._exhausted = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.finished = threading.Event()
+        self.error: Optional[BaseException] = None
+
+        self.refills = 0
+        self.bytes_written = 0
+        self.underruns = 0
+        self.polls = 0
+        self._write_seconds = deque(maxlen=history)
+        self._refill_bytes = deque(maxlen=history)
+        self._fills = deque(maxlen=history)
+        # Estimated FIFO level and when it was estimated, for the fill metrics
+        self._level = 0.0
+        self._level_time = 0.0
+
+    @property
+    def ctrl(self) -> int:
+        '''AUDIO_CTRL value for the output format, without the FIFO reset bit.'''
+        return (AUDIO_16BIT if self.bits == 16 else 0) | (AUDIO_STEREO if self.stereo else 0) | self.volume
+
+    def _produce(self, count: int) -> bytes:
+        '''Take up to `count` bytes (whole frames) of encoded output, converting more source as needed.'''
+        while len(self._pending) < count and not self._exhausted:
+            try:
+                samples = next(self._source)
+            except StopIteration:
+                self._exhausted = True
+                break
+            frames = self._resampler.process(to_float(samples, self._channels, self._width))
+            self._pending += encode_samples(frames, self.bits, self.stereo)
+        count = min(count, len(self._pending))
+        count -= count % self.frame_bytes
+        data = bytes(self._pending[:count])
+        del self._pending[:count]
+        return data
+
+    def _write(self, bus, room: int) -> int:
+        data = self._produce(room)
+        if not data:
+            return 0
+        start = time.perf_counter()
+        bus.write_stream(VERA_AUDIO_DATA, data)
+        bus.sync()
+        now = time.perf_counter()
+        level = max(0.0, self._level - (start - self._level_time) * self.byte_rate)
+        self._level = min(float(AUDIO_FIFO_SIZE), level + len(data))
+        self._level_time = now
+        self._write_seconds.append(now - start)
+        self._refill_bytes.append(len(data))
+        self._fills.append(self._level / AUDIO_FIFO_SIZE)
+        self.refills += 1
+        self.bytes_written += len(data)
+        return len(data)
+
+    def start(self) -> None:
+        '''Reset the FIFO, prefill it, start playback and the feeder thread.'''
+        if not isinstance(self.vera.bus, WriteBehindBus):
+            enable_write_behind(self.vera)
+        self.vera.write_register(VERA_AUDIO_RATE, 0)
+        self.vera.write_register(VERA_AUDIO_CTRL, AUDIO_FIFO_RESET | self.ctrl)
+        self._level, self._level_time = 0.0, time.perf_counter()
+        self._write(self.vera.bus, AUDIO_FIFO_SIZE - self.frame_bytes)
+        self.vera.write_register(VERA_AUDIO_RATE, self.rate)
+        self.vera.sync()
+        self._stop.clear()
+        self.finished.clear()
+        self._thread = threading.Thread(target=self._run, name='vera-audio', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        bus = self.vera.bus
+        try:
+            while not self._stop.is_set():
+                self.polls += 1
+                if not bus.read_register(VERA_ISR) & ISR_AFLOW:
+                    self._stop.wait(self.poll_interval)
+                    continue
+                empty = bus.read_register(VERA_AUDIO_CTRL) & AUDIO_FIFO_EMPTY
+                if self._exhausted and not self._pending:
+                    if empty:
+                        break           # Played to the end
+                    self._stop.wait(self.poll_interval)
+                    continue
+                if empty:
+                    self.underruns += 1
+                    self._level = 0.0
+                # The FIFO holds less than the low-water mark, so this much always fits
+                self._write(bus, AUDIO_FIFO_SIZE - AUDIO_LOW_WATER)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.finished.set()
+
+    def stop(self) -> None:
+        '''Stop the feeder thread and playback, and discard what is left in the FIFO.'''
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.vera.write_register(VERA_AUDIO_RATE, 0)
+        self.vera.write_register(VERA_AUDIO_CTRL, AUDIO_FIFO_RESET | self.ctrl)
+        self.vera.sync()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        '''Wait until the source has been played to the end. Re-raises an error of the feeder thread.'''
+        done = self.finished.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return done
+
+    def stats(self) -> AudioStats:
+        writes = list(self._write_seconds)
+        sizes = list(self._refill_bytes)
+        fills = list(self._fills)
+        return AudioStats(
+            sample_rate=self.sample_rate,
+            byte_rate=self.byte_rate,
+            refills=self.refills,
+            bytes_written=self.bytes_written,
+            underruns=self.underruns,
+            polls=self.polls,
+            mean_refill_bytes=sum(sizes) / len(sizes) if sizes else 0.0,
+            mean_write_seconds=sum(writes) / len(writes) if writes else 0.0,
+            max_write_seconds=max(writes, default=0.0),
+            mean_fill=sum(fills) / len(fills) if fills else 0.0,
+            low_water_seconds=AUDIO_LOW_WATER / self.byte_rate,
+        )
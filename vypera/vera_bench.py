@@ -0,0 +1,156 @@
+'''
+Bus-efficiency benchmarks for the VERA driver.
+
+Runs a set of canonical workloads against the simulated MCP23017 (`vera_sim.SimSMBus`), so
+every I2C transaction the driver issues is counted exactly, and reports per workload:
+transactions, bytes on the wire, estimated bus time at several I2C clock rates, and the
+Python CPU time spent (driver plus simulator).
+
+Usage:
+    python vera_bench.py [--json results.json] [--baseline previous.json] [--tolerance 0.0]
+
+With --baseline, the run fails (exit status 1) if any workload needs more transactions or
+wire bytes than the baseline allows.
+'''
+import argparse
+import json
+import sys
+import time
+
+from mcp23017 import MCP23017
+from vera_intf import VeraIntf
+from vera_sim import SimSMBus
+from vypera import VERA
+
+I2C_CLOCKS = (100_000, 400_000, 1_000_000)
+
+# Each byte is 8 data bits plus ACK; each transaction adds about a start and a stop condition.
+BITS_PER_BYTE = 9
+BITS_PER_TRANSACTION = 2
+
+def wire_time(transactions: int, wire_bytes: int, clock: int) -> float:
+    '''Estimated time in seconds to clock the given traffic over I2C at `clock` Hz.'''
+    return (wire_bytes * BITS_PER_BYTE + transactions * BITS_PER_TRANSACTION) / clock
+
+def make_rig():
+    '''Return a (vera, smbus) pair wired through VeraIntf and MCP23017 to a fresh simulator.'''
+    smbus = SimSMBus()
+    mcp = MCP23017(0x20, smbus)
+    mcp.init()
+    vera = VERA(VeraIntf(mcp))
+    smbus.reset_counters()
+    return vera, smbus
+
+def bench_configure_display(vera):
+    vera.configure_display(hscale=2, vscale=2, bordercol=3)
+    return 1
+
+def bench_configure_layer(layer_index):
+    def bench(vera):
+        vera.configure_layer(layer_index, 32, 64, False, False, 4, 0x1000 * layer_index, 0x8000, 8, 8)
+        return 1
+    return bench
+
+def bench_address(vera):
+    for i in range(100):
+        vera.address = i * 0x123
+        vera.address
+    return 200
+
+def bench_upload(size):
+    data = bytes(i & 0xff for i in range(size))
+    def bench(vera):
+        vera.write_vram(0, data)
+        return size
+    return bench
+
+def bench_readback(size):
+    def bench(vera):
+        vera.read_vram(0, size)
+        return size
+    return bench
+
+def bench_bit_toggles(vera):
+    for i in range(1000):
+        vera.SPRITE_EN = i & 1
+    return 1000
+
+WORKLOADS = [
+    ('configure_display',   bench_configure_display),
+    ('configure_layer_0',   bench_configure_layer(0)),
+    ('configure_layer_1',   bench_configure_layer(1)),
+    ('address_set_get',     bench_address),
+    ('upload_1k',           bench_upload(1024)),
+    ('upload_16k',          bench_upload(16 * 1024)),
+    ('upload_64k',          bench_upload(64 * 1024)),
+    ('readback_1k',         bench_readback(1024)),
+    ('readback_16k',        bench_readback(16 * 1024)),
+    ('readback_64k',        bench_readback(64 * 1024)),
+    ('bit_toggle_x1000',    bench_bit_toggles),
+]
+
+def run_workload(name, bench) -> dict:
+    vera, smbus = make_rig()
+    start = time.process_time()
+    ops = bench(vera)
+    cpu = time.process_time() - start
+    result = {
+        'name': name,
+        'ops': ops,
+        'transactions': smbus.transactions,
+        'wire_bytes': smbus.wire_bytes,
+        'cpu_seconds': cpu,
+        'cpu_us_per_op': cpu * 1e6 / ops,
+    }
+    for clock in I2C_CLOCKS:
+        result[f'bus_seconds_{clock // 1000}khz'] = wire_time(smbus.transactions, smbus.wire_bytes, clock)
+    return result
+
+def run(names=None) -> list:
+    return [run_workload(name, bench) for name, bench in WORKLOADS if names is None or name in names]
+
+def regressions(results: list, baseline: list, tolerance: float = 0.0) -> list:
+    '''Return a description of every workload that uses more of the bus than in `baseline`.'''
+    previous = {entry['name']: entry for entry in baseline}
+    found = []
+    for entry in results:
+        old = previous.get(entry['name'])
+        if old is None:
+            continue
+        for key in ('transactions', 'wire_bytes'):
+            if entry[key] > old[key] * (1 + tolerance):
+                found.append(f"{entry['name']}: {key} {old[key]} -> {entry[key]}")
+    return found
+
+def print_table(results: list) -> None:
+    print(f"{'workload':<20} {'ops':>6} {'i2c tx':>9} {'bytes':>9} "
+          + ' '.join(f'{clock // 1000:>6}kHz' for clock in I2C_CLOCKS) + f" {'cpu us/op':>10}")
+    for r in results:
+        times = ' '.join(f"{r[f'bus_seconds_{clock // 1000}khz']:>8.3f}s" for clock in I2C_CLOCKS)
+        print(f"{r['name']:<20} {r['ops']:>6} {r['transactions']:>9} {r['wire_bytes']:>9} {times} {r['cpu_us_per_op']:>10.2f}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Measure VERA driver bus traffic per operation.')
+    parser.add_argument('workloads', nargs='*', help='Workloads to run (default: all)')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Fail if bus usage regressed against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.0, help='Allowed relative increase')
+    args = parser.parse_args(argv)
+
+    results = run(args.workloads or None)
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        if found:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,283 @@
+'''
+Drawing into a bitmap layer through a NumPy surface.
+
+A `BitmapSurface` holds the layer's pixels as a (height, width) array of palette indices.
+The drawing primitives are NumPy operations on that array and record, per row, the span of
+columns they touched. `commit()` packs the dirty rows to the layer's depth, compares them
+with what was last uploaded, and sends only the bytes that changed:
+
+    - rows whose changed bytes cover the whole row go out as one stream with increment 1
+    - other runs of changed rows are sent row by row or, when that needs fewer register
+      writes, column by column with the row pitch as increment (the pitch of every bitmap
+      layer is one of VERA's 40/80/160/320/640 increments)
+
+Fonts are (glyphs, height, width) arrays of 0/1, indexed by character code; `load_font`
+cuts one out of a font atlas image.
+
+Example:
+    vera.configure_layer(0, 32, 32, False, True, 4, 0, BITMAP_BASE, 8, 8)
+    surface = BitmapSurface(vera, BITMAP_BASE, 320, 240, 4)
+    surface.fill_rect(10, 10, 100, 20, 6)
+    surface.text(12, 16, 'CPU 42%', 1, font)
+    frames.schedule(lambda vera: surface.commit(), key='dashboard')
+'''
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from vera_assets import pack_pixels, split_tiles
+from vypera import VERA, depth_map, increment_map
+
+# Register writes to point the address pointer somewhere else (ADDR_L, ADDR_M, ADDR_H)
+SEEK_COST = 3
+
+def load_font(atlas: np.ndarray, glyph_width: int = 8, glyph_height: int = 8, first: int = 0) -> np.ndarray:
+    '''
+    Cut a font out of an atlas image with the glyphs on a grid, in character code order.
+
+    Args:
+        atlas (np.ndarray): 2-D image; non-zero pixels are set
+        glyph_width (int): Glyph width in pixels
+        glyph_height (int): Glyph height in pixels
+        first (int): Character code of the first glyph in the atlas
+
+    Returns:
+        np.ndarray: (first + glyphs, glyph_height, glyph_width) uint8 array of 0/1
+    '''
+    glyphs = split_tiles(np.asarray(atlas) != 0, glyph_width, glyph_height)
+    glyphs = glyphs.reshape(-1, glyph_height, glyph_width)
+    return np.concatenate([np.zeros((first, glyph_height, glyph_width), dtype=np.uint8), glyphs])
+
+class BitmapSurface(object):
+    '''
+    Host-side image of a bitmap layer with dirty tracking.
+
+    Args:
+        vera (VERA): Device
+        address (int): VRAM address of the bitmap (the layer's tile base)
+        width (int): Layer width in pixels, 320 or 640
+        height (int): Rows in the bitmap
+        bpp (int): Bits per pixel, 1, 2, 4 or 8
+        port (int): Data port / address pointer used for the uploads
+
+    Attributes:
+        pixels (np.ndarray): (height, width) uint8 palette indices. After changing it
+            directly, report the changed area with `mark_dirty`.
+    '''
+
+    def __init__(self, vera: VERA, address: int, width: int = 320, height: int = 240, bpp: int = 4,
+                 port: int = 0):
+        if width not in (320, 640):
+            raise ValueError(f'bitmap width {width}')
+        if bpp not in depth_map:
+            raise ValueError(bpp)
+        self.vera = vera
+        self.address = address
+        self.width = width
+        self.height = height
+        self.bpp = bpp
+        self.port = port
+        self.pitch = width * bpp // 8
+        self.pixels_per_byte = 8 // bpp
+        self.pixels = np.zeros((height, width), dtype=np.uint8)
+        # Dirty column span [start, end) of each row; start == width means clean
+        self._start = np.full(height, width, dtype=np.int32)
+        self._end = np.zeros(height, dtype=np.int32)
+        self._committed = np.zeros((height, self.pitch), dtype=np.uint8)
+        self._known = np.zeros(height, dtype=bool)     # Rows whose VRAM content is in _committed
+        self.bytes_sent = 0
+        self.mark_dirty()
+
+    def _clip(self, x: int, y: int, width: int, height: int) -> Optional[Tuple[int, int, int, int]]:
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.width), min(y + height, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
+
+    def mark_dirty(self, x: int = 0, y: int = 0, width: Optional[int] = None, height: Optional[int] = None) -> None:
+        '''Record that a rectangle of `pixels` changed. Default: the whole surface.'''
+        clipped = self._clip(x, y, self.width if width is None else width,
+                             self.height if height is None else height)
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+        np.minimum(self._start[y0:y1], x0, out=self._start[y0:y1])
+        np.maximum(self._end[y0:y1], x1, out=self._end[y0:y1])
+
+    def _mark_points(self, xs: np.ndarray, ys: np.ndarray) -> None:
+        np.minimum.at(self._start, ys, xs)
+        np.maximum.at(self._end, ys, xs + 1)
+
+    def fill(self, color: int) -> None:
+        '''Set every pixel to `color`.'''
+        self.pixels[...] = color
+        self.mark_dirty()
+
+    def fill_rect(self, x: int, y: int, width: int, height: int, color: int) -> None:
+        '''Fill a rectangle, clipped to the surface.'''
+        clipped = self._clip(x, y, width, height)
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+        self.pixels[y0:y1, x0:x1] = color
+        self.mark_dirty(x0, y0, x1 - x0, y1 - y0)
+
+    def hline(self, x: int, y: int, width: int, color: int) -> None:
+        self.fill_rect(x, y, width, 1, color)
+
+    def vline(self, x: int, y: int, height: int, color: int) -> None:
+        self.fill_rect(x, y, 1, height, color)
+
+    def rect(self, x: int, y: int, width: int, height: int, color: int) -> None:
+        '''Draw the outline of a rectangle.'''
+        self.hline(x, y, width, color)
+        self.hline(x, y + height - 1, width, color)
+        self.vline(x, y + 1, height - 2, color)
+        self.vline(x + width - 1, y + 1, height - 2, color)
+
+    def line(self, x0: int, y0: int, x1: int, y1: int, color: int) -> None:
+        '''Draw a line between two points, both included, clipped to the surface.'''
+        steps = max(abs(x1 - x0), abs(y1 - y0))
+        t = np.arange(steps + 1) / max(steps, 1)
+        xs = np.rint(x0 + t * (x1 - x0)).astype(np.int32)
+        ys = np.rint(y0 + t * (y1 - y0)).astype(np.int32)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        xs, ys = xs[inside], ys[inside]
+        self.pixels[ys, xs] = color
+        self._mark_points(xs, ys)
+
+    def blit(self, image: np.ndarray, x: int, y: int, key: Optional[int] = None) -> None:
+        '''
+        Copy an image of palette indices onto the surface, clipped.
+
+        Args:
+            image (np.ndarray): 2-D uint8 image
+            x (int): Destination of the image's left column
+            y (int): Destination of the image's top row
+            key (int): Color that is left out (transparent), if any
+        '''
+        image = np.asarray(image, dtype=np.uint8)
+        clipped = self._clip(x, y, image.shape[1], image.shape[0])
+        if clipped is None:
+            return
+        x0, y0, x1, y1 = clipped
+        source = image[y0 - y:y1 - y, x0 - x:x1 - x]
+        target = self.pixels[y0:y1, x0:x1]
+        if key is None:
+            target[...] = source
+        else:
+            np.copyto(target, source, where=source != key)
+        self.mark_dirty(x0, y0, x1 - x0, y1 - y0)
+
+    def text(self, x: int, y: int, text: str, color: int, font: np.ndarray, bg: Optional[int] = None) -> int:
+        '''
+        Draw a line of text with a fixed width font.
+
+        Args:
+            x (int): Left edge of the first glyph
+            y (int): Top edge of the glyphs
+            text (str): Text; characters the font has no glyph for are drawn as '?'
+            color (int): Color of the set glyph pixels
+            font (np.ndarray): (glyphs, height, width) array of 0/1, see `load_font`
+            bg (int): Color of the clear glyph pixels. Default: left unchanged.
+
+        Returns:
+            int: Width of the text in pixels
+        '''
+        codes = np.frombuffer(text.encode('latin-1', 'replace'), dtype=np.uint8).astype(np.intp)
+        codes[codes >= len(font)] = ord('?')
+        glyph_height = font.shape[1]
+        # (characters, rows, columns) -> (rows, characters * columns)
+        mask = font[codes].transpose(1, 0, 2).reshape(glyph_height, -1) != 0
+        clipped = self._clip(x, y, mask.shape[1], mask.shape[0])
+        if clipped is not None:
+            x0, y0, x1, y1 = clipped
+            mask_part = mask[y0 - y:y1 - y, x0 - x:x1 - x]
+            target = self.pixels[y0:y1, x0:x1]
+            if bg is not None:
+                target[...] = bg
+            target[mask_part] = color
+            self.mark_dirty(x0, y0, x1 - x0, y1 - y0)
+        return mask.shape[1]
+
+    def _blocks(self) -> List[Tuple[int, int, np.ndarray, np.ndarray]]:
+        '''
+        Pack the dirty rows and find the bytes that differ from the last upload.
+
+        Returns:
+            list: (first row, packed rows, start bytes, end bytes) for each run of consecutive
+            rows with changes; a start of `pitch` marks a row without changes inside a run
+        '''
+        dirty = np.flatnonzero(self._start < self._end)
+        if not len(dirty):
+            return []
+        top, bottom = dirty[0], dirty[-1] + 1
+        packed = pack_pixels(self.pixels[top:bottom], self.bpp)
+        rows = np.arange(top, bottom)
+        per_byte = self.pixels_per_byte
+        # Dirty pixel spans widened to whole bytes
+        in_span = np.arange(self.pitch) >= (self._start[top:bottom] // per_byte)[:, np.newaxis]
+        in_span &= np.arange(self.pitch) < (-(-self._end[top:bottom] // per_byte))[:, np.newaxis]
+        changed = in_span & ((packed != self._committed[top:bottom]) | ~self._known[top:bottom, np.newaxis])
+        has_change = changed.any(axis=1)
+        starts = np.where(has_change, changed.argmax(axis=1), self.pitch)
+        ends = np.where(has_change, self.pitch - changed[:, ::-1].argmax(axis=1), 0)
+        self._start[top:bottom] = self.width
+        self._end[top:bottom] = 0
+
+        blocks = []
+        run = None
+        for n in range(len(rows)):
+            if has_change[n]:
+                run = n if run is None else run
+                continue
+            if run is not None:
+                blocks.append((top + run, packed[run:n], starts[run:n], ends[run:n]))
+                run = None
+        if run is not None:
+            blocks.append((top + run, packed[run:], starts[run:], ends[run:]))
+        return blocks
+
+    def _upload(self, first_row: int, packed: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> int:
+        '''Send one run of changed rows the cheapest way. Returns the number of data bytes sent.'''
+        rows = len(packed)
+        pitch = self.pitch
+        base = self.address + first_row * pitch
+        start, end = int(starts.min()), int(ends.max())
+        # Register writes of each way to send the run
+        by_stream = rows * pitch + SEEK_COST
+        by_rows = int(np.maximum(ends - starts, 0).sum()) + SEEK_COST * rows
+        by_columns = (end - start) * (rows + SEEK_COST) if pitch in increment_map else by_rows + 1
+        if by_stream <= min(by_rows, by_columns):
+            self.vera.write_vram(base, packed, 1, self.port)
+            sent = packed.size
+        elif by_columns < by_rows:
+            columns = np.ascontiguousarray(packed[:, start:end].T)
+            for n, column in enumerate(columns):
+                self.vera.write_vram(base + start + n, column, pitch, self.port)
+            sent = columns.size
+        else:
+            sent = 0
+            for n in range(rows):
+                s, e = int(starts[n]), int(ends[n])
+                if s < e:
+                    self.vera.write_vram(base + n * pitch + s, packed[n, s:e], 1, self.port)
+                    sent += e - s
+        self._committed[first_row:first_row + rows] = packed
+        self._known[first_row:first_row + rows] = True
+        return sent
+
+    def commit(self) -> int:
+        '''
+        Upload the changed bytes of the dirty rows. Call during vertical blank.
+
+        Returns:
+            int: Number of data bytes sent
+        '''
+        sent = 0
+        with self.vera.batch():
+            for block in self._blocks():
+                sent += self._upload(*block)
+        self.bytes_sent += sent
+        return sent
@@ -0,0 +1,242 @@
+'''
+Scrolling text console on a 1bpp tile layer.
+
+Text is written into a host-side grid of (character, attribute) cells and nothing is sent
+until `commit()`, so any number of prints between two frames cost one upload. The commit
+sends, for each row that changed, only the span of cells that differs from what VRAM holds,
+as one auto-increment stream.
+
+The layer's map is a ring buffer of `map_height` rows. Scrolling up by a line advances the
+ring and the layer's VSCROLL register instead of moving any text; only the newly exposed row
+is cleared, with two strided fills (characters, then attributes). Rows that scroll out of
+view before a commit are never sent.
+
+Attributes use the 16-colour 1bpp mode: foreground colour in the low nibble, background in
+the high nibble.
+
+Example:
+    vera.configure_layer(1, 64, 128, False, False, 1, MAP_BASE, FONT_BASE, 8, 8)
+    console = VeraConsole(vera, 1, MAP_BASE)
+    console.clear()
+    console.print('ready', fg=5)
+    frames.schedule(lambda vera: console.commit(), key='console')
+'''
+import re
+from typing import Optional
+
+import numpy as np
+
+from vypera import VERA, VERA_L0_VSCROLL_L, VERA_L1_VSCROLL_L, tile_dimensions_map
+
+TAB_SIZE = 8
+
+_CONTROL = re.compile('[\n\r\t\b]')
+
+class VeraConsole(object):
+    '''
+    Text console on a tile layer configured for 1bpp, 8x8 tiles, 16-colour attributes and
+    a font whose tile numbers are the character codes.
+
+    Args:
+        vera (VERA): Device
+        layer (int): Layer index (0 or 1)
+        map_base (int): VRAM address of the layer's map
+        columns (int): Visible text columns
+        rows (int): Visible text rows
+        map_width (int): Map width in tiles, at least `columns`
+        map_height (int): Map height in tiles, at least `rows`
+        fg (int): Initial foreground colour (0-15)
+        bg (int): Initial background colour (0-15)
+        charmap (bytes): 256-byte table from Latin-1 codes to tile numbers. Default: identity.
+        tile_height (int): Tile height in pixels, for the scroll offset
+        port (int): Data port / address pointer used for the uploads
+
+    Raises:
+        ValueError: The map cannot hold the visible text area
+    '''
+
+    def __init__(self, vera: VERA, layer: int, map_base: int, columns: int = 80, rows: int = 60,
+                 map_width: int = 128, map_height: int = 64, fg: int = 1, bg: int = 6,
+                 charmap: Optional[bytes] = None, tile_height: int = 8, port: int = 0):
+        if map_width not in tile_dimensions_map or map_height not in tile_dimensions_map:
+            raise ValueError(f'map size {map_width}x{map_height}')
+        if columns > map_width or rows > map_height:
+            raise ValueError(f'{map_width}x{map_height} map cannot hold {columns}x{rows} text')
+        self.vera = vera
+        self.map_base = map_base
+        self.columns = columns
+        self.rows = rows
+        self.map_width = map_width
+        self.map_height = map_height
+        self.pitch = 2 * map_width
+        self.tile_height = tile_height
+        self.port = port
+        self.vscroll_register = VERA_L1_VSCROLL_L if layer else VERA_L0_VSCROLL_L
+        self.charmap = None if charmap is None else np.frombuffer(bytes(charmap), dtype=np.uint8)
+        self.space = int(self._encode(' ')[0])
+        self.attribute = (bg & 0x0f) << 4 | (fg & 0x0f)
+        # Cells of every ring row, and what VRAM is known to hold for them
+        self.cells = np.empty((map_height, columns, 2), dtype=np.uint8)
+        self._committed = np.empty_like(self.cells)
+        self._dirty = np.zeros(map_height, dtype=bool)
+        self._cleared = np.zeros(map_height, dtype=bool)   # Ring rows to blank with fills first
+        self._blank = np.zeros(map_height, dtype=np.uint8) # Attribute those rows were blanked with
+        self.top = 0            # Ring row shown at the top of the screen
+        self._committed_top: Optional[int] = None
+        self.x = 0
+        self.y = 0
+        self.bytes_sent = 0
+        self.clear()
+
+    def set_color(self, fg: Optional[int] = None, bg: Optional[int] = None) -> None:
+        '''Change the colours used by later writes.'''
+        self.attribute = self._attribute(fg, bg)
+
+    def _attribute(self, fg: Optional[int], bg: Optional[int]) -> int:
+        attribute = self.attribute
+        if fg is not None:
+            attribute = (attribute & 0xf0) | (fg & 0x0f)
+        if bg is not None:
+            attribute = (attribute & 0x0f) | (bg & 0x0f) << 4
+        return attribute
+
+    def _blank_rows(self, ring_rows) -> None:
+        '''Blank ring rows on the host; the commit clears them in VRAM with fills.'''
+        self.cells[ring_rows, :, 0] = self.space
+        self.cells[ring_rows, :, 1] = self.attribute
+        self._blank[ring_rows] = self.attribute
+        self._cleared[ring_rows] = True
+        self._dirty[ring_rows] = True
+
+    def _ring(self, y: int) -> int:
+        return (self.top + y) % self.map_height
+
+    def _encode(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(text.encode('latin-1', 'replace'), dtype=np.uint8)
+        return codes if self.charmap is None else self.charmap[codes]
+
+    def clear(self) -> None:
+        '''Blank the whole console and move the cursor home.'''
+        self.top = 0
+        self.x = self.y = 0
+        self._blank_rows(slice(None))
+
+    def scroll(self, lines: int = 1) -> None:
+        '''Scroll the text up by `lines`, exposing blank rows at the bottom.'''
+        if lines >= self.rows:
+            # Everything visible is new; skip the rows that would scroll straight past
+            self.top = (self.top + lines - self.rows) % self.map_height
+            lines = self.rows
+        for _ in range(lines):
+            ring = self._ring(self.rows)
+            self.top = (self.top + 1) % self.map_height
+            self._blank_rows(ring)
+
+    def _newline(self) -> None:
+        self.x = 0
+        if self.y == self.rows - 1:
+            self.scroll()
+        else:
+            self.y += 1
+
+    def _put(self, codes: np.ndarray, attribute: int) -> None:
+        '''Place printable codes at the cursor, wrapping at the right edge.'''
+        start = 0
+        while start < len(codes):
+            if self.x == self.columns:
+                self._newline()
+            count = min(len(codes) - start, self.columns - self.x)
+            ring = self._ring(self.y)
+            self.cells[ring, self.x:self.x + count, 0] = codes[start:start + count]
+            self.cells[ring, self.x:self.x + count, 1] = attribute
+            self._dirty[ring] = True
+            self.x += count
+            start += count
+
+    def write(self, text: str, fg: Optional[int] = None, bg: Optional[int] = None) -> None:
+        '''
+        Write text at the cursor. Handles newline, carriage return, tab and backspace;
+        long lines wrap and writing past the bottom row scrolls.
+
+        Args:
+            text (str): Text; characters outside Latin-1 are shown as '?'
+            fg (int): Foreground colour for this text only
+            bg (int): Background colour for this text only
+        '''
+        attribute = self._attribute(fg, bg)
+        run = 0
+        for match in _CONTROL.finditer(text):
+            i, char = match.start(), match.group()
+            if i > run:
+                self._put(self._encode(text[run:i]), attribute)
+            run = i + 1
+            if char == '\n':
+                self._newline()
+            elif char == '\r':
+                self.x = 0
+            elif char == '\t':
+                self._put(np.full(TAB_SIZE - self.x % TAB_SIZE, self.space, dtype=np.uint8), attribute)
+            elif self.x > 0:
+                self.x -= 1
+        if len(text) > run:
+            self._put(self._encode(text[run:]), attribute)
+
+    def print(self, *values, sep: str = ' ', end: str = '\n', flush: bool = False,
+              fg: Optional[int] = None, bg: Optional[int] = None) -> None:
+        '''Like the built-in `print`; `flush` commits right away.'''
+        self.write(sep.join(str(value) for value in values) + end, fg, bg)
+        if flush:
+            self.commit()
+
+    def write_line(self, y: int, text: str, fg: Optional[int] = None, bg: Optional[int] = None) -> None:
+        '''
+        Replace screen row `y` with `text`, padded with blanks or cut to the width. The cursor
+        does not move. Meant for status lines redrawn every frame.
+        '''
+        if y < 0 or y >= self.rows:
+            raise IndexError(y)
+        attribute = self._attribute(fg, bg)
+        codes = self._encode(text[:self.columns])
+        ring = self._ring(y)
+        row = self.cells[ring]
+        row[:len(codes), 0] = codes
+        row[len(codes):, 0] = self.space
+        row[:, 1] = attribute
+        self._dirty[ring] = True
+
+    def _upload(self, ring: int) -> None:
+        address = self.map_base + ring * self.pitch
+        row = self.cells[ring]
+        committed = self._committed[ring]
+        if self._cleared[ring]:
+            committed[:, 0] = self.space
+            committed[:, 1] = self._blank[ring]
+        changed = np.flatnonzero((row != committed).any(axis=1))
+        if self._cleared[ring]:
+            # Blank the row with two strided fills, unless the whole line is sent anyway
+            if not len(changed) or changed[0] > 0 or changed[-1] < self.columns - 1:
+                self.vera.fill(address, self.columns, self.space, 2, self.port)
+                self.vera.fill(address + 1, self.columns, int(self._blank[ring]), 2, self.port)
+            self._cleared[ring] = False
+        if len(changed):
+            first, last = changed[0], changed[-1] + 1
+            self.vera.write_vram(address + 2 * first, row[first:last], 1, self.port)
+            committed[first:last] = row[first:last]
+            self.bytes_sent += 2 * (last - first)
+
+    def commit(self) -> None:
+        '''
+        Send the visible rows that changed and the scroll position. Call once per frame,
+        during vertical blank, so text and scroll offset change together.
+        '''
+        with self.vera.batch():
+            for y in range(self.rows):
+                ring = self._ring(y)
+                if self._dirty[ring]:
+                    self._upload(ring)
+                    self._dirty[ring] = False
+            if self.top != self._committed_top:
+                vscroll = (self.top * self.tile_height) % (self.map_height * self.tile_height)
+                self.vera.write_register(self.vscroll_register, vscroll & 0xff)
+                self.vera.write_register(self.vscroll_register + 1, vscroll >> 8)
+                self._committed_top = self.top
@@ -0,0 +1,125 @@
+'''
+Declarative display configuration.
+
+A `DisplayState` (with a `LayerState` per layer) describes the whole display setup. It is
+compiled into a register program against what the register shadow says the hardware holds:
+only registers that change are written, and the DCSEL-banked registers are grouped so each
+bank is selected at most once. Compiled programs are cached, so switching back and forth
+between a few preset modes replays a cached program.
+
+Example:
+    text_mode = DisplayState(layer1=LayerState(enabled=True, map_width=128, map_height=64,
+                                               map_base=0x1b000, tile_base=0x1f000))
+    vera.apply_state(text_mode)
+'''
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Tuple
+
+from vypera import VERA_CTRL, VERA_DC_VIDEO, VERA_L0_CONFIG, VERA_L1_CONFIG, encode_layer
+
+# Program cache size, in (target state, current register values) combinations
+PROGRAM_CACHE_SIZE = 64
+
+@dataclass(frozen=True)
+class LayerState:
+    '''Configuration of one tile/bitmap layer. Arguments match `VERA.configure_layer`.'''
+    enabled: bool = False
+    map_height: int = 32
+    map_width: int = 32
+    t256c: bool = False
+    bitmap_mode: bool = False
+    bpp: int = 1
+    map_base: int = 0
+    tile_base: int = 0
+    tile_height: int = 8
+    tile_width: int = 8
+    hscroll: int = 0
+    vscroll: int = 0
+
+    def registers(self) -> Tuple[int, ...]:
+        '''The 7 layer register values, CONFIG through VSCROLL_H.'''
+        config, map_base, tile_base = encode_layer(self.map_height, self.map_width, self.t256c,
+                                                   self.bitmap_mode, self.bpp, self.map_base,
+                                                   self.tile_base, self.tile_height, self.tile_width)
+        return (config, map_base, tile_base,
+                self.hscroll & 0xff, (self.hscroll >> 8) & 0x0f,
+                self.vscroll & 0xff, (self.vscroll >> 8) & 0x0f)
+
+@dataclass(frozen=True)
+class DisplayState:
+    '''Configuration of the display composer. Arguments match `VERA.configure_display`.'''
+    output_mode: int = 1                # VGA
+    sprites: bool = False
+    chroma_disable: bool = False
+    hscale: int = 1
+    vscale: int = 1
+    border: int = 0
+    hstart: int = 0
+    hstop: int = 640
+    vstart: int = 0
+    vstop: int = 480
+    layer0: LayerState = field(default_factory=LayerState)
+    layer1: LayerState = field(default_factory=LayerState)
+
+    def registers(self) -> Tuple[Tuple[int, int, int], ...]:
+        '''All register values of the state, as (register, DCSEL bank, value) triples.'''
+        video = ((1 if self.sprites else 0) << 6 | (1 if self.layer1.enabled else 0) << 5
+                 | (1 if self.layer0.enabled else 0) << 4 | (1 if self.chroma_disable else 0) << 2
+                 | (self.output_mode & 0x3))
+        values = [
+            (VERA_DC_VIDEO,     0, video),
+            (VERA_DC_VIDEO + 1, 0, round(128 / self.hscale)),
+            (VERA_DC_VIDEO + 2, 0, round(128 / self.vscale)),
+            (VERA_DC_VIDEO + 3, 0, self.border),
+            (VERA_DC_VIDEO,     1, self.hstart >> 2),
+            (VERA_DC_VIDEO + 1, 1, self.hstop >> 2),
+            (VERA_DC_VIDEO + 2, 1, self.vstart >> 1),
+            (VERA_DC_VIDEO + 3, 1, self.vstop >> 1),
+        ]
+        for base, layer in ((VERA_L0_CONFIG, self.layer0), (VERA_L1_CONFIG, self.layer1)):
+            values.extend((base + i, 0, value) for i, value in enumerate(layer.registers()))
+        return tuple(values)
+
+@lru_cache(maxsize=PROGRAM_CACHE_SIZE)
+def compile_program(state: DisplayState, current: Tuple, ctrl: int) -> Tuple[Tuple[int, int], ...]:
+    '''
+    Compile the register writes that take the hardware from `current` to `state`.
+
+    Args:
+        state (DisplayState): Target configuration
+        current (tuple): Known value (or None) of each entry of `state.registers()`, in order
+        ctrl (int): Current CTRL register value
+
+    Returns:
+        tuple: (register, value) writes. Unbanked registers come first, then the DCSEL bank
+        that is already selected, then the other bank, so CTRL is written at most twice.
+    '''
+    selected = (ctrl >> 1) & 1
+    unbanked, same_bank, other_bank = [], [], []
+    for (register, bank, value), known in zip(state.registers(), current):
+        if value == known:
+            continue
+        if register > VERA_DC_VIDEO + 3:
+            unbanked.append((register, value))
+        elif bank == selected:
+            same_bank.append((register, value))
+        else:
+            other_bank.append((register, value))
+
+    program = unbanked + same_bank
+    if other_bank:
+        program.append((VERA_CTRL, (ctrl & ~0x02 & 0x7f) | ((1 - selected) << 1)))
+        program.extend(other_bank)
+    return tuple(program)
+
+def apply_state(vera, state: DisplayState) -> None:
+    '''Compile `state` against `vera`'s register shadow and send the changes as one burst.'''
+    ctrl = vera.cached_register(VERA_CTRL)
+    if ctrl is None:
+        ctrl = vera.read_register(VERA_CTRL)
+    current = tuple(vera.cached_register(register, bank) for register, bank, _ in state.registers())
+    program = compile_program(state, current, ctrl)
+    with vera.batch():
+        for register, value in program:
+            vera.write_register(register, value)
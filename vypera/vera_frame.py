@@ -0,0 +1,266 @@
+'''
+VSYNC-synchronised frame commits.
+
+Updates for the next frame (scroll registers, sprite attributes, palette entries, VRAM
+deltas) are accumulated in a `FrameScheduler` while the frame is being generated. When the
+vertical blank starts they are committed in priority order until the blanking budget is used
+up; whatever does not fit is spilled to the next frame. Each frame's budget utilisation is
+recorded so overruns are visible.
+
+VSYNC is detected by one of:
+    IsrVsync        Polls VERA's ISR VSYNC flag, with adaptive backoff around the predicted
+                    next frame.
+    McpIrqVsync     VERA's IRQ# line wired to a spare pin of an MCP23017; polls that
+                    expander's INTF register (one I2C transaction) instead of VERA's ISR.
+
+Example:
+    frames = FrameScheduler(vera, IsrVsync(vera))
+    while True:
+        frames.set_scroll(1, hscroll=x)
+        frames.write_vram(row_address, row_data)
+        stats = frames.run_frame()
+'''
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Optional, Union
+
+from vypera import VERA, VERA_ISR, VERA_L0_HSCROLL_L, VERA_L1_HSCROLL_L
+
+PRIORITY_REGISTERS = 0
+PRIORITY_SPRITES = 1
+PRIORITY_PALETTE = 2
+PRIORITY_VRAM = 3
+
+# Vertical blank of the 640x480@60 VGA timing: 45 lines of 31.78us
+VGA_VBLANK_SECONDS = 45 * 31.78e-6
+VGA_FRAME_SECONDS = 1 / 59.94
+
+ISR_VSYNC = 0x01
+
+class IsrVsync(object):
+    '''
+    Waits for VSYNC by polling the VSYNC flag in VERA_ISR, then clears it.
+
+    The frame period is learned from the detected edges. The waiter sleeps until shortly before
+    the predicted next VSYNC and then polls with a delay that doubles from `min_poll` up to
+    `max_poll`, so the bus is barely used while waiting.
+    '''
+
+    def __init__(self, vera: VERA, min_poll: float = 0.0002, max_poll: float = 0.002,
+                 period: float = VGA_FRAME_SECONDS, guard: float = 0.001):
+        self.vera = vera
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.period = period
+        self.guard = guard
+        self.polls = 0
+        self._last: Optional[float] = None
+
+    def _pending(self) -> bool:
+        return bool(self.vera.read_register(VERA_ISR) & ISR_VSYNC)
+
+    def _acknowledge(self) -> None:
+        self.vera.write_register(VERA_ISR, ISR_VSYNC)
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[float]:
+        '''
+        Block until VSYNC.
+
+        Returns:
+            float: perf_counter timestamp of the detected VSYNC, or None on timeout
+        '''
+        start = time.perf_counter()
+        deadline = None if timeout is None else start + timeout
+        if self._last is not None:
+            wake = self._last + self.period - self.guard
+            if wake > start and (deadline is None or wake < deadline):
+                time.sleep(wake - start)
+        delay = self.min_poll
+        while True:
+            self.polls += 1
+            if self._pending():
+                break
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_poll)
+        now = time.perf_counter()
+        self._acknowledge()
+        if self._last is not None and now - self._last < 2 * self.period:
+            # Track the real refresh rate with a slow moving average
+            self.period += (now - self._last - self.period) / 8
+        self._last = now
+        return now
+
+class McpIrqVsync(IsrVsync):
+    '''
+    Waits for VSYNC using VERA's IRQ# output, wired to pin `bit` of `port` on an MCP23017 that
+    is not the one driving the VERA bus (that one has no free pins). The expander is set to
+    flag the pin going low; polling its INTF register costs one I2C transaction instead of
+    the three of a VERA register read (four right after a write, which flips port A).
+    '''
+
+    def __init__(self, vera: VERA, mcp, port: int, bit: int, **kwargs):
+        super().__init__(vera, **kwargs)
+        self.mcp = mcp
+        self.port = port
+        self.mask = 1 << bit
+        mcp.write_register(mcp.IODIR_A + port, mcp.read_register(mcp.IODIR_A + port) | self.mask)
+        mcp.write_register(mcp.DEFVAL_A + port, mcp.read_register(mcp.DEFVAL_A + port) | self.mask)
+        mcp.write_register(mcp.INTCON_A + port, mcp.read_register(mcp.INTCON_A + port) | self.mask)
+        mcp.write_register(mcp.GPINTEN_A + port, mcp.read_register(mcp.GPINTEN_A + port) | self.mask)
+        vera.VSYNC_IEN = 1
+
+    def _pending(self) -> bool:
+        return bool(self.mcp.read_register(self.mcp.INTF_A + self.port) & self.mask)
+
+    def _acknowledge(self) -> None:
+        # Release VERA's IRQ# first, then read INTCAP to clear the expander's interrupt
+        super()._acknowledge()
+        self.mcp.read_register(self.mcp.INTCAP_A + self.port)
+
+@dataclass
+class FrameStats:
+    '''What happened in one committed frame.'''
+    frame: int
+    vsync_time: float
+    committed: int          # updates performed
+    spilled: int            # updates left for the next frame
+    elapsed: float          # seconds spent committing
+    budget: float
+
+    @property
+    def utilization(self) -> float:
+        return self.elapsed / self.budget if self.budget else 0.0
+
+    @property
+    def overrun(self) -> bool:
+        return self.elapsed > self.budget
+
+class _Update(object):
+    __slots__ = ('priority', 'sequence', 'action', 'cost')
+
+    def __init__(self, priority: int, sequence: int, action: Callable[[VERA], None],
+                 cost: Union[int, Callable[[], int]]):
+        self.priority = priority
+        self.sequence = sequence
+        self.action = action
+        self.cost = cost
+
+class FrameScheduler(object):
+    '''
+    Accumulates per-frame updates and commits them during vertical blank.
+
+    Args:
+        vera (VERA): Device to update
+        vsync: Object with a `wait(timeout)` method, `IsrVsync` by default
+        budget (float): Seconds available for commits after each VSYNC
+        history (int): Number of `FrameStats` kept in `stats`
+    '''
+
+    def __init__(self, vera: VERA, vsync=None, budget: float = VGA_VBLANK_SECONDS, history: int = 120):
+        self.vera = vera
+        self.vsync = vsync if vsync is not None else IsrVsync(vera)
+        self.budget = budget
+        self.stats = deque(maxlen=history)
+        self.frame = 0
+        self.overruns = 0
+        # Learned cost of one register write, used to decide whether an update still fits
+        self.seconds_per_write = 0.0
+        self._pending = {}
+        self._sequence = 0
+
+    def schedule(self, action: Callable[[VERA], None], priority: int = PRIORITY_VRAM,
+                 cost: Union[int, Callable[[], int]] = 1, key=None) -> None:
+        '''
+        Queue an update for the next frame.
+
+        Args:
+            action: Called with the `VERA` during vertical blank
+            priority (int): Lower values are committed first
+            cost: Estimated number of register writes the action performs, or a function
+                returning it, called when the update's turn comes
+            key: If given, replaces a pending update with the same key (keeping its place in
+                the queue), so only the latest value of e.g. a scroll register is sent
+        '''
+        if key is not None and key in self._pending:
+            update = self._pending[key]
+            update.action = action
+            update.cost = cost
+            return
+        self._sequence += 1
+        update = _Update(priority, self._sequence, action, cost)
+        self._pending[key if key is not None else ('_', self._sequence)] = update
+
+    def set_register(self, register: int, value: int, mask: int = 0, priority: int = PRIORITY_REGISTERS) -> None:
+        self.schedule(lambda vera: vera.write_register(register, value, mask), priority, 1,
+                      key=('register', register, mask))
+
+    def set_scroll(self, layer: int, hscroll: Optional[int] = None, vscroll: Optional[int] = None) -> None:
+        '''Queue new 12-bit scroll values for a layer.'''
+        base = VERA_L1_HSCROLL_L if layer else VERA_L0_HSCROLL_L
+        if hscroll is not None:
+            self.set_register(base, hscroll & 0xff)
+            self.set_register(base + 1, (hscroll >> 8) & 0x0f)
+        if vscroll is not None:
+            self.set_register(base + 2, vscroll & 0xff)
+            self.set_register(base + 3, (vscroll >> 8) & 0x0f)
+
+    def write_vram(self, address: int, data, priority: int = PRIORITY_VRAM, chunk: int = 256) -> None:
+        '''Queue a VRAM upload, split into chunks so a large upload can spread over frames.'''
+        data = bytes(memoryview(data).cast('B'))
+        for start in range(0, len(data), chunk):
+            part = data[start:start + chunk]
+            self.schedule(lambda vera, a=address + start, d=part: vera.write_vram(a, d), priority, len(part) + 3)
+
+    def commit_mirror(self, mirror, priority: int = PRIORITY_VRAM) -> None:
+        '''
+        Queue a `VramMirror.commit()`. Its cost is taken from the dirty ranges at commit time,
+        an upper bound that needs no diff against the committed copy.
+        '''
+        cost = lambda: sum(end - start + mirror.SEEK_COST for start, end in mirror.dirty)
+        self.schedule(lambda vera: mirror.commit(), priority, cost, key=('mirror', id(mirror)))
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def commit(self, vsync_time: Optional[float] = None) -> FrameStats:
+        '''Commit pending updates in priority order until the budget is spent.'''
+        start = time.perf_counter()
+        ordered = sorted(self._pending.items(), key=lambda item: (item[1].priority, item[1].sequence))
+        committed = 0
+        writes = 0
+        for key, update in ordered:
+            cost = update.cost() if callable(update.cost) else update.cost
+            elapsed = time.perf_counter() - start
+            if committed and elapsed + cost * self.seconds_per_write > self.budget:
+                break
+            update.action(self.vera)
+            del self._pending[key]
+            committed += 1
+            writes += cost
+        self.vera.sync()
+        elapsed = time.perf_counter() - start
+        if writes:
+            measured = elapsed / writes
+            if self.seconds_per_write:
+                self.seconds_per_write += (measured - self.seconds_per_write) / 4
+            else:
+                self.seconds_per_write = measured
+        self.frame += 1
+        stats = FrameStats(self.frame, vsync_time if vsync_time is not None else start,
+                           committed, len(self._pending), elapsed, self.budget)
+        if stats.overrun:
+            self.overruns += 1
+        self.stats.append(stats)
+        return stats
+
+    def run_frame(self, timeout: Optional[float] = None) -> Optional[FrameStats]:
+        '''Wait for VSYNC and commit. Returns None if VSYNC did not arrive within `timeout`.'''
+        vsync_time = self.vsync.wait(timeout)
+        if vsync_time is None:
+            return None
+        return self.commit(vsync_time)
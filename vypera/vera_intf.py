@@ -3,32 +3,193 @@ class VeraIntf:
     CS_N = (1 << 7)
     WE_N = (1 << 6)
     RE_N = (1 << 5)
-    def __init__(self, mcp):
+    # Bit times (8 data bits and ACK per byte) between two writes in a burst of four-byte records
+    RECORD_BITS = 4 * 9
+    # Seconds one SPI byte takes at VERA's slow clock (390.625 kHz)
+    SPI_SLOW_BYTE = 8 / 390_625
+
+    def __init__(self, mcp, i2c_clock: int = 400_000):
+        '''
+        Args:
+            mcp (MCP23017): Expander wired to VERA
+            i2c_clock (int): I2C clock of the bus the expander is on, in Hz
+        '''
         self.mcp = mcp
+        # SPI_DATA writes are RECORD_BITS apart: 90 us at 400 kHz, but only 21 us at the
+        # MCP23017's 1.7 MHz, too close to a 20 us SPI byte. With at least twice a byte time
+        # in between, VeraSpi need not poll the SPI busy flag.
+        self.spi_paced = self.RECORD_BITS / i2c_clock >= 2 * self.SPI_SLOW_BYTE
+        mcp.write_register(mcp.GPIO_B, self.CS_N | self.WE_N | self.RE_N)   # Strobes idle once driven
         mcp.port_mode(mcp.PORT_A, mcp.OUTPUT)
         mcp.port_mode(mcp.PORT_B, mcp.OUTPUT)
         self.ctrl = mcp.GPIO_B
         self.data = mcp.GPIO_A
+        self._input = False     # Port A direction; left as input after reads until the next write
     
+    # A register write is sent as a burst starting at GPIO_A. In byte mode the MCP23017
+    # alternates GPIO_A/GPIO_B, so each write is four bytes:
+    #   data <- value, ctrl <- CS#/WE# asserted, data <- value, ctrl <- deasserted
+    # Data is sampled on the rising edge of (CS# | WE#), so the value is held across the strobe.
+
+    def _strobes(self, index):
+        index &= 0x1f
+        return self.RE_N | index, self.CS_N | self.WE_N | self.RE_N | index
+
+    def _read_strobes(self, index):
+        index &= 0x1f
+        return self.WE_N | index, self.CS_N | self.WE_N | self.RE_N | index
+
+    def _set_input(self, value):
+        if self._input != value:
+            self.mcp.write_register(self.mcp.IODIR_A, 0xff if value else 0x00)
+            self._input = value
+
     def write_register(self, index, value):
-        # assert CS/WR and put address on bus
-        self.mcp.write_register(self.ctrl, self.RE_N | (index & 0x1f))
-        # Data appears on bus after CS/WR assertion
-        self.mcp.write_register(self.data, value & 0xff)
-        
-        # Data is sampled on rising edge of (CS# | WR#)
-        self.mcp.write_register(self.ctrl, self.CS_N | self.WE_N | self.RE_N | (index & 0x1f))
+        self._set_input(False)
+        assert_ctrl, release_ctrl = self._strobes(index)
+        self.mcp.write_block(self.data, bytes((value & 0xff, assert_ctrl, value & 0xff, release_ctrl)))
+
+    def write_registers(self, writes):
+        '''
+        Write a sequence of (index, value) register writes as one burst.
+
+        Args:
+            writes: iterable of (register index, byte value) pairs, applied in order
+        '''
+        self._set_input(False)
+        buf = bytearray()
+        for index, value in writes:
+            assert_ctrl, release_ctrl = self._strobes(index)
+            buf += bytes((value & 0xff, assert_ctrl, value & 0xff, release_ctrl))
+        if buf:
+            self.mcp.write_block(self.data, buf)
+
+    def write_stream(self, index, data):
+        '''
+        Write every byte of `data` to the same register, e.g. DATA0 with auto-increment.
+
+        Args:
+            index (int): VERA register index
+            data: bytes-like object
+        '''
+        self._set_input(False)
+        view = memoryview(data).cast('B')
+        count = len(view)
+        assert_ctrl, release_ctrl = self._strobes(index)
+        buf = bytearray(4 * count)
+        buf[0::4] = view
+        buf[1::4] = bytes((assert_ctrl,)) * count
+        buf[2::4] = view
+        buf[3::4] = bytes((release_ctrl,)) * count
+        if buf:
+            self.mcp.write_block(self.data, buf)
+
+    def fill(self, index, value, count):
+        '''
+        Write the same byte `count` times to a register.
+
+        The value is latched in OLAT_A once and the expander is switched to IOCON.BANK=1 for
+        the fill: with SEQOP=1 its address pointer then stays on GPIO_B, so each write is only
+        the two strobe bytes (asserted, released) instead of a four-byte record. Fills too
+        short to pay for the three extra register writes are sent as records.
+        '''
+        if count <= 0:
+            return
+        self._set_input(False)
+        mcp = self.mcp
+        assert_ctrl, release_ctrl = self._strobes(index)
+        per_record_chunk = max(1, mcp.block_limit // 4)
+        per_toggle_chunk = mcp.block_limit // 2
+        if -(-count // per_record_chunk) <= 3 + -(-count // per_toggle_chunk):
+            chunk = bytes((value & 0xff, assert_ctrl, value & 0xff, release_ctrl)) * per_record_chunk
+            while count > 0:
+                n = min(count, per_record_chunk)
+                mcp.write_block(self.data, chunk if n == per_record_chunk else chunk[:4 * n])
+                count -= n
+            return
+        mcp.write_register(mcp.OLAT_A, value & 0xff)
+        mcp.write_register(mcp.IOCON, mcp.IOCON_BYTE_MODE | mcp.IOCON_BANK)
+        try:
+            chunk = bytes((assert_ctrl, release_ctrl)) * per_toggle_chunk
+            while count > 0:
+                n = min(count, per_toggle_chunk)
+                mcp.write_block(mcp.BANK1_GPIO_B, chunk if n == per_toggle_chunk else chunk[:2 * n])
+                count -= n
+        finally:
+            mcp.write_register(mcp.BANK1_IOCON, mcp.IOCON_BYTE_MODE)
     
     def read_register(self, index):
-        self.mcp.write_register(self.mcp.IODIR_A, 0b11111111)
-        
-        self.mcp.write_register(self.ctrl, self.CS_N | self.WE_N | self.RE_N | (index & 0x1f)) # Address precedes CS#
-        self.mcp.write_register(self.ctrl, 0    | self.WE_N | 0    | (index & 0x1f)) # Assert CS#/RD#
-        
-        value = self.mcp.read_register(self.data)
-        
-        self.mcp.write_register(self.ctrl, self.CS_N | self.WE_N | self.RE_N | (index & 0x1f)) # Address precedes CS#
-        
-        self.mcp.write_register(self.mcp.IODIR_A, 0b00000000)
-
-        return value
+        return self.read_stream(index, 1)[0]
+
+    def read_stream(self, index, length):
+        '''
+        Read the same register `length` times, e.g. DATA0 with auto-increment.
+
+        Port A is switched to input once and stays that way until the next write. Between two
+        reads, RE# is released and asserted again by a single three byte block write to
+        GPIO_B (the middle byte lands in OLAT_A, which does not drive the bus while port A is
+        an input), so each byte costs one write and one read. If the bus supports combined
+        transactions, those are packed many to an I2C_RDWR call.
+
+        Args:
+            index (int): VERA register index
+            length (int): Number of reads
+
+        Returns:
+            bytearray: The values read
+        '''
+        if length <= 0:
+            return bytearray()
+        self._set_input(True)
+        assert_ctrl, release_ctrl = self._read_strobes(index)
+        toggle = bytes((release_ctrl, 0, assert_ctrl))
+        mcp = self.mcp
+        if mcp.supports_combined:
+            # After a write to GPIO_B the byte mode address pointer is left on GPIO_A, so each
+            # read needs no register address message of its own
+            operations = [(self.ctrl, bytes((assert_ctrl,))), (None, 1)]
+            operations += [(self.ctrl, toggle), (None, 1)] * (length - 1)
+            operations.append((self.ctrl, bytes((release_ctrl,))))
+            return bytearray(b''.join(mcp.transfer(operations)))
+        data = bytearray(length)
+        mcp.write_register(self.ctrl, assert_ctrl)
+        data[0] = mcp.read_register(self.data)
+        for i in range(1, length):
+            mcp.write_block(self.ctrl, toggle)
+            data[i] = mcp.read_register(self.data)
+        mcp.write_register(self.ctrl, release_ctrl)
+        return data
+
+    def exchange_stream(self, index, value, length):
+        '''
+        Write `value` to a register and read the register back, `length` times, e.g. to clock
+        bytes in through SPI_DATA.
+
+        Each round trip flips port A to output for the write and back to input for the read,
+        which is six I2C messages. If the bus supports combined transactions, seven round
+        trips go in one I2C_RDWR call instead of six transactions each.
+
+        Args:
+            index (int): VERA register index
+            value (int): Byte written before each read
+            length (int): Number of round trips
+
+        Returns:
+            bytearray: The values read
+        '''
+        mcp = self.mcp
+        if length <= 0:
+            return bytearray()
+        if not mcp.supports_combined:
+            data = bytearray(length)
+            for i in range(length):
+                self.write_register(index, value)
+                data[i] = self.read_register(index)
+            return data
+        write_assert, write_release = self._strobes(index)
+        read_assert, read_release = self._read_strobes(index)
+        record = bytes((value & 0xff, write_assert, value & 0xff, write_release))
+        operations = [(mcp.IODIR_A, b'\x00'), (self.data, record), (mcp.IODIR_A, b'\xff'),
+                      (self.ctrl, bytes((read_assert,))), (None, 1), (self.ctrl, bytes((read_release,)))]
+        self._input = True
+        return bytearray(b''.join(mcp.transfer(operations * length)))
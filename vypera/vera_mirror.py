@@ -0,0 +1,207 @@
+from bisect import bisect_left, bisect_right
+from typing import List, Tuple
+
+from vypera import increment_map
+
+VRAM_SIZE = 0x20000
+
+class VramMirror(object):
+    '''
+    Host-side copy of VERA's 128 KB of VRAM. Writes go to the mirror and mark the touched
+    range dirty; `commit()` compares the dirty ranges with what was last uploaded and only
+    sends the bytes that changed.
+
+    The mirror can also be written directly through `view` (a memoryview of the buffer),
+    in which case the caller must report the range with `mark_dirty()`.
+
+    What VRAM holds is unknown until it has been read with `fetch()` or written by a
+    commit, so bytes that were never fetched or committed are always uploaded when dirty,
+    even if the mirror holds the same value.
+    '''
+
+    # Cost of re-seeking the address pointer, in register writes (ADDR_L, ADDR_M, ADDR_H).
+    # Gaps between changed runs that are no longer than this are rewritten instead.
+    SEEK_COST = 3
+
+    # Granularity of the first-pass comparison against the committed copy.
+    COMPARE_BLOCK = 64
+
+    def __init__(self, vera, port: int = 0):
+        '''
+        Args:
+            vera (VERA): Device the mirror uploads to
+            port (int): Data port / address pointer used for uploads (0 or 1)
+        '''
+        self.vera = vera
+        self.port = port
+        self.data = bytearray(VRAM_SIZE)
+        self.view = memoryview(self.data)
+        self._committed = bytearray(VRAM_SIZE)
+        self._known = bytearray(VRAM_SIZE)     # 1 where VRAM is known to hold _committed
+        # Disjoint, sorted, non-adjacent dirty intervals [start, end)
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+
+    def __len__(self) -> int:
+        return VRAM_SIZE
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(VRAM_SIZE)
+            self.data[index] = value
+            if step < 0:
+                start, stop = stop + 1, start + 1
+            if stop > start:
+                self.mark_dirty(start, stop)
+        else:
+            if index < 0:
+                index += VRAM_SIZE
+            self.data[index] = value
+            self.mark_dirty(index, index + 1)
+
+    def write(self, address: int, data) -> None:
+        '''
+        Copy a buffer into the mirror at `address` and mark it dirty.
+
+        Args:
+            address (int): VRAM address of the first byte
+            data: Any object supporting the buffer protocol
+        '''
+        view = memoryview(data).cast('B')
+        end = address + len(view)
+        if address < 0 or end > VRAM_SIZE:
+            raise IndexError(address)
+        self.data[address:end] = view
+        self.mark_dirty(address, end)
+
+    def mark_dirty(self, start: int, end: int) -> None:
+        '''Mark VRAM range [start, end) as possibly changed.'''
+        if end <= start:
+            return
+        starts, ends = self._starts, self._ends
+        # Intervals overlapping or touching [start, end)
+        lo = bisect_left(ends, start)
+        hi = bisect_right(starts, end)
+        if lo < hi:
+            start = min(start, starts[lo])
+            end = max(end, ends[hi - 1])
+        starts[lo:hi] = [start]
+        ends[lo:hi] = [end]
+
+    @property
+    def dirty(self) -> List[Tuple[int, int]]:
+        '''The dirty intervals as a list of (start, end) tuples.'''
+        return list(zip(self._starts, self._ends))
+
+    def fetch(self, address: int = 0, length: int = VRAM_SIZE) -> None:
+        '''
+        Read a range of VRAM from the hardware into the mirror. The range is considered
+        committed afterwards.
+        '''
+        data = self.vera.read_vram(address, length, port=self.port)
+        self.data[address:address + length] = data
+        self._committed[address:address + length] = data
+        self._known[address:address + length] = b'\x01' * length
+
+    def adopt(self, data) -> None:
+        '''
+        Take a 128 KB image as both the mirror's contents and what VRAM is known to hold,
+        and clear the dirty state. For when VRAM was brought to that content another way.
+        '''
+        view = memoryview(data).cast('B')
+        if len(view) != VRAM_SIZE:
+            raise ValueError(f'VRAM image is {len(view)} bytes, expected {VRAM_SIZE}')
+        self.data[:] = view
+        self._committed[:] = view
+        self._known[:] = b'\x01' * VRAM_SIZE
+        self._starts.clear()
+        self._ends.clear()
+
+    def _changed_runs(self, start: int, end: int) -> List[List[int]]:
+        '''
+        Runs [start, end) of bytes in the given range that differ from the committed copy,
+        or whose VRAM content is unknown.
+        '''
+        data, committed, known = self.data, self._committed, self._known
+        block = self.COMPARE_BLOCK
+        runs: List[List[int]] = []
+        for block_start in range(start, end, block):
+            block_end = min(block_start + block, end)
+            known_block = known[block_start:block_end]
+            if 0 not in known_block:
+                if data[block_start:block_end] == committed[block_start:block_end]:
+                    continue
+            elif 1 not in known_block:
+                if runs and runs[-1][1] == block_start:
+                    runs[-1][1] = block_end
+                else:
+                    runs.append([block_start, block_end])
+                continue
+            for address in range(block_start, block_end):
+                if data[address] != committed[address] or not known[address]:
+                    if runs and runs[-1][1] == address:
+                        runs[-1][1] = address + 1
+                    else:
+                        runs.append([address, address + 1])
+        return runs
+
+    def plan(self) -> List[Tuple[int, int, int]]:
+        '''
+        Compute the uploads `commit()` would perform, without sending anything.
+
+        Returns:
+            list: (address, count, increment) tuples, in upload order
+        '''
+        runs: List[List[int]] = []
+        for start, end in zip(self._starts, self._ends):
+            for run in self._changed_runs(start, end):
+                # Rewriting a short unchanged gap is cheaper than re-seeking the pointer
+                if runs and run[0] - runs[-1][1] <= self.SEEK_COST:
+                    runs[-1][1] = run[1]
+                else:
+                    runs.append(run)
+
+        # Isolated single bytes at a regular spacing (a tilemap column, one attribute per
+        # sprite) are sent as one strided upload when the spacing is a VERA increment.
+        uploads: List[Tuple[int, int, int]] = []
+        i = 0
+        while i < len(runs):
+            start, end = runs[i]
+            j = i + 1
+            if end - start == 1 and j < len(runs) and runs[j][1] - runs[j][0] == 1:
+                step = runs[j][0] - start
+                if step in increment_map:
+                    while j < len(runs) and runs[j][1] - runs[j][0] == 1 and runs[j][0] - runs[j - 1][0] == step:
+                        j += 1
+                    if j - i > self.SEEK_COST:
+                        uploads.append((start, j - i, step))
+                        i = j
+                        continue
+                    j = i + 1
+            uploads.append((start, end - start, 1))
+            i = j
+        return uploads
+
+    def commit(self) -> int:
+        '''
+        Upload the changed bytes of the dirty ranges and clear the dirty state.
+
+        Returns:
+            int: Number of data bytes sent
+        '''
+        sent = 0
+        data, committed = self.data, self._committed
+        with self.vera.batch():
+            for address, count, step in self.plan():
+                end = address + count * step
+                chunk = data[address:end:step]
+                self.vera.write_vram(address, chunk, step, self.port)
+                committed[address:end:step] = chunk
+                self._known[address:end:step] = b'\x01' * count
+                sent += count
+        self._starts.clear()
+        self._ends.clear()
+        return sent
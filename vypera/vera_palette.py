@@ -0,0 +1,143 @@
+'''
+Palette management for VERA's 256-entry, 12-bit colour palette.
+
+Colours are converted from 24-bit RGB with NumPy. Fades and colour cycles are precomputed as
+tables of whole palettes, one per step, so running an effect is a table lookup followed by a
+commit. `Palette.commit()` uploads only the entries whose encoded value changed since the
+last commit, streaming each contiguous range of changed entries with auto-increment.
+
+Example:
+    palette = Palette(vera)
+    palette.set_rgb(level_colors)
+    palette.commit()
+    for step in palette.fade_table((0, 0, 0), 16):
+        palette.load(step)
+        palette.commit()
+'''
+from typing import Optional
+
+import numpy as np
+
+from vera_assets import diff_runs
+from vera_mirror import VramMirror
+from vypera import VERA
+
+PALETTE_BASE = 0x1FA00
+PALETTE_SIZE = 256
+
+def rgb_to_vera(rgb) -> np.ndarray:
+    '''
+    Convert 24-bit colours to VERA's 12-bit 0x0RGB format, rounding each channel.
+
+    Args:
+        rgb: (..., 3) array-like of 8-bit channel values
+
+    Returns:
+        np.ndarray: uint16 array of shape rgb.shape[:-1]
+    '''
+    rgb = np.asarray(rgb, dtype=np.uint16)
+    nibbles = (rgb * 15 + 127) // 255
+    return (nibbles[..., 0] << 8) | (nibbles[..., 1] << 4) | nibbles[..., 2]
+
+def vera_to_rgb(colors) -> np.ndarray:
+    '''Convert 12-bit colours back to (..., 3) 8-bit RGB.'''
+    colors = np.asarray(colors, dtype=np.uint16)
+    nibbles = np.stack([(colors >> 8) & 0xf, (colors >> 4) & 0xf, colors & 0xf], axis=-1)
+    return (nibbles * 17).astype(np.uint8)
+
+def encode_palette(colors) -> np.ndarray:
+    '''Encode 12-bit colours into VRAM byte order: GGGGBBBB, then 0000RRRR.'''
+    colors = np.asarray(colors, dtype=np.uint16)
+    encoded = np.empty(colors.shape + (2,), dtype=np.uint8)
+    encoded[..., 0] = colors & 0xff
+    encoded[..., 1] = (colors >> 8) & 0x0f
+    return encoded
+
+class Palette(object):
+    '''
+    Host-side copy of VERA's palette.
+
+    Attributes:
+        colors (np.ndarray): 256 12-bit colours. May be modified directly; `commit()` finds
+            the changes by comparing with what was uploaded.
+    '''
+
+    SEEK_COST = VramMirror.SEEK_COST
+
+    def __init__(self, vera: VERA, base: int = PALETTE_BASE):
+        self.vera = vera
+        self.base = base
+        self.colors = np.zeros(PALETTE_SIZE, dtype=np.uint16)
+        # Encoded palette the hardware is known to hold; None until the first commit or fetch()
+        self._committed: Optional[np.ndarray] = None
+
+    def set_rgb(self, rgb, start: int = 0) -> None:
+        '''Set consecutive entries from an (N, 3) array of 24-bit colours.'''
+        converted = rgb_to_vera(rgb).reshape(-1)
+        self.colors[start:start + len(converted)] = converted
+
+    def load(self, colors, start: int = 0) -> None:
+        '''Set consecutive entries from 12-bit colours, e.g. one row of a fade or cycle table.'''
+        colors = np.asarray(colors, dtype=np.uint16).reshape(-1)
+        self.colors[start:start + len(colors)] = colors
+
+    def fetch(self) -> None:
+        '''Read the palette from VRAM.'''
+        data = np.frombuffer(bytes(self.vera.read_vram(self.base, 2 * PALETTE_SIZE)), dtype=np.uint8)
+        self._committed = data.reshape(PALETTE_SIZE, 2).copy()
+        self.colors[:] = self._committed[:, 0] | (self._committed[:, 1].astype(np.uint16) << 8)
+
+    def commit(self) -> int:
+        '''
+        Upload the entries that changed since the last commit.
+
+        Returns:
+            int: Number of palette entries sent
+        '''
+        encoded = encode_palette(self.colors)
+        if self._committed is None:
+            self.vera.write_vram(self.base, encoded)
+            self._committed = encoded
+            return PALETTE_SIZE
+        sent = 0
+        flat = encoded.reshape(-1)
+        with self.vera.batch():
+            for start, end in diff_runs(self._committed, encoded, self.SEEK_COST):
+                # Keep whole entries together
+                start &= ~1
+                end += end & 1
+                self.vera.write_vram(self.base + start, flat[start:end])
+                sent += (end - start) // 2
+        self._committed = encoded
+        return sent
+
+    def fade_table(self, target, steps: int, start: int = 0, count: int = PALETTE_SIZE) -> np.ndarray:
+        '''
+        Precompute a fade of entries [start, start + count) from their current colours to `target`.
+
+        Args:
+            target: One RGB colour, or a (count, 3) array of RGB colours
+            steps (int): Number of steps after the current palette
+
+        Returns:
+            np.ndarray: (steps + 1, count) 12-bit colours; row 0 is the current palette and
+            the last row is the target
+        '''
+        source = vera_to_rgb(self.colors[start:start + count]).astype(np.float32)
+        target = np.broadcast_to(np.asarray(target, dtype=np.float32), source.shape)
+        weights = np.linspace(0.0, 1.0, steps + 1, dtype=np.float32)[:, np.newaxis, np.newaxis]
+        blended = source + (target - source) * weights
+        return rgb_to_vera(np.rint(blended).astype(np.uint8))
+
+    def cycle_table(self, start: int, count: int, step: int = 1) -> np.ndarray:
+        '''
+        Precompute a colour cycle that rotates entries [start, start + count).
+
+        Returns:
+            np.ndarray: (count // gcd, count) 12-bit colours, one row per position of the cycle,
+            to be passed to `load(row, start)`
+        '''
+        colors = self.colors[start:start + count]
+        positions = count // np.gcd(count, step)
+        shifts = (np.arange(positions)[:, np.newaxis] * step + np.arange(count)) % count
+        return colors[shifts]
@@ -0,0 +1,251 @@
+'''
+Driving many VERA boards at once.
+
+A `VeraPool` holds any number of VERA boards, each behind its own MCP23017, spread over one
+or more I2C buses. Every bus gets one worker thread: boards on the same bus are driven one
+after another, boards on different buses in parallel. Operations are either broadcast (the
+same call on every board) or scattered (a call with per-board arguments). Each board's
+outcome is recorded separately, so a failing board does not stop the others, and the
+timings are collected per board and per bus.
+
+Example:
+    pool = VeraPool.discover(buses=(1, 3, 4))
+    result = pool.broadcast(VERA.write_vram, 0x4000, tile_data)
+    result = pool.scatter(VERA.write_vram, {device: (0, maps[n]) for n, device in enumerate(pool)})
+    print(result.elapsed, result.bus_seconds, result.errors)
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Mapping, Optional, Sequence
+
+from mcp23017 import MCP23017
+from vera_intf import VeraIntf
+from vypera import VERA, VERA_ADDR_L
+
+# Addresses an MCP23017 can be strapped to
+MCP23017_ADDRESSES = range(0x20, 0x28)
+
+class PoolDevice(object):
+    '''
+    One board of a pool.
+
+    Attributes:
+        bus_id: Identifier of the I2C bus the board is on (e.g. the bus number)
+        address (int): I2C address of the board's MCP23017
+        vera (VERA): Driver for the board. Only use it through the pool while the pool is running
+            operations, as the pool's worker for `bus_id` owns the bus.
+        error (Exception): Error of the last failed operation, None if the board is healthy
+    '''
+
+    def __init__(self, bus_id: Hashable, address: int, vera: VERA):
+        self.bus_id = bus_id
+        self.address = address
+        self.vera = vera
+        self.error: Optional[BaseException] = None
+
+    @property
+    def name(self) -> str:
+        return f'{self.bus_id}:{self.address:#04x}'
+
+    def __repr__(self) -> str:
+        return f'PoolDevice({self.name})'
+
+@dataclass
+class DeviceResult:
+    device: PoolDevice
+    value: Any = None
+    error: Optional[BaseException] = None
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+@dataclass
+class PoolResult:
+    '''Outcome of one pool operation.'''
+    results: List[DeviceResult]
+    elapsed: float                                  # Wall clock time of the whole operation
+    bus_seconds: Dict[Hashable, float] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return all(result.ok for result in self.results)
+
+    @property
+    def errors(self) -> Dict[str, BaseException]:
+        return {result.device.name: result.error for result in self.results if not result.ok}
+
+    @property
+    def values(self) -> Dict[str, Any]:
+        return {result.device.name: result.value for result in self.results if result.ok}
+
+    @property
+    def slowest_bus(self) -> Optional[Hashable]:
+        return max(self.bus_seconds, key=self.bus_seconds.get, default=None)
+
+class VeraPool(object):
+    '''
+    A set of VERA boards on one or more I2C buses.
+
+    Args:
+        devices: Initial `PoolDevice`s
+    '''
+
+    def __init__(self, devices: Iterable[PoolDevice] = ()):
+        self.devices: List[PoolDevice] = []
+        self._workers: Dict[Hashable, ThreadPoolExecutor] = {}
+        for device in devices:
+            self._add(device)
+
+    def _add(self, device: PoolDevice) -> PoolDevice:
+        self.devices.append(device)
+        if device.bus_id not in self._workers:
+            self._workers[device.bus_id] = ThreadPoolExecutor(1, thread_name_prefix=f'vera-bus-{device.bus_id}')
+        return device
+
+    def add(self, bus_id: Hashable, bus, address: int, **mcp_options) -> PoolDevice:
+        '''
+        Add the board whose MCP23017 is at `address` on `bus` and initialise the expander.
+
+        Args:
+            bus_id: Identifier of the bus; boards with the same id share a worker
+            bus: Open SMBus-compatible object
+            address (int): I2C address of the MCP23017
+            mcp_options: Passed on to `MCP23017`, e.g. block_limit
+        '''
+        mcp = MCP23017(address, bus, **mcp_options)
+        mcp.init()
+        return self._add(PoolDevice(bus_id, address, VERA(VeraIntf(mcp))))
+
+    @classmethod
+    def discover(cls, buses: Iterable = (1,), addresses: Iterable[int] = MCP23017_ADDRESSES,
+                 open_bus: Optional[Callable[[Any], Any]] = None, **mcp_options) -> 'VeraPool':
+        '''
+        Find the boards on the given buses and initialise them. An address counts as a board
+        if an MCP23017 answers there; boards whose VERA does not respond are kept, with the
+        error recorded in `PoolDevice.error`.
+
+        Args:
+            buses: Bus numbers, opened with `open_bus`, or a mapping from bus id to an open
+                SMBus-compatible object
+            addresses: I2C addresses to probe on each bus
+            open_bus: Opens a bus number. Default: `smbus.SMBus`
+        '''
+        pool = cls()
+        if not isinstance(buses, Mapping):
+            if open_bus is None:
+                import smbus
+                open_bus = smbus.SMBus
+            buses = {number: open_bus(number) for number in buses}
+        for bus_id, bus in buses.items():
+            for address in addresses:
+                try:
+                    bus.read_byte_data(address, MCP23017.IOCON)
+                except OSError:
+                    continue
+                pool.add(bus_id, bus, address, **mcp_options)
+        pool.broadcast(probe)
+        return pool
+
+    def __iter__(self):
+        return iter(self.devices)
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    @property
+    def healthy(self) -> List[PoolDevice]:
+        return [device for device in self.devices if device.error is None]
+
+    def clear_errors(self) -> None:
+        for device in self.devices:
+            device.error = None
+
+    def _run_bus(self, jobs) -> List[DeviceResult]:
+        results = []
+        for device, function, args, kwargs in jobs:
+            start = time.perf_counter()
+            try:
+                value = function(device.vera, *args, **kwargs)
+                device.vera.sync()
+            except Exception as e:
+                device.error = e
+                results.append(DeviceResult(device, error=e, seconds=time.perf_counter() - start))
+            else:
+                results.append(DeviceResult(device, value, seconds=time.perf_counter() - start))
+        return results
+
+    def run(self, jobs: Sequence, skip_failed: bool = True) -> PoolResult:
+        '''
+        Run calls on boards, each bus's calls on its worker, and wait for all of them.
+
+        Args:
+            jobs: (device, function, args, kwargs) tuples; `function(device.vera, *args, **kwargs)`
+                is called. Calls for the same bus run in the given order.
+            skip_failed (bool): Leave out boards whose last operation failed
+        '''
+        by_bus: Dict[Hashable, list] = {}
+        for job in jobs:
+            device = job[0]
+            if skip_failed and device.error is not None:
+                continue
+            by_bus.setdefault(device.bus_id, []).append(job)
+        start = time.perf_counter()
+        futures = {bus_id: self._workers[bus_id].submit(self._run_bus, bus_jobs)
+                   for bus_id, bus_jobs in by_bus.items()}
+        results = []
+        bus_seconds = {}
+        for bus_id, future in futures.items():
+            bus_results = future.result()
+            bus_seconds[bus_id] = sum(result.seconds for result in bus_results)
+            results.extend(bus_results)
+        return PoolResult(results, time.perf_counter() - start, bus_seconds)
+
+    def broadcast(self, function: Callable, *args, skip_failed: bool = True, **kwargs) -> PoolResult:
+        '''
+        Call `function(vera, *args, **kwargs)` for every board.
+
+        Example:
+            pool.broadcast(VERA.configure_layer, 1, 32, 64, False, False, 4, 0, 0x4000, 8, 8)
+        '''
+        return self.run([(device, function, args, kwargs) for device in self.devices], skip_failed)
+
+    def scatter(self, function: Callable, arguments, skip_failed: bool = True) -> PoolResult:
+        '''
+        Call `function(vera, *arguments[device])` with per-board arguments.
+
+        Args:
+            arguments: Mapping from `PoolDevice` to an argument tuple, or a sequence of argument
+                tuples in the order of `devices`. Boards without arguments are left out.
+        '''
+        if isinstance(arguments, Mapping):
+            pairs = arguments.items()
+        else:
+            pairs = zip(self.devices, arguments)
+        return self.run([(device, function, tuple(args), {}) for device, args in pairs], skip_failed)
+
+    def close(self) -> None:
+        '''Stop the bus workers.'''
+        for worker in self._workers.values():
+            worker.shutdown()
+        self._workers.clear()
+
+    def __enter__(self) -> 'VeraPool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+def probe(vera: VERA, value: int = 42) -> None:
+    '''
+    Check that a VERA answers by writing ADDR_L and reading it back.
+
+    Raises:
+        IOError: The value read back differs
+    '''
+    vera.write_register(VERA_ADDR_L, value)
+    read = vera.read_register(VERA_ADDR_L)
+    if read != value:
+        raise IOError(f'VERA not responding: wrote {value:#04x} to ADDR_L, read {read:#04x}')
@@ -0,0 +1,145 @@
+'''
+Software rendering of VERA's layers from a VRAM snapshot, for visual regression tests.
+
+`screenshot()` reads the display and layer registers, takes (or is given) a VRAM snapshot
+and composes the enabled tile and bitmap layers, with their scroll offsets, palette offsets
+and tile flips, into an RGB NumPy array at the layer resolution set by DC_HSCALE/DC_VSCALE.
+Sprites and the DC_HSTART/HSTOP/VSTART/VSTOP border window are not rendered.
+
+Example:
+    image = screenshot(vera)
+    assert np.array_equal(image, np.load('expected/title_screen.npy'))
+    write_ppm('actual.ppm', image)
+'''
+import numpy as np
+
+from vera_palette import PALETTE_BASE, PALETTE_SIZE, vera_to_rgb
+from vypera import (
+    VERA, VERA_CTRL, VERA_DC_VIDEO, VERA_DC_HSCALE, VERA_DC_VSCALE, VERA_L0_CONFIG, VERA_L1_CONFIG,
+    depth_map, tile_dimensions_map,
+)
+
+SCREEN_WIDTH = 640
+SCREEN_HEIGHT = 480
+
+_depth_bits = {code: bpp for bpp, code in depth_map.items()}
+_map_tiles = {code: tiles for tiles, code in tile_dimensions_map.items()}
+
+def decode_palette(vram) -> np.ndarray:
+    '''Return the palette in a VRAM snapshot as a (256, 3) RGB array.'''
+    raw = np.frombuffer(bytes(vram[PALETTE_BASE:PALETTE_BASE + 2 * PALETTE_SIZE]), dtype=np.uint8)
+    return vera_to_rgb(raw[0::2] | (raw[1::2].astype(np.uint16) << 8))
+
+def _pixels(vram: np.ndarray, addresses: np.ndarray, bit_offsets: np.ndarray, bpp: int) -> np.ndarray:
+    '''Fetch pixels of `bpp` bits at byte `addresses`, `bit_offsets` counted from the leftmost pixel.'''
+    data = vram[addresses & 0x1ffff]
+    if bpp == 8:
+        return data
+    return (data >> (8 - bpp - bit_offsets)) & ((1 << bpp) - 1)
+
+def render_layer(vram: np.ndarray, registers, width: int, height: int) -> np.ndarray:
+    '''
+    Render one layer to palette indices, 0 meaning transparent.
+
+    Args:
+        vram (np.ndarray): 128 KB VRAM snapshot as uint8
+        registers: The layer's 7 register values, CONFIG through VSCROLL_H
+        width (int): Width of the rendered area in layer pixels
+        height (int): Height in layer pixels
+
+    Returns:
+        np.ndarray: (height, width) uint8 palette indices
+    '''
+    config, map_base, tile_base, hscroll_l, hscroll_h, vscroll_l, vscroll_h = registers
+    bpp = _depth_bits[config & 0x03]
+    bitmap_mode = bool(config & 0x04)
+    t256c = bool(config & 0x08)
+    tile_address = (tile_base >> 2) << 11
+    tile_width = 16 if tile_base & 0x01 else 8
+    y, x = np.mgrid[0:height, 0:width]
+
+    if bitmap_mode:
+        # TILE_W selects a 320 or 640 pixel wide bitmap; HSCROLL_H holds the palette offset
+        bitmap_width = 640 if tile_base & 0x01 else 320
+        palette_offset = hscroll_h & 0x0f
+        pixel = y * bitmap_width + x
+        colors = _pixels(vram, tile_address + pixel * bpp // 8, (pixel * bpp) % 8, bpp)
+        if bpp < 8:
+            colors = np.where(colors != 0, colors + 16 * palette_offset, 0)
+        elif palette_offset:
+            colors = np.where((colors > 0) & (colors < 16), colors + 16 * palette_offset, colors)
+        return np.where(x < bitmap_width, colors, 0).astype(np.uint8)
+
+    tile_height = 16 if tile_base & 0x02 else 8
+    map_width = _map_tiles[(config >> 4) & 0x03]
+    map_height = _map_tiles[(config >> 6) & 0x03]
+    hscroll = hscroll_l | (hscroll_h & 0x0f) << 8
+    vscroll = vscroll_l | (vscroll_h & 0x0f) << 8
+    mx = (x + hscroll) % (map_width * tile_width)
+    my = (y + vscroll) % (map_height * tile_height)
+    entry = (map_base << 9) + 2 * ((my // tile_height) * map_width + mx // tile_width)
+    byte0 = vram[entry & 0x1ffff].astype(np.int32)
+    byte1 = vram[(entry + 1) & 0x1ffff].astype(np.int32)
+    px = mx % tile_width
+    py = my % tile_height
+
+    if bpp == 1:
+        tile_bytes = tile_width * tile_height // 8
+        pixel = py * tile_width + px
+        bit = _pixels(vram, tile_address + byte0 * tile_bytes + pixel // 8, pixel % 8, 1)
+        if t256c:
+            return np.where(bit != 0, byte1, 0).astype(np.uint8)
+        return np.where(bit != 0, byte1 & 0x0f, byte1 >> 4).astype(np.uint8)
+
+    index = byte0 | (byte1 & 0x03) << 8
+    px = np.where(byte1 & 0x04, tile_width - 1 - px, px)
+    py = np.where(byte1 & 0x08, tile_height - 1 - py, py)
+    palette_offset = byte1 >> 4
+    tile_bytes = tile_width * tile_height * bpp // 8
+    pixel = py * tile_width + px
+    colors = _pixels(vram, tile_address + index * tile_bytes + pixel * bpp // 8, (pixel * bpp) % 8, bpp)
+    colors = colors.astype(np.int32)
+    if bpp < 8:
+        colors = np.where(colors != 0, colors + 16 * palette_offset, 0)
+    else:
+        colors = np.where((colors > 0) & (colors < 16), colors + 16 * palette_offset, colors)
+    return colors.astype(np.uint8)
+
+def screenshot(vera: VERA, vram=None) -> np.ndarray:
+    '''
+    Render what the enabled layers show.
+
+    Args:
+        vera (VERA): Device to read the display configuration from
+        vram: VRAM snapshot to render from. Default: `vera.snapshot_vram()`
+
+    Returns:
+        np.ndarray: (height, width, 3) uint8 RGB image
+    '''
+    if vram is None:
+        vram = vera.snapshot_vram()
+    vram = np.frombuffer(bytes(vram), dtype=np.uint8)
+
+    ctrl = vera.read_register(VERA_CTRL)
+    vera.write_register(VERA_CTRL, 0, 0x02)        # DCSEL 0
+    video = vera.read_register(VERA_DC_VIDEO)
+    hscale = vera.read_register(VERA_DC_HSCALE) or 128
+    vscale = vera.read_register(VERA_DC_VSCALE) or 128
+    vera.write_register(VERA_CTRL, ctrl, 0x02)
+    width = SCREEN_WIDTH * hscale // 128
+    height = SCREEN_HEIGHT * vscale // 128
+
+    indices = np.zeros((height, width), dtype=np.uint8)
+    for enable, base in ((0x10, VERA_L0_CONFIG), (0x20, VERA_L1_CONFIG)):
+        if video & enable:
+            registers = [vera.read_register(base + n) for n in range(7)]
+            layer = render_layer(vram, registers, width, height)
+            indices = np.where(layer != 0, layer, indices)
+    return decode_palette(vram)[indices]
+
+def write_ppm(path: str, image: np.ndarray) -> None:
+    '''Save an RGB image as a binary PPM, viewable without any imaging library.'''
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    with open(path, 'wb') as f:
+        f.write(b'P6 %d %d 255\n' % (image.shape[1], image.shape[0]))
+        f.write(image.tobytes())
@@ -0,0 +1,176 @@
+'''
+Smooth scrolling over tile worlds larger than VERA's 256x256-tile maps.
+
+The world is a (rows, columns, 2) array of map entries on the host, in the format produced by
+`vera_assets.build_tilemap`; large worlds can be memory-mapped from a .npy file with
+`open_world`. The layer's hardware map is used as a ring buffer: world tile (column, row) is
+stored at map position (column % map_width, row % map_height), and the layer's 12-bit scroll
+registers hold the camera position modulo the map size, so the hardware wraps around the
+ring by itself.
+
+Moving the camera costs the scroll register writes that actually change (unchanged values
+are elided by the register shadow) plus, for each tile boundary crossed, one newly exposed
+row (streamed with increment 1) or column (streamed with the map pitch as increment).
+
+Example:
+    vera.configure_layer(1, 64, 64, False, False, 4, MAP_BASE, TILE_BASE, 8, 8)
+    scroller = TileScroller(vera, 1, open_world('level.npy'), MAP_BASE, 64, 64)
+    frames.schedule(lambda vera: scroller.scroll_to(x, y), PRIORITY_REGISTERS, key='camera')
+'''
+from typing import Optional, Tuple
+
+import numpy as np
+
+from vypera import VERA, VERA_L0_HSCROLL_L, VERA_L1_HSCROLL_L, increment_map, tile_dimensions_map
+
+def open_world(path: str) -> np.ndarray:
+    '''Memory-map a world saved with `np.save` as a (rows, columns, 2) uint8 array.'''
+    world = np.load(path, mmap_mode='r')
+    if world.ndim != 3 or world.shape[2] != 2 or world.dtype != np.uint8:
+        raise ValueError(f'{path}: expected a (rows, columns, 2) uint8 array, got {world.shape} {world.dtype}')
+    return world
+
+class TileScroller(object):
+    '''
+    Streams a large world through a tile layer's map as the camera moves.
+
+    The layer must already be configured as a tile layer with the given map and tile sizes.
+
+    Args:
+        vera (VERA): Device
+        layer (int): Layer index (0 or 1)
+        world: (rows, columns, 2) uint8 array of map entries
+        map_base (int): VRAM address of the layer's map
+        map_width (int): Map width in tiles (32, 64, 128 or 256)
+        map_height (int): Map height in tiles
+        tile_width (int): Tile width in pixels (8 or 16)
+        tile_height (int): Tile height in pixels
+        screen_width (int): Visible width in layer pixels, after scaling
+        screen_height (int): Visible height in layer pixels
+        blank (tuple): Map entry shown outside the world
+        port (int): Data port / address pointer used for the uploads
+
+    Raises:
+        ValueError: The map is too small to hold the visible area plus one tile
+    '''
+
+    def __init__(self, vera: VERA, layer: int, world: np.ndarray, map_base: int,
+                 map_width: int = 64, map_height: int = 64, tile_width: int = 8, tile_height: int = 8,
+                 screen_width: int = 640, screen_height: int = 480, blank: Tuple[int, int] = (0, 0),
+                 port: int = 0):
+        if map_width not in tile_dimensions_map or map_height not in tile_dimensions_map:
+            raise ValueError(f'map size {map_width}x{map_height}')
+        self.vera = vera
+        self.world = world
+        self.map_base = map_base
+        self.map_width = map_width
+        self.map_height = map_height
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.pitch = 2 * map_width
+        self.blank = np.asarray(blank, dtype=np.uint8)
+        self.port = port
+        self.scroll_register = VERA_L1_HSCROLL_L if layer else VERA_L0_HSCROLL_L
+        # Tiles kept loaded: everything a screen at any sub-tile offset can show
+        self.view_columns = -(-screen_width // tile_width) + 1
+        self.view_rows = -(-screen_height // tile_height) + 1
+        if self.view_columns > map_width or self.view_rows > map_height:
+            raise ValueError(f'{map_width}x{map_height} map cannot hold a '
+                             f'{self.view_columns}x{self.view_rows}-tile view')
+        if self.pitch not in increment_map:
+            raise ValueError(f'map pitch {self.pitch} is not a VERA increment')
+        self.column: Optional[int] = None      # World tile at the top left of the loaded view
+        self.row: Optional[int] = None
+        self.x = 0
+        self.y = 0
+        self.tiles_sent = 0
+
+    def _entries(self, row: int, column: int, rows: int, columns: int) -> np.ndarray:
+        '''World entries of a rectangle, with `blank` outside the world.'''
+        entries = np.empty((rows, columns, 2), dtype=np.uint8)
+        entries[...] = self.blank
+        world_rows, world_columns = self.world.shape[:2]
+        r0, r1 = max(row, 0), min(row + rows, world_rows)
+        c0, c1 = max(column, 0), min(column + columns, world_columns)
+        if r0 < r1 and c0 < c1:
+            entries[r0 - row:r1 - row, c0 - column:c1 - column] = self.world[r0:r1, c0:c1]
+        return entries
+
+    @staticmethod
+    def _segments(start: int, count: int, size: int):
+        '''Split `count` ring positions from `start` at the wrap: (ring position, offset, length).'''
+        position = start % size
+        first = min(count, size - position)
+        yield position, 0, first
+        if first < count:
+            yield 0, first, count - first
+
+    def _upload_row(self, row: int, column: int, columns: int) -> None:
+        entries = self._entries(row, column, 1, columns)[0]
+        line = self.map_base + (row % self.map_height) * self.pitch
+        for x, offset, length in self._segments(column, columns, self.map_width):
+            self.vera.write_vram(line + 2 * x, entries[offset:offset + length], 1, self.port)
+        self.tiles_sent += columns
+
+    def _upload_column(self, column: int, row: int, rows: int) -> None:
+        entries = self._entries(row, column, rows, 1)[:, 0]
+        base = self.map_base + 2 * (column % self.map_width)
+        for y, offset, length in self._segments(row, rows, self.map_height):
+            address = base + y * self.pitch
+            segment = entries[offset:offset + length]
+            # Tile index bytes, then attribute bytes, each walking down the column
+            self.vera.write_vram(address, np.ascontiguousarray(segment[:, 0]), self.pitch, self.port)
+            self.vera.write_vram(address + 1, np.ascontiguousarray(segment[:, 1]), self.pitch, self.port)
+        self.tiles_sent += rows
+
+    def load(self, x: int, y: int) -> None:
+        '''Upload the whole view for camera position (`x`, `y`) and scroll there.'''
+        column, row = x // self.tile_width, y // self.tile_height
+        with self.vera.batch():
+            for r in range(row, row + self.view_rows):
+                self._upload_row(r, column, self.view_columns)
+            self._set_scroll(x, y)
+        self.column, self.row = column, row
+
+    def scroll_to(self, x: int, y: int) -> None:
+        '''
+        Move the camera so world pixel (`x`, `y`) is at the top left of the screen, uploading
+        the rows and columns that come into view. Call during vertical blank, so the new tiles
+        and the new scroll position appear together.
+        '''
+        if self.column is None:
+            self.load(x, y)
+            return
+        column, row = x // self.tile_width, y // self.tile_height
+        if abs(column - self.column) >= self.view_columns or abs(row - self.row) >= self.view_rows:
+            self.load(x, y)
+            return
+        with self.vera.batch():
+            if column > self.column:
+                exposed = range(self.column + self.view_columns, column + self.view_columns)
+            else:
+                exposed = range(column, self.column)
+            for c in exposed:
+                self._upload_column(c, row, self.view_rows)
+            if row > self.row:
+                exposed = range(self.row + self.view_rows, row + self.view_rows)
+            else:
+                exposed = range(row, self.row)
+            for r in exposed:
+                self._upload_row(r, column, self.view_columns)
+            self._set_scroll(x, y)
+        self.column, self.row = column, row
+
+    def scroll_by(self, dx: int, dy: int) -> None:
+        self.scroll_to(self.x + dx, self.y + dy)
+
+    def _set_scroll(self, x: int, y: int) -> None:
+        # The ring is at most 256 tiles of 16 pixels, so positions modulo it fit in 12 bits
+        hscroll = x % (self.map_width * self.tile_width)
+        vscroll = y % (self.map_height * self.tile_height)
+        register = self.scroll_register
+        self.vera.write_register(register, hscroll & 0xff)
+        self.vera.write_register(register + 1, hscroll >> 8)
+        self.vera.write_register(register + 2, vscroll & 0xff)
+        self.vera.write_register(register + 3, vscroll >> 8)
+        self.x, self.y = x, y
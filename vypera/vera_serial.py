@@ -0,0 +1,225 @@
+'''
+VERA register bus over a serial link to a microcontroller bridge (see vera_bridge/vera_bridge.ino).
+
+`SerialBus` implements the same bus interface as `VeraIntf`, so `VERA(SerialBus('/dev/ttyACM0'))`
+works unchanged. Every call is one or more request frames; requests are pipelined, so a
+write returns as soon as its frame is sent, and only reads (and `sync()`) wait for replies.
+
+Protocol
+--------
+All multi-byte fields are little-endian. The CRC is CRC-16/CCITT-FALSE (polynomial 0x1021,
+initial value 0xFFFF) over every byte after the sync byte, up to the end of the payload.
+
+    Request:    0xA5 | seq | opcode | length (2) | payload (length) | crc (2)
+    Response:   0x5A | seq | status | length (2) | payload (length) | crc (2)
+
+`seq` is chosen by the host and echoed in the response. The bridge executes requests in
+the order received and answers each one, in order.
+
+    Opcode          Payload                                 Response payload
+    0x00 PING       -                                       protocol version (1 byte)
+    0x01 WRITE      (register, value) pairs, in order       -
+    0x02 READ       register                                value
+    0x03 STREAM     register, data...                       -
+    0x04 FILL       register, value, count (4)              -
+    0x05 READ_STREAM register, count (2)                    count values
+    0x06 EXCHANGE   register, value, count (2)              count values
+
+STREAM writes every data byte to the register, FILL writes `value` `count` times and
+READ_STREAM reads the register `count` times, so with DATA0/DATA1 these are auto-increment
+block transfers. EXCHANGE writes `value` and reads the register back, `count` times, which
+clocks bytes in through SPI_DATA.
+
+Accesses to SPI_DATA are paced: the bridge waits for the busy bit of SPI_CTRL to clear
+before every read or write of SPI_DATA, in every opcode. A byte takes about 20 us at
+VERA's slow SPI clock, while back-to-back bus writes are about 1 us apart, so without the
+wait a STREAM or FILL to SPI_DATA would overrun the SPI port. The host therefore never
+polls SPI busy itself (`SerialBus.spi_paced`).
+
+    Status  0 OK, 1 bad CRC, 2 unknown opcode, 3 bad length
+
+A request with a bad CRC, unknown opcode or bad length is not executed. Payloads are at most
+`MAX_PAYLOAD` bytes. The bridge drains the serial port into a `RX_WINDOW` byte receive buffer
+even while it executes a request, so the host keeps at most that many request bytes
+unanswered. After a link error the host raises rather than retrying: requests pipelined
+behind the failed one have already been executed.
+'''
+import binascii
+import struct
+from collections import deque
+from typing import Optional
+
+SYNC_REQUEST = 0xa5
+SYNC_RESPONSE = 0x5a
+PROTOCOL_VERSION = 2
+
+OP_PING = 0x00
+OP_WRITE = 0x01
+OP_READ = 0x02
+OP_STREAM = 0x03
+OP_FILL = 0x04
+OP_READ_STREAM = 0x05
+OP_EXCHANGE = 0x06
+
+STATUS_OK = 0
+STATUS_BAD_CRC = 1
+STATUS_BAD_OPCODE = 2
+STATUS_BAD_LENGTH = 3
+
+MAX_PAYLOAD = 512
+RX_WINDOW = 1024
+
+HEADER = struct.Struct('<BBBH')
+CRC = struct.Struct('<H')
+
+def crc16(data, crc: int = 0xffff) -> int:
+    '''CRC-16/CCITT-FALSE.'''
+    return binascii.crc_hqx(data, crc)
+
+def encode_frame(sync: int, seq: int, code: int, payload=b'') -> bytes:
+    '''Build a request (sync 0xA5, code = opcode) or response (sync 0x5A, code = status) frame.'''
+    body = HEADER.pack(sync, seq, code, len(payload))[1:] + bytes(payload)
+    return bytes((sync,)) + body + CRC.pack(crc16(body))
+
+class SerialBridgeError(IOError):
+    '''The bridge rejected a request, or the link lost or corrupted a frame.'''
+
+class SerialBus(object):
+    '''
+    Register bus through a serial bridge.
+
+    Args:
+        port: Serial device name (opened with pyserial), or an open object with `read(n)` and
+            `write(data)`, such as a `serial.Serial`
+        baudrate (int): Baud rate when opening `port` by name
+        timeout (float): Seconds to wait for a response when opening `port` by name
+        window (int): Maximum request bytes sent but not yet answered
+    '''
+
+    # The bridge waits out SPI transfers itself (protocol version 2), see the module docstring
+    spi_paced = True
+
+    def __init__(self, port, baudrate: int = 1_000_000, timeout: float = 1.0, window: int = RX_WINDOW):
+        if isinstance(port, str):
+            import serial
+            port = serial.Serial(port, baudrate, timeout=timeout)
+        self.port = port
+        self.window = window
+        self._seq = 0
+        self._outstanding = deque()    # (seq, request size, callback or None) per unanswered request
+        self._outstanding_bytes = 0
+        self._error: Optional[SerialBridgeError] = None
+        self.requests = 0
+
+    def _read_exact(self, count: int) -> bytes:
+        data = bytearray()
+        while len(data) < count:
+            chunk = self.port.read(count - len(data))
+            if not chunk:
+                raise SerialBridgeError(f'timed out waiting for the bridge ({len(data)} of {count} bytes)')
+            data += chunk
+        return bytes(data)
+
+    def _receive(self) -> None:
+        '''Read the response to the oldest unanswered request.'''
+        seq, size, callback = self._outstanding.popleft()
+        self._outstanding_bytes -= size
+        while self._read_exact(1)[0] != SYNC_RESPONSE:
+            pass
+        header = self._read_exact(HEADER.size - 1)
+        _, response_seq, status, length = HEADER.unpack(b'\0' + header)
+        payload = self._read_exact(length)
+        crc, = CRC.unpack(self._read_exact(CRC.size))
+        if crc != crc16(header + payload):
+            raise SerialBridgeError('corrupted response')
+        if response_seq != seq:
+            raise SerialBridgeError(f'response {response_seq} does not match request {seq}')
+        if status != STATUS_OK:
+            error = SerialBridgeError(f'bridge rejected request {seq}: status {status}')
+            if callback is None:
+                self._error = self._error or error
+                return
+            raise error
+        if callback is not None:
+            callback(payload)
+
+    def _raise_pending_error(self) -> None:
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _send(self, opcode: int, payload=b'', callback=None) -> None:
+        '''Send a request, first waiting for replies if the bridge's receive window is full.'''
+        frame = encode_frame(SYNC_REQUEST, self._seq, opcode, payload)
+        while self._outstanding and self._outstanding_bytes + len(frame) > self.window:
+            self._receive()
+        self._raise_pending_error()
+        self.port.write(frame)
+        self._outstanding.append((self._seq, len(frame), callback))
+        self._outstanding_bytes += len(frame)
+        self._seq = (self._seq + 1) & 0xff
+        self.requests += 1
+
+    def sync(self) -> None:
+        '''Wait for every request to be answered, then raise any error a write ran into.'''
+        while self._outstanding:
+            self._receive()
+        self._raise_pending_error()
+
+    def ping(self) -> int:
+        '''Return the bridge's protocol version.'''
+        result = []
+        self._send(OP_PING, b'', result.append)
+        self.sync()
+        return result[0][0]
+
+    def write_register(self, index: int, value: int) -> None:
+        self._send(OP_WRITE, bytes((index & 0x1f, value & 0xff)))
+
+    def write_registers(self, writes) -> None:
+        payload = bytearray()
+        for index, value in writes:
+            payload += bytes((index & 0x1f, value & 0xff))
+        for start in range(0, len(payload), MAX_PAYLOAD):
+            self._send(OP_WRITE, payload[start:start + MAX_PAYLOAD])
+
+    def write_stream(self, index: int, data) -> None:
+        view = memoryview(data).cast('B')
+        prefix = bytes((index & 0x1f,))
+        for start in range(0, len(view), MAX_PAYLOAD - 1):
+            self._send(OP_STREAM, prefix + view[start:start + MAX_PAYLOAD - 1])
+
+    def fill(self, index: int, value: int, count: int) -> None:
+        if count > 0:
+            self._send(OP_FILL, struct.pack('<BBI', index & 0x1f, value & 0xff, count))
+
+    def read_register(self, index: int) -> int:
+        result = []
+        self._send(OP_READ, bytes((index & 0x1f,)), result.append)
+        self.sync()
+        return result[0][0]
+
+    def read_stream(self, index: int, length: int) -> bytearray:
+        data = bytearray()
+        for start in range(0, length, MAX_PAYLOAD):
+            # All the requests go out before the first reply is awaited
+            self._send(OP_READ_STREAM, struct.pack('<BH', index & 0x1f, min(MAX_PAYLOAD, length - start)),
+                       data.extend)
+        self.sync()
+        return data
+
+    def exchange_stream(self, index: int, value: int, length: int) -> bytearray:
+        data = bytearray()
+        for start in range(0, length, MAX_PAYLOAD):
+            self._send(OP_EXCHANGE, struct.pack('<BBH', index & 0x1f, value & 0xff,
+                                                min(MAX_PAYLOAD, length - start)), data.extend)
+        self.sync()
+        return data
+
+    def close(self) -> None:
+        try:
+            self.sync()
+        finally:
+            close = getattr(self.port, 'close', None)
+            if close is not None:
+                close()
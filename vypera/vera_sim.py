@@ -0,0 +1,673 @@
+import ctypes
+import os
+import struct
+import threading
+import tty
+from typing import Optional
+
+from vypera import (
+    VERA_ADDR_L, VERA_ADDR_M, VERA_ADDR_H, VERA_DATA_0, VERA_DATA_1, VERA_CTRL,
+    VERA_IEN, VERA_ISR, VERA_DC_VIDEO, VERA_DC_BORDER,
+    VERA_AUDIO_CTRL, VERA_AUDIO_DATA, VERA_SPI_DATA, VERA_SPI_CTRL,
+    increment_reverse_map,
+)
+from vera_serial import (
+    CRC, HEADER, MAX_PAYLOAD, OP_EXCHANGE, OP_FILL, OP_PING, OP_READ, OP_READ_STREAM, OP_STREAM, OP_WRITE,
+    PROTOCOL_VERSION, STATUS_BAD_CRC, STATUS_BAD_LENGTH, STATUS_BAD_OPCODE, STATUS_OK,
+    SYNC_REQUEST, SYNC_RESPONSE, crc16, encode_frame,
+)
+
+VRAM_SIZE = 0x20000
+AUDIO_FIFO_SIZE = 4096
+
+class VeraSim(object):
+    '''
+    Software model of VERA's register interface: the 32 registers with the DCSEL banks,
+    both VRAM address pointers with INCR/DECR, 128 KB of VRAM, the audio FIFO and the SPI
+    port. It implements the same bus interface as `VeraIntf`, so it can be handed to `VERA`
+    directly, or driven through `SimSMBus` to exercise the real MCP23017 strobe protocol.
+
+    Attributes:
+        vram (bytearray): VRAM contents
+        reads (int): Number of register reads performed
+        writes (int): Number of register writes performed
+        spi_device: Optional object with `select(bool)` and `transfer(int) -> int`
+            attached to the SPI port
+        spi_busy_accesses (int): Register accesses an SPI byte transfer lasts. While it runs,
+            SPI_CTRL reads with the busy bit set, SPI_DATA still holds the previous byte
+            received, and a write to SPI_DATA is lost and counted in `spi_overruns`. 0
+            finishes every transfer at once.
+        spi_overruns (int): Number of SPI_DATA writes lost to a transfer in progress
+    '''
+
+    def __init__(self, spi_device=None, spi_busy_accesses: int = 0):
+        self.vram = bytearray(VRAM_SIZE)
+        self.spi_device = spi_device
+        self.spi_busy_accesses = spi_busy_accesses
+        self.spi_overruns = 0
+        self._clock = 0                     # Register accesses so far, the model's time base
+        self.reads = 0
+        self.writes = 0
+        self.reset()
+
+    def reset(self) -> None:
+        '''Return every register to its power-on value. VRAM is left untouched.'''
+        self.regs = bytearray(32)
+        self.dc_bank1 = bytearray(4)
+        self.regs[0x0A] = 128               # DC_HSCALE
+        self.regs[0x0B] = 128               # DC_VSCALE
+        self.dc_bank1[1] = 640 >> 2         # DC_HSTOP
+        self.dc_bank1[3] = 480 >> 1         # DC_VSTOP
+        self.addr = [0, 0]
+        self.addr_h = [0, 0]                # ADDR_H bits 7:3 for each pointer
+        self.step = [0, 0]
+        self.isr = 0
+        self.field = 0
+        self.audio_fifo = bytearray()
+        self.spi_received = 0xff
+        self._spi_pending = 0xff            # Byte being clocked in by the transfer in progress
+        self._spi_done = -1                 # Last access during which that transfer is busy
+
+    @property
+    def addrsel(self) -> int:
+        return self.regs[VERA_CTRL] & 1
+
+    @property
+    def dcsel(self) -> int:
+        return (self.regs[VERA_CTRL] >> 1) & 1
+
+    @property
+    def irq(self) -> bool:
+        '''State of the (active high) interrupt output.'''
+        return bool(self.regs[VERA_IEN] & self._isr() & 0x0f)
+
+    def _isr(self) -> int:
+        isr = self.isr & 0xf7
+        if len(self.audio_fifo) < AUDIO_FIFO_SIZE // 4:
+            isr |= 0x08                     # AFLOW is a level, not a latched flag
+        return isr
+
+    def vsync(self) -> None:
+        '''Signal the start of vertical blank: latch the VSYNC flag and advance the field.'''
+        self.isr |= 0x01
+        self.field ^= 1
+
+    def audio_consume(self, count: int) -> bytes:
+        '''Remove up to `count` bytes from the audio FIFO, as playback would.'''
+        data = bytes(self.audio_fifo[:count])
+        del self.audio_fifo[:count]
+        return data
+
+    @property
+    def spi_busy(self) -> bool:
+        return self._clock <= self._spi_done
+
+    def _spi_write(self, value: int) -> None:
+        if self.spi_busy:
+            self.spi_overruns += 1
+            return
+        self.spi_received = self._spi_pending
+        self._spi_pending = self.spi_device.transfer(value) if self.spi_device else 0xff
+        self._spi_done = self._clock + self.spi_busy_accesses
+        if not self.spi_busy_accesses:
+            self.spi_received = self._spi_pending
+
+    def _set_addr_h(self, sel: int, value: int) -> None:
+        self.addr[sel] = (self.addr[sel] & 0xffff) | ((value & 1) << 16)
+        self.addr_h[sel] = value & 0xf8
+        step = increment_reverse_map[value >> 4]
+        self.step[sel] = -step if value & 0x08 else step
+
+    def write_register(self, index: int, value: int) -> None:
+        self.writes += 1
+        self._clock += 1
+        if index == VERA_DATA_0 or index == VERA_DATA_1:
+            sel = index - VERA_DATA_0
+            address = self.addr[sel]
+            self.vram[address] = value
+            self.addr[sel] = (address + self.step[sel]) & 0x1ffff
+        elif index <= VERA_ADDR_H:
+            sel = self.regs[VERA_CTRL] & 1
+            if index == VERA_ADDR_L:
+                self.addr[sel] = (self.addr[sel] & 0x1ff00) | value
+            elif index == VERA_ADDR_M:
+                self.addr[sel] = (self.addr[sel] & 0x100ff) | (value << 8)
+            else:
+                self._set_addr_h(sel, value)
+        elif index == VERA_CTRL:
+            if value & 0x80:
+                self.reset()
+            else:
+                self.regs[VERA_CTRL] = value & 0x03
+        elif index == VERA_ISR:
+            self.isr &= ~value
+        elif VERA_DC_VIDEO <= index <= VERA_DC_BORDER and self.regs[VERA_CTRL] & 0x02:
+            self.dc_bank1[index - VERA_DC_VIDEO] = value
+        elif index == VERA_AUDIO_DATA:
+            if len(self.audio_fifo) < AUDIO_FIFO_SIZE:
+                self.audio_fifo.append(value)
+        elif index == VERA_AUDIO_CTRL:
+            if value & 0x80:
+                self.audio_fifo.clear()
+            self.regs[index] = value & 0x3f
+        elif index == VERA_SPI_DATA:
+            self._spi_write(value)
+        elif index == VERA_SPI_CTRL:
+            if self.spi_device and (value ^ self.regs[index]) & 0x01:
+                self.spi_device.select(bool(value & 0x01))
+            self.regs[index] = value & 0x03
+        else:
+            self.regs[index] = value
+
+    def read_register(self, index: int) -> int:
+        self.reads += 1
+        self._clock += 1
+        if index == VERA_DATA_0 or index == VERA_DATA_1:
+            sel = index - VERA_DATA_0
+            address = self.addr[sel]
+            self.addr[sel] = (address + self.step[sel]) & 0x1ffff
+            return self.vram[address]
+        if index <= VERA_ADDR_H:
+            sel = self.regs[VERA_CTRL] & 1
+            if index == VERA_ADDR_L:
+                return self.addr[sel] & 0xff
+            if index == VERA_ADDR_M:
+                return (self.addr[sel] >> 8) & 0xff
+            return self.addr_h[sel] | (self.addr[sel] >> 16)
+        if index == VERA_ISR:
+            return self._isr()
+        if VERA_DC_VIDEO <= index <= VERA_DC_BORDER:
+            if self.regs[VERA_CTRL] & 0x02:
+                return self.dc_bank1[index - VERA_DC_VIDEO]
+            if index == VERA_DC_VIDEO:
+                return (self.regs[index] & 0x7f) | (self.field << 7)
+        if index == VERA_AUDIO_CTRL:
+            level = len(self.audio_fifo)
+            full = 0x80 if level >= AUDIO_FIFO_SIZE else 0
+            empty = 0x40 if level == 0 else 0
+            return self.regs[index] | full | empty
+        if index == VERA_AUDIO_DATA:
+            return 0
+        if index == VERA_SPI_DATA:
+            return self.spi_received if self.spi_busy else self._spi_pending
+        if index == VERA_SPI_CTRL:
+            return self.regs[index] | (0x80 if self.spi_busy else 0)
+        return self.regs[index]
+
+    def write_registers(self, writes) -> None:
+        write = self.write_register
+        for index, value in writes:
+            write(index, value)
+
+    def write_stream(self, index: int, data) -> None:
+        view = memoryview(data).cast('B')
+        if index == VERA_DATA_0 or index == VERA_DATA_1:
+            sel = index - VERA_DATA_0
+            address = self.addr[sel]
+            count = len(view)
+            if self.step[sel] == 1 and address + count <= VRAM_SIZE:
+                # Fast path for the common sequential upload
+                self.vram[address:address + count] = view
+                self.addr[sel] = (address + count) & 0x1ffff
+                self.writes += count
+                self._clock += count
+                return
+        write = self.write_register
+        for value in view:
+            write(index, value)
+
+    def fill(self, index: int, value: int, count: int) -> None:
+        self.write_stream(index, bytes((value,)) * count)
+
+    def read_stream(self, index: int, length: int) -> bytearray:
+        if index == VERA_DATA_0 or index == VERA_DATA_1:
+            sel = index - VERA_DATA_0
+            address = self.addr[sel]
+            if self.step[sel] == 1 and address + length <= VRAM_SIZE:
+                self.addr[sel] = (address + length) & 0x1ffff
+                self.reads += length
+                self._clock += length
+                return bytearray(self.vram[address:address + length])
+        read = self.read_register
+        return bytearray(read(index) for _ in range(length))
+
+
+class SimSdCard(object):
+    '''
+    SD card in SPI mode, for `VeraSim(spi_device=...)`. Models the initialisation sequence
+    (CMD0, CMD8, CMD55/ACMD41, CMD58, CMD16), CMD17 single-block and CMD18 multi-block reads
+    ended by CMD12. Block or byte addressing follows `high_capacity`.
+
+    Args:
+        image: Card contents, a whole number of 512-byte blocks
+        high_capacity (bool): Report an SDHC card (block addressed) rather than SDSC
+        init_polls (int): Number of ACMD41 calls answered "still idle" before the card is ready
+
+    Attributes:
+        commands (list): Index of every command received, in order
+    '''
+
+    BLOCK_SIZE = 512
+
+    def __init__(self, image, high_capacity: bool = True, init_polls: int = 2):
+        self.image = bytearray(image)
+        self.high_capacity = high_capacity
+        self.init_polls = init_polls
+        self.commands = []
+        self.selected = False
+        self.idle = True
+        self._command = bytearray()
+        self._output = bytearray()
+        self._app_command = False
+        self._streaming: Optional[int] = None  # Next block of a CMD18 read
+
+    def select(self, selected: bool) -> None:
+        self.selected = selected
+        self._command.clear()
+
+    def transfer(self, value: int) -> int:
+        if not self.selected:
+            return 0xff
+        if self._command or (value & 0xc0) == 0x40:
+            self._command.append(value)
+            if len(self._command) == 6:
+                self._execute(self._command[0] & 0x3f, int.from_bytes(self._command[1:5], 'big'))
+                self._command.clear()
+        if not self._output and self._streaming is not None:
+            self._queue_block(self._streaming)
+            self._streaming += 1
+        if not self._output:
+            return 0xff
+        result = self._output[0]
+        del self._output[0]
+        return result
+
+    def _queue_block(self, block: int) -> None:
+        start = block * self.BLOCK_SIZE
+        self._output += b'\xff\xfe' + self.image[start:start + self.BLOCK_SIZE] + b'\xff\xff'
+
+    def _respond(self, r1: int, extra: bytes = b'') -> None:
+        self._output = bytearray(b'\xff') + bytes((r1,)) + extra
+
+    def _execute(self, command: int, argument: int) -> None:
+        self.commands.append(command)
+        app_command, self._app_command = self._app_command, False
+        idle = 0x01 if self.idle else 0x00
+        if command == 0:
+            self.idle = True
+            self._streaming = None
+            self._respond(0x01)
+        elif command == 8:
+            self._respond(idle, bytes((0, 0, (argument >> 8) & 0x0f, argument & 0xff)))
+        elif command == 55:
+            self._app_command = True
+            self._respond(idle)
+        elif command == 41 and app_command:
+            if self.init_polls > 0:
+                self.init_polls -= 1
+            else:
+                self.idle = False
+            self._respond(0x01 if self.idle else 0x00)
+        elif command == 58:
+            ocr = 0x80ff8000 | (0x40000000 if self.high_capacity else 0)
+            self._respond(idle, ocr.to_bytes(4, 'big'))
+        elif command == 16:
+            self._respond(idle if argument == self.BLOCK_SIZE else idle | 0x40)
+        elif command in (17, 18) and not self.idle:
+            block = argument if self.high_capacity else argument // self.BLOCK_SIZE
+            if (block + 1) * self.BLOCK_SIZE > len(self.image):
+                self._respond(0x40)         # Parameter error
+                return
+            self._respond(0x00)
+            if command == 17:
+                self._queue_block(block)
+            else:
+                self._streaming = block
+        elif command == 12:
+            self._streaming = None
+            self._output = bytearray(b'\xff\x00\x00\xff')    # Stuff byte, R1, busy, ready
+        else:
+            self._respond(idle | 0x04)      # Illegal command
+
+
+class SimSMBus(object):
+    '''
+    Stand-in for an `smbus.SMBus` with an MCP23017 on it whose ports are wired to VERA the way
+    `VeraIntf` expects: port A is the data bus, port B carries the register index in bits 0-4
+    and CS#, WE#, RE# in bits 7, 6, 5. The strobe edges are decoded and applied to a `VeraSim`.
+
+    IOCON.BANK=1 is modelled as far as register addresses go: with SEQOP=1 the address pointer
+    then stays on the register a block starts at. Every SMBus call counts as one transaction, and the bytes
+    each one would put on the wire (address, register and data bytes) are counted too.
+
+    With `combined=True` the bus also offers smbus2's `i2c_rdwr`, counted as one transaction
+    per call however many messages it carries.
+    '''
+
+    GPIO_A = 0x12
+    GPIO_B = 0x13
+    OLAT_A = 0x14
+    OLAT_B = 0x15
+    IODIR_A = 0x00
+    IPOL_A = 0x02
+    IOCON = 0x0A
+    IOCON_ALT = 0x0B
+
+    CS_N = (1 << 7)
+    WE_N = (1 << 6)
+    RE_N = (1 << 5)
+
+    def __init__(self, vera: Optional[VeraSim] = None, address: int = 0x20, combined: bool = False):
+        self.vera = vera if vera is not None else VeraSim()
+        self.address = address
+        if combined:
+            self.i2c_rdwr = self._i2c_rdwr
+        self.regs = bytearray(0x16)
+        self._pointer = 0                   # Register address pointer
+        self.regs[0x00] = 0xff              # IODIR_A/B power up as inputs
+        self.regs[0x01] = 0xff
+        self._driven = None                 # Value VERA drives on the data bus during a read
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.transactions = 0
+        self.wire_bytes = 0
+
+    def _check(self, address: int) -> None:
+        if address != self.address:
+            raise OSError(121, 'Remote I/O error')
+
+    def _bank0(self, register: int) -> int:
+        '''The IOCON.BANK=0 address of `register`, which `regs` is laid out by.'''
+        if self.regs[self.IOCON] & 0x80:
+            port, index = divmod(register, 0x10)
+            return 2 * index + port
+        return register
+
+    def _next(self, register: int) -> int:
+        if self.regs[self.IOCON] & 0x80:
+            return register if self.regs[self.IOCON] & 0x20 else register + 1
+        if self.regs[self.IOCON] & 0x20:
+            return register ^ 1             # Byte mode: toggle within the A/B pair
+        return (register + 1) % 0x16
+
+    def _ctrl_changed(self, old: int, new: int) -> None:
+        selected = not (new & self.CS_N)
+        index = new & 0x1f
+        if not (old & (self.CS_N | self.WE_N)) and (new & (self.CS_N | self.WE_N)):
+            # Write data is sampled on the rising edge of (CS# | WE#)
+            self.vera.write_register(old & 0x1f, self._port_a_pins())
+        if selected and not (new & self.RE_N):
+            if old & (self.CS_N | self.RE_N):
+                self._driven = self.vera.read_register(index)
+        else:
+            self._driven = None
+
+    def _port_a_pins(self) -> int:
+        iodir = self.regs[self.IODIR_A]
+        driven = 0xff if self._driven is None else self._driven
+        return (self.regs[self.OLAT_A] & ~iodir | driven & iodir) & 0xff
+
+    def _write(self, register: int, value: int) -> None:
+        register = self._bank0(register)
+        if register in (self.GPIO_A, self.GPIO_B):
+            register += 2                   # Writing GPIO writes the output latch
+        if register == self.OLAT_B:
+            old = self.regs[register]
+            self.regs[register] = value
+            self._ctrl_changed(old, value)
+            return
+        if register == self.IOCON_ALT:
+            register = self.IOCON
+        self.regs[register] = value
+
+    def _read(self, register: int) -> int:
+        register = self._bank0(register)
+        if register == self.GPIO_A:
+            iodir = self.regs[self.IODIR_A]
+            return self._port_a_pins() ^ (self.regs[self.IPOL_A] & iodir)
+        if register == self.GPIO_B:
+            return self.regs[self.OLAT_B]
+        if register == self.IOCON_ALT:
+            register = self.IOCON
+        return self.regs[register]
+
+    def write_byte_data(self, address: int, register: int, value: int) -> None:
+        self._check(address)
+        self.transactions += 1
+        self.wire_bytes += 3
+        self._write(register, value)
+        self._pointer = self._next(register)
+
+    def read_byte_data(self, address: int, register: int) -> int:
+        self._check(address)
+        self.transactions += 1
+        self.wire_bytes += 4                # address+W, register, address+R, data
+        value = self._read(register)
+        self._pointer = self._next(register)
+        return value
+
+    def write_i2c_block_data(self, address: int, register: int, values) -> None:
+        self._check(address)
+        if len(values) > 32:
+            raise OSError(22, 'Invalid argument')
+        self.transactions += 1
+        self.wire_bytes += 2 + len(values)
+        for value in values:
+            self._write(register, value)
+            register = self._next(register)
+        self._pointer = register
+
+    def read_i2c_block_data(self, address: int, register: int, length: int) -> list:
+        self._check(address)
+        if length > 32:
+            raise OSError(22, 'Invalid argument')
+        self.transactions += 1
+        self.wire_bytes += 3 + length
+        values = []
+        for _ in range(length):
+            values.append(self._read(register))
+            register = self._next(register)
+        self._pointer = register
+        return values
+
+    def _i2c_rdwr(self, *messages) -> None:
+        self.transactions += 1
+        for message in messages:
+            self._check(message.addr)
+            self.wire_bytes += 1 + message.len
+            if message.flags & 0x0001:      # I2C_M_RD
+                values = bytearray()
+                for _ in range(message.len):
+                    values.append(self._read(self._pointer))
+                    self._pointer = self._next(self._pointer)
+                ctypes.memmove(message.buf, bytes(values), message.len)
+            else:
+                data = bytes(message)
+                register = data[0]
+                for value in data[1:]:
+                    self._write(register, value)
+                    register = self._next(register)
+                self._pointer = register
+
+
+class SimI2CBus(object):
+    '''
+    Several `SimSMBus` expanders sharing one bus, each answering at its own address. Accesses
+    to an address nobody answers at fail like on real hardware.
+    '''
+
+    def __init__(self, devices=()):
+        self.devices = {device.address: device for device in devices}
+
+    def _device(self, address: int) -> SimSMBus:
+        device = self.devices.get(address)
+        if device is None:
+            raise OSError(121, 'Remote I/O error')
+        return device
+
+    def write_byte_data(self, address: int, register: int, value: int) -> None:
+        self._device(address).write_byte_data(address, register, value)
+
+    def read_byte_data(self, address: int, register: int) -> int:
+        return self._device(address).read_byte_data(address, register)
+
+    def write_i2c_block_data(self, address: int, register: int, values) -> None:
+        self._device(address).write_i2c_block_data(address, register, values)
+
+    def read_i2c_block_data(self, address: int, register: int, length: int) -> list:
+        return self._device(address).read_i2c_block_data(address, register, length)
+
+
+class SimSerialBridge(object):
+    '''
+    Software stand-in for the vera_bridge firmware: decodes request frames of the protocol in
+    `vera_serial`, applies them to a `VeraSim` and produces the response frames, byte for
+    byte as the firmware does. Requests with a bad CRC, opcode or length are answered with
+    an error status and not executed.
+
+    Like the firmware, every access to SPI_DATA first waits for the SPI port's busy flag to
+    clear; give the `VeraSim` a nonzero `spi_busy_accesses` to exercise that.
+
+    Args:
+        vera (VeraSim): Device behind the bridge. Default: a new `VeraSim`.
+        pace_spi (bool): Wait for SPI busy as the firmware does. False models a bridge that
+            does not, whose SPI_DATA streams overrun.
+
+    Attributes:
+        frames (int): Number of requests received
+    '''
+
+    def __init__(self, vera: Optional[VeraSim] = None, pace_spi: bool = True):
+        self.vera = vera if vera is not None else VeraSim()
+        self.pace_spi = pace_spi
+        self.frames = 0
+        self._buffer = bytearray()
+
+    def feed(self, data) -> bytes:
+        '''Take bytes received from the host and return the bytes to send back.'''
+        buffer = self._buffer
+        buffer += data
+        output = bytearray()
+        while True:
+            start = buffer.find(SYNC_REQUEST)
+            if start < 0:
+                buffer.clear()
+                break
+            del buffer[:start]
+            if len(buffer) < HEADER.size:
+                break
+            _, seq, opcode, length = HEADER.unpack_from(buffer)
+            if length > MAX_PAYLOAD:
+                # Answered at once; the hunt for the next sync byte starts after the header
+                output += self._response(seq, STATUS_BAD_LENGTH)
+                del buffer[:HEADER.size]
+                continue
+            end = HEADER.size + length + CRC.size
+            if len(buffer) < end:
+                break
+            body = bytes(buffer[1:HEADER.size + length])
+            crc, = CRC.unpack_from(buffer, HEADER.size + length)
+            del buffer[:end]
+            self.frames += 1
+            if crc != crc16(body):
+                output += self._response(seq, STATUS_BAD_CRC)
+            else:
+                output += self._execute(seq, opcode, body[HEADER.size - 1:])
+        return bytes(output)
+
+    @staticmethod
+    def _response(seq: int, status: int, payload=b'') -> bytes:
+        return encode_frame(SYNC_RESPONSE, seq, status, payload)
+
+    def _wait_spi(self, index: int) -> None:
+        if self.pace_spi and index == VERA_SPI_DATA:
+            while self.vera.read_register(VERA_SPI_CTRL) & 0x80:
+                pass
+
+    def _write(self, index: int, value: int) -> None:
+        self._wait_spi(index)
+        self.vera.write_register(index, value)
+
+    def _read(self, index: int) -> int:
+        self._wait_spi(index)
+        return self.vera.read_register(index)
+
+    def _execute(self, seq: int, opcode: int, payload: bytes) -> bytes:
+        vera = self.vera
+        lengths = {OP_PING: 0, OP_READ: 1, OP_FILL: 6, OP_READ_STREAM: 3, OP_EXCHANGE: 4}
+        if opcode in lengths and len(payload) != lengths[opcode]:
+            return self._response(seq, STATUS_BAD_LENGTH)
+        if opcode == OP_PING:
+            return self._response(seq, STATUS_OK, bytes((PROTOCOL_VERSION,)))
+        if opcode == OP_WRITE:
+            if len(payload) & 1:
+                return self._response(seq, STATUS_BAD_LENGTH)
+            for index, value in zip(payload[0::2], payload[1::2]):
+                self._write(index & 0x1f, value)
+            return self._response(seq, STATUS_OK)
+        if opcode == OP_READ:
+            return self._response(seq, STATUS_OK, bytes((self._read(payload[0] & 0x1f),)))
+        if opcode == OP_STREAM:
+            if not payload:
+                return self._response(seq, STATUS_BAD_LENGTH)
+            index = payload[0] & 0x1f
+            if index == VERA_SPI_DATA:
+                for value in payload[1:]:
+                    self._write(index, value)
+            else:
+                vera.write_stream(index, payload[1:])
+            return self._response(seq, STATUS_OK)
+        if opcode == OP_FILL:
+            index, value, count = struct.unpack('<BBI', payload)
+            index &= 0x1f
+            if index == VERA_SPI_DATA:
+                for _ in range(count):
+                    self._write(index, value)
+            else:
+                vera.fill(index, value, count)
+            return self._response(seq, STATUS_OK)
+        if opcode == OP_READ_STREAM:
+            index, count = struct.unpack('<BH', payload)
+            index &= 0x1f
+            if index == VERA_SPI_DATA:
+                return self._response(seq, STATUS_OK, bytes(self._read(index) for _ in range(count)))
+            return self._response(seq, STATUS_OK, bytes(vera.read_stream(index, count)))
+        if opcode == OP_EXCHANGE:
+            index, value, count = struct.unpack('<BBH', payload)
+            index &= 0x1f
+            data = bytearray(count)
+            for i in range(count):
+                self._write(index, value)
+                data[i] = self._read(index)
+            return self._response(seq, STATUS_OK, data)
+        return self._response(seq, STATUS_BAD_OPCODE)
+
+    def serve(self, fd: int) -> None:
+        '''Answer requests arriving on file descriptor `fd` until it is closed.'''
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            reply = self.feed(data)
+            while reply:
+                reply = reply[os.write(fd, reply):]
+
+def open_pty_bridge(bridge: Optional[SimSerialBridge] = None):
+    '''
+    Run a `SimSerialBridge` behind a pseudo-terminal, so `vera_serial.SerialBus` can be tested
+    through a real serial device node.
+
+    Returns:
+        tuple: (device path to open, e.g. with `SerialBus(path)`, the bridge)
+    '''
+    bridge = bridge if bridge is not None else SimSerialBridge()
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    threading.Thread(target=bridge.serve, args=(master,), name='vera-bridge', daemon=True).start()
+    return path, bridge
@@ -0,0 +1,357 @@
+'''
+SPI through VERA's SPI_DATA/SPI_CTRL registers, and an SD card block device on top of it.
+
+`VeraSpi` drives the SPI port: chip select, clock speed and byte transfers. A byte is sent by
+writing SPI_DATA; once the busy flag in SPI_CTRL clears, the byte clocked in at the same time
+is read back from SPI_DATA. A byte takes about 20 us at the slow clock (390 kHz), which a fast
+bus such as the serial bridge easily outruns, so the flag is polled after every byte. Buses
+that cannot reach VERA again within a byte time say so with a true `spi_paced` attribute, and
+the polls are skipped.
+
+`SdCard` is an SD card in SPI mode. It reads single blocks with CMD17 and runs of blocks
+with CMD18, keeps a bounded LRU cache of blocks, and reads ahead when access is sequential.
+`SdFile` gives a byte range of the card a read-only file interface whose `readinto` fills
+the caller's buffer, reading whole uncached blocks straight into it.
+
+Example:
+    card = SdCard(VeraSpi(vera))
+    card.init()
+    with SdFile(card, offset=start_lba * 512, length=size) as f:
+        f.readinto(buffer)
+'''
+import io
+from collections import OrderedDict
+from typing import Optional
+
+from vypera import VERA, VERA_SPI_CTRL, VERA_SPI_DATA
+
+# SPI_CTRL bits
+SPI_SELECT = 0x01
+SPI_SLOW = 0x02
+SPI_BUSY = 0x80
+
+BLOCK_SIZE = 512
+
+# SD commands used in SPI mode
+CMD_GO_IDLE_STATE = 0
+CMD_SEND_IF_COND = 8
+CMD_STOP_TRANSMISSION = 12
+CMD_SET_BLOCKLEN = 16
+CMD_READ_SINGLE_BLOCK = 17
+CMD_READ_MULTIPLE_BLOCK = 18
+CMD_APP_CMD = 55
+CMD_READ_OCR = 58
+ACMD_SD_SEND_OP_COND = 41
+
+R1_IDLE = 0x01
+R1_ILLEGAL_COMMAND = 0x04
+DATA_START_TOKEN = 0xfe
+OCR_CCS = 0x40000000        # Card capacity status: block addressed (SDHC/SDXC)
+
+# SPI_CTRL reads before a transfer that is still busy is given up on
+SPI_BUSY_POLLS = 1000
+
+class SdCardError(IOError):
+    '''The SD card did not respond, or responded with an error.'''
+
+class VeraSpi(object):
+    '''
+    The SPI port of a `VERA`.
+
+    Args:
+        vera (VERA): Device
+        paced (bool): Whether the bus is too slow to reach SPI_DATA again before a byte
+            transfer has finished, so the busy flag need not be polled. Default: the bus's
+            `spi_paced` attribute, False if it has none.
+    '''
+
+    def __init__(self, vera: VERA, paced: Optional[bool] = None):
+        self.vera = vera
+        self.paced = bool(getattr(vera.bus, 'spi_paced', False)) if paced is None else paced
+
+    def select(self) -> None:
+        self.vera.write_register(VERA_SPI_CTRL, SPI_SELECT, SPI_SELECT)
+
+    def deselect(self) -> None:
+        self.vera.write_register(VERA_SPI_CTRL, 0, SPI_SELECT)
+
+    @property
+    def slow(self) -> bool:
+        return bool(self.vera.read_register(VERA_SPI_CTRL) & SPI_SLOW)
+
+    @slow.setter
+    def slow(self, value: bool) -> None:
+        self.vera.write_register(VERA_SPI_CTRL, SPI_SLOW if value else 0, SPI_SLOW)
+
+    def _wait(self) -> None:
+        '''Wait for the byte transfer in progress to finish.'''
+        read = self.vera.bus.read_register
+        for _ in range(SPI_BUSY_POLLS):
+            if not read(VERA_SPI_CTRL) & SPI_BUSY:
+                return
+        raise IOError('SPI transfer did not finish')
+
+    def transfer(self, value: int) -> int:
+        '''Send one byte and return the byte received.'''
+        bus = self.vera.bus
+        bus.write_register(VERA_SPI_DATA, value)
+        if not self.paced:
+            self._wait()
+        return bus.read_register(VERA_SPI_DATA)
+
+    def write(self, data) -> None:
+        '''Send bytes, ignoring what is received.'''
+        bus = self.vera.bus
+        if self.paced:
+            bus.write_stream(VERA_SPI_DATA, data)
+            return
+        for value in memoryview(data).cast('B'):
+            bus.write_register(VERA_SPI_DATA, value)
+            self._wait()
+
+    def readinto(self, buffer) -> None:
+        '''Fill `buffer` with received bytes, sending 0xFF for each.'''
+        view = memoryview(buffer).cast('B')
+        bus = self.vera.bus
+        exchange = getattr(bus, 'exchange_stream', None)
+        if self.paced and exchange is not None:
+            # The bus sends each 0xFF and reads the byte received without a round trip per byte
+            view[:] = exchange(VERA_SPI_DATA, 0xff, len(view))
+            return
+        write = bus.write_register
+        read = bus.read_register
+        for i in range(len(view)):
+            write(VERA_SPI_DATA, 0xff)
+            if not self.paced:
+                self._wait()
+            view[i] = read(VERA_SPI_DATA)
+
+    def read(self, count: int) -> bytearray:
+        data = bytearray(count)
+        self.readinto(data)
+        return data
+
+class SdCard(object):
+    '''
+    SD card in SPI mode, addressed in 512-byte blocks.
+
+    Args:
+        spi (VeraSpi): SPI port the card is on
+        cache_blocks (int): Maximum number of blocks kept in the LRU cache
+        read_ahead (int): Blocks read with one CMD18 when a cache miss continues a sequential
+            access
+        timeout (int): Bytes polled for a response or data token before giving up
+    '''
+
+    def __init__(self, spi: VeraSpi, cache_blocks: int = 64, read_ahead: int = 8, timeout: int = 4096):
+        self.spi = spi
+        self.cache_blocks = cache_blocks
+        self.read_ahead = read_ahead
+        self.timeout = timeout
+        self.block_addressing = False
+        self._cache = OrderedDict()
+        self._next_block: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _command(self, command: int, argument: int = 0) -> int:
+        '''Send a command to the selected card and return its R1 response.'''
+        crc = 0x95 if command == CMD_GO_IDLE_STATE else 0x87 if command == CMD_SEND_IF_COND else 0x01
+        self.spi.write(bytes((0x40 | command, (argument >> 24) & 0xff, (argument >> 16) & 0xff,
+                              (argument >> 8) & 0xff, argument & 0xff, crc)))
+        for _ in range(8):
+            response = self.spi.transfer(0xff)
+            if not response & 0x80:
+                return response
+        raise SdCardError(f'no response to CMD{command}')
+
+    def _wait_token(self) -> None:
+        for _ in range(self.timeout):
+            token = self.spi.transfer(0xff)
+            if token == DATA_START_TOKEN:
+                return
+            if token != 0xff:
+                raise SdCardError(f'data error token {token:#04x}')
+        raise SdCardError('timed out waiting for data')
+
+    def init(self) -> None:
+        '''
+        Put the card into SPI mode and initialise it, at the slow clock, then switch to the
+        fast clock.
+
+        Raises:
+            SdCardError: No card, or a card that does not complete initialisation
+        '''
+        spi = self.spi
+        spi.slow = True
+        spi.deselect()
+        spi.write(b'\xff' * 10)                 # At least 74 clocks with CS high
+        spi.select()
+        try:
+            if self._command(CMD_GO_IDLE_STATE) != R1_IDLE:
+                raise SdCardError('card did not enter the idle state')
+            version2 = self._command(CMD_SEND_IF_COND, 0x1aa) == R1_IDLE
+            if version2 and bytes(spi.read(4))[2:] != b'\x01\xaa':
+                raise SdCardError('voltage check pattern mismatch')
+            for _ in range(self.timeout):
+                self._command(CMD_APP_CMD)
+                if self._command(ACMD_SD_SEND_OP_COND, 0x40000000 if version2 else 0) == 0:
+                    break
+            else:
+                raise SdCardError('card did not leave the idle state')
+            self.block_addressing = False
+            if version2 and self._command(CMD_READ_OCR) == 0:
+                self.block_addressing = bool(int.from_bytes(spi.read(4), 'big') & OCR_CCS)
+            if not self.block_addressing and self._command(CMD_SET_BLOCKLEN, BLOCK_SIZE) != 0:
+                raise SdCardError('CMD16 failed')
+        finally:
+            spi.deselect()
+            spi.write(b'\xff')
+        spi.slow = False
+        self.clear_cache()
+
+    def _address(self, block: int) -> int:
+        return block if self.block_addressing else block * BLOCK_SIZE
+
+    def read_blocks(self, block: int, buffer) -> None:
+        '''
+        Read consecutive blocks from the card straight into `buffer`, whose length must be a
+        multiple of the block size. Bypasses the cache.
+
+        Raises:
+            SdCardError: The card reported an error or timed out
+        '''
+        view = memoryview(buffer).cast('B')
+        count = len(view) // BLOCK_SIZE
+        if count == 0 or len(view) % BLOCK_SIZE:
+            raise ValueError(f'buffer of {len(view)} bytes is not a whole number of blocks')
+        spi = self.spi
+        spi.select()
+        try:
+            command = CMD_READ_SINGLE_BLOCK if count == 1 else CMD_READ_MULTIPLE_BLOCK
+            response = self._command(command, self._address(block))
+            if response:
+                raise SdCardError(f'CMD{command} of block {block} failed: R1 {response:#04x}')
+            for n in range(count):
+                self._wait_token()
+                spi.readinto(view[n * BLOCK_SIZE:(n + 1) * BLOCK_SIZE])
+                spi.read(2)                     # CRC, not checked in SPI mode
+            if count > 1:
+                self._command(CMD_STOP_TRANSMISSION)
+                for _ in range(self.timeout):   # Wait out the busy signal
+                    if spi.transfer(0xff) == 0xff:
+                        break
+        finally:
+            spi.deselect()
+            spi.write(b'\xff')
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+        self._next_block = None
+
+    def _store(self, block: int, data) -> None:
+        cache = self._cache
+        cache[block] = bytes(data)
+        cache.move_to_end(block)
+        while len(cache) > self.cache_blocks:
+            cache.popitem(last=False)
+
+    def block(self, block: int) -> bytes:
+        '''Return one block, from the cache when possible.'''
+        cache = self._cache
+        data = cache.get(block)
+        if data is not None:
+            cache.move_to_end(block)
+            self.hits += 1
+        else:
+            self.misses += 1
+            count = self.read_ahead if block == self._next_block else 1
+            run = bytearray(count * BLOCK_SIZE)
+            self.read_blocks(block, run)
+            for n in range(count):
+                self._store(block + n, memoryview(run)[n * BLOCK_SIZE:(n + 1) * BLOCK_SIZE])
+            data = cache[block]
+        self._next_block = block + 1
+        return data
+
+    def readinto(self, block: int, buffer) -> None:
+        '''
+        Fill `buffer` (a whole number of blocks) with consecutive blocks starting at `block`.
+        Cached blocks are copied from the cache; each run of uncached blocks is read straight
+        into the buffer with one command, and not cached.
+        '''
+        view = memoryview(buffer).cast('B')
+        count = len(view) // BLOCK_SIZE
+        if len(view) % BLOCK_SIZE:
+            raise ValueError(f'buffer of {len(view)} bytes is not a whole number of blocks')
+        cache = self._cache
+        n = 0
+        while n < count:
+            data = cache.get(block + n)
+            if data is not None:
+                cache.move_to_end(block + n)
+                self.hits += 1
+                view[n * BLOCK_SIZE:(n + 1) * BLOCK_SIZE] = data
+                n += 1
+                continue
+            end = n + 1
+            while end < count and block + end not in cache:
+                end += 1
+            self.misses += end - n
+            self.read_blocks(block + n, view[n * BLOCK_SIZE:end * BLOCK_SIZE])
+            n = end
+        self._next_block = block + count
+
+class SdFile(io.RawIOBase):
+    '''
+    Read-only, seekable file over a byte range of an `SdCard`.
+
+    Args:
+        card (SdCard): Card to read
+        offset (int): Byte offset of the start of the file on the card
+        length (int): File length in bytes
+    '''
+
+    def __init__(self, card: SdCard, offset: int = 0, length: int = 0):
+        super().__init__()
+        self.card = card
+        self.offset = offset
+        self.length = length
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        if offset < 0:
+            raise ValueError(f'negative seek position {offset}')
+        self.position = offset
+        return offset
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast('B')
+        count = max(0, min(len(view), self.length - self.position))
+        done = 0
+        while done < count:
+            address = self.offset + self.position + done
+            block, start = divmod(address, BLOCK_SIZE)
+            if start == 0 and count - done >= BLOCK_SIZE:
+                # Whole blocks go straight into the caller's buffer
+                size = (count - done) // BLOCK_SIZE * BLOCK_SIZE
+                self.card.readinto(block, view[done:done + size])
+            else:
+                size = min(BLOCK_SIZE - start, count - done)
+                view[done:done + size] = self.card.block(block)[start:start + size]
+            done += size
+        self.position += count
+        return count
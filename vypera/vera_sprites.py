@@ -0,0 +1,174 @@
+'''
+Host-side model of VERA's sprite attribute table.
+
+The 128 sprites are held in a NumPy structured array, one record per sprite, so attributes
+of many sprites can be changed at once with vectorised assignments. Sprites touched through
+the table's methods are marked dirty; `commit()` encodes the dirty entries into VERA's
+8-byte attribute format, compares them with what was last uploaded and sends only the bytes
+that changed, grouped into contiguous runs.
+
+Example:
+    sprites = SpriteTable(vera)
+    sprites.update(range(10), address=0x10000, width=16, height=16, z=3)
+    sprites.move(ids, xs, ys)       # move many sprites at once
+    sprites.commit()
+'''
+from typing import Optional
+
+import numpy as np
+
+from vera_assets import diff_runs
+from vera_mirror import VramMirror
+from vypera import VERA, increment_map
+
+SPRITE_ATTRIBUTES = 0x1FC00
+SPRITE_COUNT = 128
+ATTRIBUTE_SIZE = 8
+
+# Z-depth values
+Z_DISABLED = 0
+Z_BEHIND_LAYER0 = 1
+Z_BETWEEN_LAYERS = 2
+Z_FRONT = 3
+
+SPRITE_DTYPE = np.dtype([
+    ('address', np.uint32),         # VRAM address of the sprite data, 32-byte aligned
+    ('mode8bpp', np.bool_),         # False: 4 bpp, True: 8 bpp
+    ('x', np.int16),                # 10-bit position, may be negative
+    ('y', np.int16),
+    ('z', np.uint8),                # Z_* depth, 0 disables the sprite
+    ('collision', np.uint8),        # 4-bit collision mask
+    ('hflip', np.bool_),
+    ('vflip', np.bool_),
+    ('width', np.uint8),            # 8, 16, 32 or 64 pixels
+    ('height', np.uint8),
+    ('palette_offset', np.uint8),   # 4 bits
+])
+
+# Pixel size -> 2-bit size code
+_size_code = np.zeros(65, dtype=np.uint8)
+_size_code[[8, 16, 32, 64]] = [0, 1, 2, 3]
+
+def encode_attributes(sprites: np.ndarray) -> np.ndarray:
+    '''
+    Encode sprite records into VERA's attribute format.
+
+    Returns:
+        np.ndarray: (len(sprites), 8) uint8 array
+    '''
+    encoded = np.empty((len(sprites), ATTRIBUTE_SIZE), dtype=np.uint8)
+    address = sprites['address']
+    x = sprites['x'].astype(np.uint16)
+    y = sprites['y'].astype(np.uint16)
+    encoded[:, 0] = (address >> 5) & 0xff
+    encoded[:, 1] = (sprites['mode8bpp'].astype(np.uint8) << 7) | ((address >> 13) & 0x0f)
+    encoded[:, 2] = x & 0xff
+    encoded[:, 3] = (x >> 8) & 0x03
+    encoded[:, 4] = y & 0xff
+    encoded[:, 5] = (y >> 8) & 0x03
+    encoded[:, 6] = (((sprites['collision'] & 0x0f) << 4) | ((sprites['z'] & 0x03) << 2)
+                     | (sprites['vflip'].astype(np.uint8) << 1) | sprites['hflip'].astype(np.uint8))
+    encoded[:, 7] = ((_size_code[sprites['height']] << 6) | (_size_code[sprites['width']] << 4)
+                     | (sprites['palette_offset'] & 0x0f))
+    return encoded
+
+class SpriteTable(object):
+    '''
+    The sprite attribute table of a `VERA`.
+
+    Attributes:
+        sprites (np.ndarray): 128 records of `SPRITE_DTYPE`. Code that assigns to it directly
+            must call `mark_dirty()` for the entries it changed.
+    '''
+
+    # Unchanged bytes rewritten rather than re-seeking the address pointer
+    SEEK_COST = VramMirror.SEEK_COST
+
+    def __init__(self, vera: VERA, base: int = SPRITE_ATTRIBUTES):
+        self.vera = vera
+        self.base = base
+        self.sprites = np.zeros(SPRITE_COUNT, dtype=SPRITE_DTYPE)
+        self.sprites['width'] = 8
+        self.sprites['height'] = 8
+        self.dirty = np.ones(SPRITE_COUNT, dtype=np.bool_)
+        # What the hardware is known to hold; None until the first commit or fetch()
+        self._committed: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return SPRITE_COUNT
+
+    def __getitem__(self, index):
+        return self.sprites[index]
+
+    def mark_dirty(self, index=slice(None)) -> None:
+        '''Mark entries (an index, slice, list or mask) as changed.'''
+        self.dirty[index] = True
+
+    def update(self, index, **fields) -> None:
+        '''
+        Set fields of one or many sprites. Values broadcast against the selected entries.
+
+        Example:
+            sprites.update(slice(0, 32), z=Z_FRONT, palette_offset=np.arange(32) % 16)
+        '''
+        for name, value in fields.items():
+            self.sprites[name][index] = value
+        self.dirty[index] = True
+
+    def move(self, index, x, y) -> None:
+        '''Set the position of one or many sprites.'''
+        self.sprites['x'][index] = x
+        self.sprites['y'][index] = y
+        self.dirty[index] = True
+
+    def offset(self, index, dx, dy) -> None:
+        '''Move one or many sprites relative to their current position.'''
+        self.sprites['x'][index] += np.asarray(dx, dtype=np.int16)
+        self.sprites['y'][index] += np.asarray(dy, dtype=np.int16)
+        self.dirty[index] = True
+
+    def hide(self, index) -> None:
+        self.update(index, z=Z_DISABLED)
+
+    def fetch(self) -> None:
+        '''Read the attribute table from VRAM, so the next commit only sends real changes.'''
+        data = self.vera.read_vram(self.base, SPRITE_COUNT * ATTRIBUTE_SIZE)
+        self._committed = np.frombuffer(bytes(data), dtype=np.uint8).reshape(SPRITE_COUNT, ATTRIBUTE_SIZE).copy()
+
+    def commit(self) -> int:
+        '''
+        Upload the attribute bytes of dirty sprites that differ from the last upload.
+
+        Returns:
+            int: Number of attribute bytes sent
+        '''
+        ids = np.flatnonzero(self.dirty)
+        if len(ids) == 0:
+            return 0
+        if self._committed is None:
+            encoded = encode_attributes(self.sprites)
+            self.vera.write_vram(self.base, encoded)
+            self._committed = encoded
+            self.dirty[:] = False
+            return encoded.size
+
+        current = self._committed.copy()
+        current[ids] = encode_attributes(self.sprites[ids])
+        flat = current.reshape(-1)
+        runs = diff_runs(self._committed, current, self.SEEK_COST)
+        sent = 0
+        with self.vera.batch():
+            starts = [start for start, _ in runs]
+            step = starts[1] - starts[0] if len(runs) > 1 else 0
+            if (len(runs) > 1 and step in increment_map and all(end - start == 1 for start, end in runs)
+                    and all(b - a == step for a, b in zip(starts, starts[1:]))):
+                # The same attribute byte of evenly spaced sprites: one strided upload
+                self.vera.write_vram(self.base + starts[0], flat[starts[0]::step][:len(runs)].copy(), step)
+                sent = len(runs)
+            else:
+                for start, end in runs:
+                    self.vera.write_vram(self.base + start, flat[start:end])
+                    sent += end - start
+        self._committed = current
+        self.dirty[:] = False
+        return sent
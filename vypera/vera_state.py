@@ -0,0 +1,252 @@
+'''
+Saving the device state and re-attaching to a board that still holds it.
+
+A fresh start resets VERA, reconfigures the display and uploads every asset. When the
+process restarts while the board stays powered, all of that is usually already in place.
+`save_state()` records the register shadow, a VRAM image and a hash per VRAM region;
+`attach()` checks a handful of registers and a sample of VRAM bytes against that record and
+only writes what is missing, without resetting VERA.
+
+VRAM is checked by sampling: a few strided bursts (`SAMPLE_STRIDE` bytes apart, at random
+offsets) read from every region. A region that differs from the record only in bytes that
+were not sampled goes unnoticed; `samples` trades attach time against that risk.
+
+Example:
+    try:
+        report = vera.attach('vera.state', vram=assets)
+    except (OSError, ValueError):
+        cold_start(vera)
+        vera.save_state('vera.state', vram=assets)
+'''
+import base64
+import hashlib
+import json
+import random
+import zlib
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from vypera import (
+    VERA, SHADOW_SIZE, VERA_ADDR_L, VERA_ADDR_M, VERA_ADDR_H, VERA_CTRL, VERA_IEN, VERA_IRQ_LINE_L,
+    VERA_DC_VIDEO, VERA_DC_HSCALE, VERA_DC_VSCALE, VERA_DC_BORDER, VERA_L0_CONFIG, VERA_L0_MAPBASE,
+    VERA_L0_TILEBASE, VERA_L1_CONFIG, VERA_L1_MAPBASE, VERA_L1_TILEBASE, VERA_L1_VSCROLL_H,
+    VERA_AUDIO_CTRL, VERA_AUDIO_RATE, VERA_SPI_CTRL, strobe_bits, volatile_bits,
+)
+
+STATE_VERSION = 1
+VRAM_SIZE = 0x20000
+REGION_SIZE = 0x1000
+
+# Largest power-of-two VERA increment; each sample pass reads one byte every SAMPLE_STRIDE
+SAMPLE_STRIDE = 512
+
+# Registers compared on attach, in DCSEL bank 0. These hold the display setup and are
+# never changed by the hardware.
+PROBE_REGISTERS = (
+    VERA_DC_VIDEO, VERA_DC_HSCALE, VERA_DC_VSCALE, VERA_DC_BORDER,
+    VERA_L0_CONFIG, VERA_L0_MAPBASE, VERA_L0_TILEBASE,
+    VERA_L1_CONFIG, VERA_L1_MAPBASE, VERA_L1_TILEBASE,
+)
+
+# Registers written back when the probe fails, as (register, DCSEL bank)
+RESTORE_REGISTERS = (
+    [(VERA_IEN, 0), (VERA_IRQ_LINE_L, 0)]
+    + [(register, bank) for bank in (0, 1) for register in range(VERA_DC_VIDEO, VERA_DC_BORDER + 1)]
+    + [(register, 0) for register in range(VERA_L0_CONFIG, VERA_L1_VSCROLL_H + 1)]
+    + [(VERA_AUDIO_CTRL, 0), (VERA_AUDIO_RATE, 0), (VERA_SPI_CTRL, 0)]
+)
+
+# Address pointers are not worth saving: any VRAM access reprograms them
+_ADDRESS_KEYS = frozenset(register + 32 * bank for register in (VERA_ADDR_L, VERA_ADDR_M, VERA_ADDR_H)
+                          for bank in (0, 1))
+
+@dataclass
+class AttachReport:
+    '''What `attach()` found and did.'''
+    registers_matched: bool                 # The probe registers held the saved values
+    registers_written: int = 0              # Registers written back because they did not
+    stale_regions: List[int] = field(default_factory=list)     # Start addresses of re-uploaded regions
+    bytes_uploaded: int = 0
+    bytes_sampled: int = 0
+
+    @property
+    def warm(self) -> bool:
+        '''True if nothing had to be written.'''
+        return self.registers_matched and not self.stale_regions
+
+def region_hashes(vram, region_size: int = REGION_SIZE) -> List[str]:
+    '''Hex digests of each `region_size` byte region of a 128 KB VRAM image.'''
+    view = memoryview(vram).cast('B')
+    return [hashlib.blake2b(view[start:start + region_size], digest_size=16).hexdigest()
+            for start in range(0, VRAM_SIZE, region_size)]
+
+def save_state(vera: VERA, path: str, vram=None, region_size: int = REGION_SIZE) -> None:
+    '''
+    Record the register shadow and VRAM contents in a file for a later `attach()`.
+
+    Args:
+        vera (VERA): Device whose state is saved
+        path (str): File to write
+        vram: 128 KB image of what VRAM holds, such as the `vera.vram.data` of a mirror that
+            every upload went through. Default: read back with `vera.snapshot_vram()`.
+        region_size (int): Granularity of the hashes and of re-uploads, a divisor of 128 KB
+            and a multiple of `SAMPLE_STRIDE`
+    '''
+    if VRAM_SIZE % region_size or region_size % SAMPLE_STRIDE:
+        raise ValueError(region_size)
+    vera.sync()
+    if vram is None:
+        vram = vera.snapshot_vram()
+    vram = bytes(memoryview(vram).cast('B'))
+    if len(vram) != VRAM_SIZE:
+        raise ValueError(f'VRAM image is {len(vram)} bytes, expected {VRAM_SIZE}')
+    shadow = []
+    for key, value in enumerate(vera._shadow):
+        if value is None or key in _ADDRESS_KEYS or volatile_bits[key] == 0xff:
+            shadow.append(None)
+        else:
+            shadow.append(value & ~volatile_bits[key] & ~strobe_bits[key])
+    state = {
+        'version': STATE_VERSION,
+        'shadow': shadow,
+        'region_size': region_size,
+        'regions': region_hashes(vram, region_size),
+        'vram': base64.b64encode(zlib.compress(vram)).decode('ascii'),
+    }
+    with open(path, 'w') as f:
+        json.dump(state, f)
+
+def load_state(path: str) -> dict:
+    '''
+    Read a file written by `save_state()`, with the VRAM image decoded.
+
+    Raises:
+        ValueError: The file is not a saved state of a supported version
+    '''
+    with open(path) as f:
+        state = json.load(f)
+    if state.get('version') != STATE_VERSION:
+        raise ValueError(f'{path}: unsupported state version {state.get("version")}')
+    state['vram'] = zlib.decompress(base64.b64decode(state['vram']))
+    if len(state['shadow']) != SHADOW_SIZE or len(state['vram']) != VRAM_SIZE:
+        raise ValueError(f'{path}: malformed state')
+    return state
+
+def _check_responding(vera: VERA, value: int = 0x5a) -> None:
+    vera.bus.write_register(VERA_ADDR_L, value)
+    read = vera.bus.read_register(VERA_ADDR_L)
+    if read != value:
+        raise IOError(f'VERA not responding: wrote {value:#04x} to ADDR_L, read {read:#04x}')
+
+def _probe(vera: VERA, shadow: list) -> bool:
+    '''Compare the probe registers (and CTRL) with the saved shadow.'''
+    bus = vera.bus
+    ctrl = bus.read_register(VERA_CTRL) & 0x7f
+    if shadow[VERA_CTRL] is not None and ctrl != shadow[VERA_CTRL]:
+        return False
+    if ctrl & 0x02:
+        bus.write_register(VERA_CTRL, ctrl & ~0x02)
+    try:
+        for register in PROBE_REGISTERS:
+            expected = shadow[register]
+            if expected is None:
+                continue
+            if bus.read_register(register) & ~volatile_bits[register] != expected:
+                return False
+    finally:
+        if ctrl & 0x02:
+            bus.write_register(VERA_CTRL, ctrl)
+    return True
+
+def _restore_registers(vera: VERA, shadow: list) -> int:
+    '''Write every saved register back. Returns the number of registers written.'''
+    written = 0
+    vera.invalidate()
+    with vera.batch():
+        for register, bank in RESTORE_REGISTERS:
+            value = shadow[register + 32 * bank]
+            if value is None:
+                continue
+            if VERA_DC_VIDEO <= register <= VERA_DC_BORDER:
+                vera.write_register(VERA_CTRL, bank << 1, 0x02)
+            vera.write_register(register, value)
+            written += 1
+        if shadow[VERA_CTRL] is not None:
+            vera.write_register(VERA_CTRL, shadow[VERA_CTRL])
+    return written
+
+def _stale_samples(vera: VERA, saved: bytes, region_size: int, samples: int, rng) -> set:
+    '''Sample VRAM in strided bursts; return the start addresses of regions that differ from `saved`.'''
+    stale = set()
+    count = VRAM_SIZE // SAMPLE_STRIDE
+    for offset in rng.sample(range(SAMPLE_STRIDE), min(samples, SAMPLE_STRIDE)):
+        data = vera.read_vram(offset, count, SAMPLE_STRIDE)
+        for n, value in enumerate(data):
+            address = offset + n * SAMPLE_STRIDE
+            if value != saved[address]:
+                stale.add(address - address % region_size)
+    return stale
+
+def attach(vera: VERA, path: str, vram=None, samples: int = 2, seed: Optional[int] = None) -> AttachReport:
+    '''
+    Take over a board left in the state saved in `path`, without resetting it.
+
+    The probe registers are compared with the saved shadow. If they match, the shadow is
+    adopted without touching the hardware; otherwise every saved register is written back.
+    VRAM regions are re-uploaded from `vram` if their hash differs from the saved one (the
+    desired content changed) or if sampling finds the board no longer holds the saved content.
+
+    Args:
+        vera (VERA): Device to attach to
+        path (str): File written by `save_state()`
+        vram: 128 KB image of the desired VRAM contents. Default: the saved image.
+        samples (int): Sample passes over VRAM, each reading 256 bytes in one burst
+        seed: Seed for choosing the sampled offsets. Default: random.
+
+    Returns:
+        AttachReport: What was found and written
+
+    Raises:
+        IOError: VERA does not respond
+        ValueError: The file is not a usable saved state
+    '''
+    state = load_state(path)
+    shadow = state['shadow']
+    saved = state['vram']
+    region_size = state['region_size']
+    desired = saved if vram is None else bytes(memoryview(vram).cast('B'))
+    if len(desired) != VRAM_SIZE:
+        raise ValueError(f'VRAM image is {len(desired)} bytes, expected {VRAM_SIZE}')
+
+    vera.sync()
+    _check_responding(vera)
+    report = AttachReport(_probe(vera, shadow))
+    if report.registers_matched:
+        vera._shadow = list(shadow)
+    else:
+        report.registers_written = _restore_registers(vera, shadow)
+
+    stale = _stale_samples(vera, saved, region_size, samples, random.Random(seed))
+    report.bytes_sampled = min(samples, SAMPLE_STRIDE) * (VRAM_SIZE // SAMPLE_STRIDE)
+    if vram is not None:
+        for n, digest in enumerate(region_hashes(desired, region_size)):
+            if digest != state['regions'][n]:
+                stale.add(n * region_size)
+    report.stale_regions = sorted(stale)
+
+    # Upload runs of adjacent stale regions
+    with vera.batch():
+        run_start = run_end = None
+        for start in report.stale_regions + [None]:
+            if start is not None and start == run_end:
+                run_end += region_size
+                continue
+            if run_start is not None:
+                vera.write_vram(run_start, desired[run_start:run_end])
+                report.bytes_uploaded += run_end - run_start
+            if start is not None:
+                run_start, run_end = start, start + region_size
+
+    if vera._vram is not None:
+        vera.vram.adopt(desired)
+    return report
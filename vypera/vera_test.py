@@ -1,12 +1,18 @@
 from mcp23017 import MCP23017
 from vera_intf import VeraIntf
-from vypera import VERA
+from vypera import VERA, DEBUG_NO_HARDWARE
+from vera_trace import Tracer
 
-mcp = MCP23017(0x20, 1)     # The MCP23017 is on i2c bus 1, address 0x20
+if DEBUG_NO_HARDWARE:
+    from vera_sim import SimSMBus
+    mcp = MCP23017(0x20, SimSMBus())    # Simulated MCP23017 wired to a simulated VERA
+else:
+    mcp = MCP23017(0x20, 1)     # The MCP23017 is on i2c bus 1, address 0x20
 mcp.init()                  # Initialize the GPIO extender
 vera_bus = VeraIntf(mcp)    # Create the register bus interface needed by the VERA class
 
 vera = VERA(vera_bus)
+Tracer(echo=True).attach(vera)  # Print every register access
 
 vera.RESET = 1  # Reset VERA
 
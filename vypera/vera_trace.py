@@ -0,0 +1,241 @@
+'''
+Register access tracing and bus metrics for the VERA driver.
+
+A `Tracer` is attached to a `VERA` instance by replacing its `read_register`/`write_register`
+with instrumented versions and wrapping its bus, so an untraced `VERA` runs exactly the
+uninstrumented code. While attached it keeps:
+
+    - per-register read and write counters
+    - a fixed-size ring buffer of (timestamp, register, value, mask, direction) records
+    - a log2 latency histogram for each bus operation
+    - optionally, a binary trace file of every record
+
+Trace files can be decoded with:
+    python vera_trace.py decode trace.bin
+    python vera_trace.py summary trace.bin
+'''
+import argparse
+import struct
+import sys
+import time
+from array import array
+from typing import Iterator, Optional, Tuple
+
+from vypera import VERA, read_stream
+
+READ = 0
+WRITE = 1
+
+TRACE_MAGIC = b'VTRC'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sH')
+TRACE_RECORD = struct.Struct('<dBBBB')     # timestamp, register, value, mask, direction
+
+HISTOGRAM_BUCKETS = 64
+
+class TracedBus(object):
+    '''Wraps a register bus and records the latency of each operation in the tracer's histograms.'''
+
+    def __init__(self, bus, tracer: 'Tracer'):
+        self.bus = bus
+        self.tracer = tracer
+
+    def _timed(self, op: str, method, *args):
+        start = time.perf_counter_ns()
+        result = method(*args)
+        self.tracer.record_latency(op, time.perf_counter_ns() - start)
+        return result
+
+    def read_register(self, index):
+        return self._timed('read_register', self.bus.read_register, index)
+
+    def write_register(self, index, value):
+        return self._timed('write_register', self.bus.write_register, index, value)
+
+    def write_registers(self, writes):
+        return self._timed('write_registers', self.bus.write_registers, writes)
+
+    def write_stream(self, index, data):
+        return self._timed('write_stream', self.bus.write_stream, index, data)
+
+    def fill(self, index, value, count):
+        return self._timed('fill', self.bus.fill, index, value, count)
+
+    def read_stream(self, index, length):
+        return self._timed('read_stream', read_stream, self.bus, index, length)
+
+    def __getattr__(self, name):
+        # Anything not instrumented (transport-specific calls) passes straight through
+        return getattr(self.bus, name)
+
+class Tracer(object):
+    '''
+    Collects register access records and bus latency metrics from one or more `VERA` instances.
+
+    Args:
+        capacity (int): Number of records kept in the ring buffer
+        path (str, optional): Binary trace file to write every record to
+        echo (bool): Print every access, the way DEBUG_REGISTER_ACCESS used to
+
+    Example:
+        tracer = Tracer(capacity=4096, path='boot.trace')
+        tracer.attach(vera)
+        vera.configure_display()
+        tracer.detach(vera)
+        print(tracer.writes[VERA_CTRL], tracer.histograms['write_register'])
+    '''
+
+    def __init__(self, capacity: int = 4096, path: Optional[str] = None, echo: bool = False):
+        self.capacity = capacity
+        self.echo = echo
+        self.reads = array('Q', bytes(8 * 32))
+        self.writes = array('Q', bytes(8 * 32))
+        self.histograms = {}
+        self._timestamps = array('d', bytes(8 * capacity))
+        self._registers = array('B', bytes(capacity))
+        self._values = array('B', bytes(capacity))
+        self._masks = array('B', bytes(capacity))
+        self._directions = array('B', bytes(capacity))
+        self._count = 0
+        self._file = None
+        if path is not None:
+            self._file = open(path, 'wb')
+            self._file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+
+    def attach(self, vera: VERA) -> None:
+        '''Start tracing `vera`.'''
+        write_register = VERA.write_register.__get__(vera)
+        read_register = VERA.read_register.__get__(vera)
+        record = self.record
+
+        def traced_write_register(register: int, value: int, mask: int = 0) -> None:
+            record(register, value, mask, WRITE)
+            write_register(register, value, mask)
+
+        def traced_read_register(register: int) -> int:
+            value = read_register(register)
+            record(register, value, 0, READ)
+            return value
+
+        vera.write_register = traced_write_register
+        vera.read_register = traced_read_register
+        vera.bus = TracedBus(vera.bus, self)
+
+    def detach(self, vera: VERA) -> None:
+        '''Stop tracing `vera` and flush the trace file.'''
+        vera.__dict__.pop('write_register', None)
+        vera.__dict__.pop('read_register', None)
+        if isinstance(vera.bus, TracedBus):
+            vera.bus = vera.bus.bus
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record(self, register: int, value: int, mask: int, direction: int) -> None:
+        timestamp = time.perf_counter()
+        slot = self._count % self.capacity
+        self._count += 1
+        self._timestamps[slot] = timestamp
+        self._registers[slot] = register & 0xff
+        self._values[slot] = value & 0xff
+        self._masks[slot] = mask & 0xff
+        self._directions[slot] = direction
+        if direction == WRITE:
+            self.writes[register & 0x1f] += 1
+        else:
+            self.reads[register & 0x1f] += 1
+        if self._file is not None:
+            self._file.write(TRACE_RECORD.pack(timestamp, register & 0xff, value & 0xff, mask & 0xff, direction))
+        if self.echo:
+            print(format_record(timestamp, register, value, mask, direction))
+
+    def record_latency(self, op: str, nanoseconds: int) -> None:
+        histogram = self.histograms.get(op)
+        if histogram is None:
+            histogram = self.histograms[op] = array('Q', bytes(8 * HISTOGRAM_BUCKETS))
+        histogram[min(nanoseconds.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def records(self) -> Iterator[Tuple[float, int, int, int, int]]:
+        '''Yield the records still in the ring buffer, oldest first.'''
+        count = min(self._count, self.capacity)
+        first = self._count - count
+        for n in range(first, self._count):
+            slot = n % self.capacity
+            yield (self._timestamps[slot], self._registers[slot], self._values[slot],
+                   self._masks[slot], self._directions[slot])
+
+    def reset(self) -> None:
+        '''Clear the counters, histograms and ring buffer.'''
+        for i in range(32):
+            self.reads[i] = 0
+            self.writes[i] = 0
+        self.histograms.clear()
+        self._count = 0
+
+def histogram_summary(histogram) -> str:
+    '''Render a latency histogram as "<=bucket_limit: count" pairs for the non-empty buckets.'''
+    parts = []
+    for bucket, count in enumerate(histogram):
+        if count:
+            parts.append(f'<{format_ns(1 << bucket)}: {count}')
+    return ', '.join(parts)
+
+def format_ns(ns: int) -> str:
+    if ns >= 1_000_000:
+        return f'{ns / 1_000_000:.0f}ms'
+    if ns >= 1_000:
+        return f'{ns / 1_000:.0f}us'
+    return f'{ns}ns'
+
+def format_record(timestamp: float, register: int, value: int, mask: int, direction: int) -> str:
+    if direction == WRITE:
+        return f'{timestamp:14.6f}  {register:02x} <- {value:02x} & {mask:02x}'
+    return f'{timestamp:14.6f}  {register:02x} == {value:02x}'
+
+def read_trace(path: str) -> Iterator[Tuple[float, int, int, int, int]]:
+    '''Yield the records of a binary trace file written by `Tracer`.'''
+    with open(path, 'rb') as f:
+        magic, version = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError(f'{path} is not a VERA trace file')
+        while True:
+            chunk = f.read(TRACE_RECORD.size * 4096)
+            if not chunk:
+                break
+            yield from TRACE_RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % TRACE_RECORD.size])
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Decode VERA register trace files.')
+    parser.add_argument('command', choices=('decode', 'summary'))
+    parser.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'decode':
+        for entry in read_trace(args.path):
+            print(format_record(*entry))
+        return 0
+
+    reads = [0] * 32
+    writes = [0] * 32
+    first = last = None
+    for timestamp, register, _, _, direction in read_trace(args.path):
+        first = timestamp if first is None else first
+        last = timestamp
+        if direction == WRITE:
+            writes[register & 0x1f] += 1
+        else:
+            reads[register & 0x1f] += 1
+    print(f'{sum(reads)} reads, {sum(writes)} writes', end='')
+    print(f' over {last - first:.6f}s' if first is not None else '')
+    print('reg   reads  writes')
+    for register in range(32):
+        if reads[register] or writes[register]:
+            print(f' {register:02x} {reads[register]:>7} {writes[register]:>7}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
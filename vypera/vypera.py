@@ -1,7 +1,8 @@
+from contextlib import contextmanager
 from enum import Enum
 from ipaddress import AddressValueError
 from multiprocessing.sharedctypes import Value
-from typing import Any, Optional
+from typing import Any, Optional, Tuple
 
 DEBUG_NO_HARDWARE = True
 
@@ -76,7 +77,7 @@ def dcsel_register_property(register, select, doc):
         return self.read_register(register)
     def set_reg(self, value):
         self.DCSEL = select
-        return self.write_register(register, select, value)
+        return self.write_register(register, value)
     return property(fget=get_reg, fset=set_reg, doc=doc)
 
 # For single-bit registers that require DCSEL to be set
@@ -133,18 +134,262 @@ VERA_AUDIO_DATA    = 0x1D
 VERA_SPI_DATA      = 0x1E
 VERA_SPI_CTRL      = 0x1F
 
-class VERA(object):
+def encode_layer(map_height: int, map_width: int, t256c: bool, bitmap_mode: bool, bpp: int,
+                 map_base: int, tile_base: int, tile_height: int, tile_width: int) -> Tuple[int, int, int]:
+    '''
+    Encode a layer configuration into its register values.
+
+    Returns:
+        tuple: (Lx_CONFIG, Lx_MAPBASE, Lx_TILEBASE) register values
+    '''
+    h = tile_dimensions_map[map_height]
+    w = tile_dimensions_map[map_width]
+    t = 1 if t256c else 0
+    b = 1 if bitmap_mode else 0
+    d = depth_map[bpp]
+    layer_config = (h << 6) | (w << 4) | (t << 3) | (b << 2) | d
+    t_map_base = map_base >> 9
+    t_base = tile_base >> 11
+    t_height = (tile_height // 8) - 1
+    t_width = (tile_width // 8) - 1
+    return layer_config, t_map_base, (t_base << 2) | (t_height << 1) | t_width
+
+# The register shadow is indexed by register + 32 * bank. Registers 0x09-0x0C are banked
+# by DCSEL and ADDR_L/M/H are banked by ADDRSEL; every other register only uses bank 0.
+SHADOW_SIZE = 64
+
+# Bits that the hardware can change on its own. Reads of a register with any volatile
+# bits always go to the bus.
+volatile_bits_map = {
+    VERA_ADDR_L: 0xff,      VERA_ADDR_L + 32: 0xff,
+    VERA_ADDR_M: 0xff,      VERA_ADDR_M + 32: 0xff,
+    VERA_ADDR_H: 0x01,      VERA_ADDR_H + 32: 0x01,
+    VERA_DATA_0: 0xff,
+    VERA_DATA_1: 0xff,
+    VERA_ISR: 0xff,
+    VERA_DC_VIDEO: 0x80,
+    VERA_AUDIO_CTRL: 0xc0,
+    VERA_AUDIO_DATA: 0xff,
+    VERA_SPI_DATA: 0xff,
+    VERA_SPI_CTRL: 0x80,
+}
+
+# Bits where the value read back means nothing when written (read-only status, write-1
+# strobes). A masked write never carries these over from the current register value.
+strobe_bits_map = {
+    VERA_CTRL: 0x80,
+    VERA_ISR: 0xff,
+    VERA_DC_VIDEO: 0x80,
+    VERA_AUDIO_CTRL: 0xc0,
+    VERA_SPI_CTRL: 0x80,
+}
+
+# Writes to these registers have side effects beyond setting the register value, so a
+# batch never merges them and never moves other writes across them.
+side_effect_registers = frozenset({
+    VERA_DATA_0, VERA_DATA_1, VERA_CTRL, VERA_ISR, VERA_AUDIO_CTRL, VERA_AUDIO_DATA, VERA_SPI_DATA
+})
+
+volatile_bits = tuple(volatile_bits_map.get(key, 0) for key in range(SHADOW_SIZE))
+strobe_bits = tuple(strobe_bits_map.get(key, 0) for key in range(SHADOW_SIZE))
+
+def read_stream(bus, index: int, length: int) -> bytearray:
+    '''Read a register `length` times, as one burst if the bus supports it.'''
+    burst = getattr(bus, 'read_stream', None)
+    if burst is not None:
+        return burst(index, length)
+    read = bus.read_register
+    return bytearray(read(index) for _ in range(length))
+
+class _BatchBus(object):
+    '''
+    Stands in for the register bus inside `VERA.batch()`. Register writes are recorded into a
+    program instead of being sent. A write to a register that was already written since the
+    last side-effect write replaces the earlier value in place, so the program holds at most
+    one write per register between barriers. Anything that needs the hardware flushes first.
+    '''
+    def __init__(self, bus):
+        self.bus = bus
+        self.program: list = []
+        self._pending: dict = {}
+
+    def write_register(self, index: int, value: int) -> None:
+        if index in side_effect_registers:
+            self.program.append((index, value))
+            self._pending.clear()
+            return
+        position = self._pending.get(index)
+        if position is None:
+            self._pending[index] = len(self.program)
+            self.program.append((index, value))
+        else:
+            self.program[position] = (index, value)
+
+    def write_registers(self, writes) -> None:
+        for index, value in writes:
+            self.write_register(index, value)
+
+    def flush(self) -> None:
+        if self.program:
+            self.bus.write_registers(self.program)
+            self.program = []
+            self._pending.clear()
 
-    DEBUG_REGISTER_ACCESS = True
+    def read_register(self, index: int) -> int:
+        self.flush()
+        return self.bus.read_register(index)
+
+    def write_stream(self, index: int, data) -> None:
+        self.flush()
+        self.bus.write_stream(index, data)
+
+    def fill(self, index: int, value: int, count: int) -> None:
+        self.flush()
+        self.bus.fill(index, value, count)
+
+    def read_stream(self, index: int, length: int) -> bytearray:
+        self.flush()
+        return read_stream(self.bus, index, length)
+
+    def sync(self) -> None:
+        self.flush()
+        sync = getattr(self.bus, 'sync', None)
+        if sync is not None:
+            sync()
+
+class VERA(object):
 
     def __init__(self, bus):
         self.bus = bus
         self._increment: Increment = Increment.INCR_0
         self._direction: StepDirection = StepDirection.FORWARD
+        self._shadow: list = [None] * SHADOW_SIZE
+        self._vram = None
+
+    def _shadow_key(self, register: int) -> int:
+        '''Return the shadow index of `register` for the currently selected DCSEL/ADDRSEL bank.'''
+        if register > VERA_DC_BORDER or VERA_DATA_0 <= register < VERA_DC_VIDEO:
+            return register
+        ctrl = self._shadow[VERA_CTRL]
+        if ctrl is None:
+            ctrl = self._shadow[VERA_CTRL] = self.bus.read_register(VERA_CTRL)
+        if register >= VERA_DC_VIDEO:
+            return register + ((ctrl << 4) & 0x20)     # DCSEL is CTRL bit 1
+        return register + ((ctrl << 5) & 0x20)         # ADDRSEL is CTRL bit 0
+
+    @property
+    def vram(self):
+        '''Host-side VRAM mirror with dirty tracking (a `vera_mirror.VramMirror`), created on first use.'''
+        if self._vram is None:
+            from vera_mirror import VramMirror
+            self._vram = VramMirror(self)
+        return self._vram
+
+    @contextmanager
+    def batch(self):
+        '''
+        Context manager that defers register writes and sends them as a single burst on exit.
+        Repeated writes to the same register are merged. Reads of shadowed registers are
+        answered from the shadow; any access that needs the hardware flushes the pending
+        writes first. Nested batches join the outermost one.
+
+        Example:
+            with vera.batch():
+                vera.configure_layer(...)
+                vera.start_display(layer1_en=True)
+        '''
+        if isinstance(self.bus, _BatchBus):
+            yield self
+            return
+        recorder = _BatchBus(self.bus)
+        self.bus = recorder
+        try:
+            yield self
+        finally:
+            self.bus = recorder.bus
+            recorder.flush()
+
+    def cached_register(self, register: int, bank: int = 0) -> Optional[int]:
+        '''
+        Return the shadowed value of a register without touching the bus, with any volatile bits
+        cleared. Returns None if the value is not known or the whole register is volatile.
+
+        Args:
+            register (int): VERA register index [0..31]
+            bank (int): DCSEL bank for registers 0x09-0x0C, ADDRSEL for ADDR_x
+        '''
+        key = register + 32 * bank
+        value = self._shadow[key]
+        if value is None or volatile_bits[key] == 0xff:
+            return None
+        return value & ~volatile_bits[key]
+
+    def apply_state(self, state) -> None:
+        '''
+        Bring the display configuration to `state` (a `vera_display.DisplayState`), writing only
+        the registers that differ from the shadow, in a single burst.
+        '''
+        from vera_display import apply_state
+        apply_state(self, state)
+
+    def save_state(self, path: str, vram=None) -> None:
+        '''
+        Save the register shadow and VRAM contents to `path` for a later `attach()`
+        (see `vera_state.save_state`).
+        '''
+        from vera_state import save_state
+        save_state(self, path, vram)
+
+    def attach(self, path: str, vram=None):
+        '''
+        Take over a board that was left in the state saved in `path` without resetting it,
+        writing only registers and VRAM regions that differ (see `vera_state.attach`).
+
+        Returns:
+            vera_state.AttachReport: What was found and written
+        '''
+        from vera_state import attach
+        return attach(self, path, vram)
+
+    def sync(self) -> None:
+        '''
+        Wait until every register access issued so far has reached the hardware. This only
+        matters for buses that queue writes, such as `vera_async.WriteBehindBus`.
+        '''
+        sync = getattr(self.bus, 'sync', None)
+        if sync is not None:
+            sync()
+
+    def invalidate(self) -> None:
+        '''
+        Forget all shadowed register values. The next access to each register goes to the bus.
+        Use this if something other than this object may have changed VERA's registers.
+        '''
+        self._shadow = [None] * SHADOW_SIZE
+
+    def resync(self) -> None:
+        '''
+        Reload the register shadow from hardware, including both DCSEL banks and the
+        ADDR_H increment settings of both address pointers. CTRL is restored afterwards.
+        '''
+        self.invalidate()
+        shadow = self._shadow
+        ctrl = self.bus.read_register(VERA_CTRL) & 0x7f
+        for bank in (0, 1):
+            self.bus.write_register(VERA_CTRL, (ctrl & 0xfc) | (bank << 1) | bank)
+            for register in (VERA_ADDR_H, VERA_DC_VIDEO, VERA_DC_HSCALE, VERA_DC_VSCALE, VERA_DC_BORDER):
+                shadow[register + 32 * bank] = self.bus.read_register(register)
+        self.bus.write_register(VERA_CTRL, ctrl)
+        shadow[VERA_CTRL] = ctrl
+        for register in range(VERA_IEN, 0x20):
+            if VERA_DC_VIDEO <= register <= VERA_DC_BORDER or volatile_bits[register] == 0xff:
+                continue
+            shadow[register] = self.bus.read_register(register)
 
     def write_register(self, register: int, value: int, mask: int = 0) -> None:
         '''
-        Write to a register on VERA.
+        Write to a register on VERA. Masked writes take the unmasked bits from the register
+        shadow, and only read the register back if some of those bits are volatile.
 
         Args:
             register (int): VERA register index [0..31]
@@ -155,16 +400,25 @@ class VERA(object):
             IndexError: `register` is not a legal register index
             ValueError: `value` is not a legal byte value
         '''
-        if self.DEBUG_REGISTER_ACCESS:
-            print(f"  {register:02x} <- {value:02x} & {mask:02x}")
         if register < 0 or register > 0x1f:
             raise IndexError(register)
         if value < 0 or value > 0xff:
             raise ValueError(value)
-        if mask != 0:
-            register_value = self.bus.read_register(register)
-            value = (register_value & ~mask) | (value & mask)
+        key = self._shadow_key(register)
+        shadow = self._shadow
+        current = shadow[key]
+        if mask != 0 and mask != 0xff:
+            keep = ~mask & ~strobe_bits[key] & 0xff
+            if current is None or volatile_bits[key] & keep:
+                current = shadow[key] = self.bus.read_register(register)
+            value = (current & keep) | (value & mask)
+        if value == current and not volatile_bits[key] and not value & strobe_bits[key]:
+            return      # Register already holds this value
         self.bus.write_register(register, value)
+        if register == VERA_CTRL and value & 0x80:
+            self.invalidate()   # VERA reset returns every register to its default
+        else:
+            shadow[key] = value
     
     def read_register(self, register: int) -> int:
         '''
@@ -181,9 +435,10 @@ class VERA(object):
         '''
         if register < 0 or register > 0x1f:
             raise ValueError(register)
-        value = self.bus.read_register(register)
-        if self.DEBUG_REGISTER_ACCESS:
-            print(f"  {register:02x} == {value:02x}")
+        key = self._shadow_key(register)
+        value = self._shadow[key]
+        if value is None or volatile_bits[key]:
+            value = self._shadow[key] = self.bus.read_register(register)
         return value
     
     def update_register_bits(self, register: int,
@@ -446,67 +701,182 @@ class VERA(object):
         self.increment = increment
 
     def set_address_and_increment(self, address, increment: int = 0, select: Optional[int] = None):
+        if address < 0 or address >= (1 << 17):
+            raise AddressValueError
+        if abs(increment) not in increment_map:
+            raise ValueError(increment)
         if select is not None:
             self.ADDRSEL = select
         self.ADDR_L = address & 0xff
         self.ADDR_M = (address >> 8) & 0xff
         direction = 0 if increment >= 0 else 1
         encoded_increment = increment_map[abs(increment)]
-        addr_h = (encoded_increment << 4) | (direction.value << 3) | ((address >> 16) & 0x1)
-        self.write_register(VERA.ADDR_H, addr_h & 0xff)
+        addr_h = (encoded_increment << 4) | (direction << 3) | ((address >> 16) & 0x1)
+        self.write_register(VERA_ADDR_H, addr_h & 0xff)
+
+    def write_vram(self, address: int, data, increment: int = 1, port: int = 0) -> None:
+        '''
+        Upload a block of bytes to VRAM. The address pointer selected by `port` is programmed
+        once and the data is then streamed through DATA0/DATA1 using the auto-increment.
+
+        Args:
+            address (int): 17-bit VRAM address of the first byte
+            data: Any object supporting the buffer protocol (bytes, bytearray, memoryview,
+                array, numpy array). Multi-byte items are sent in memory order.
+            increment (int): Address step between bytes, must be a key of `increment_map`
+                or its negative. Default 1.
+            port (int): Data port / address pointer to use (0 or 1)
+        '''
+        view = memoryview(data).cast('B')
+        self.set_address_and_increment(address, increment, port)
+        self.bus.write_stream(VERA_DATA_1 if port else VERA_DATA_0, view)
+
+    def read_vram(self, address: int, length: int, increment: int = 1, port: int = 0) -> bytearray:
+        '''
+        Read a block of bytes from VRAM by streaming DATA0/DATA1 with auto-increment.
+
+        Args:
+            address (int): 17-bit VRAM address of the first byte
+            length (int): Number of bytes to read
+            increment (int): Address step between bytes. Default 1.
+            port (int): Data port / address pointer to use (0 or 1)
+
+        Returns:
+            bytearray: The bytes read
+        '''
+        self.set_address_and_increment(address, increment, port)
+        return self._read_data(VERA_DATA_1 if port else VERA_DATA_0, length)
+
+    def snapshot_vram(self, port: int = 0) -> bytearray:
+        '''Read all 128 KB of VRAM in one burst.'''
+        return self.read_vram(0, 1 << 17, 1, port)
+
+    def _read_data(self, data_register: int, length: int) -> bytearray:
+        '''Read `length` bytes from a data port whose address pointer is already set up.'''
+        return read_stream(self.bus, data_register, length)
+
+    def fill(self, address: int, length: int, value: int, stride: int = 1, port: int = 0) -> None:
+        '''
+        Write `value` to `length` VRAM locations starting at `address`, `stride` bytes apart.
+
+        Args:
+            address (int): 17-bit VRAM address of the first byte
+            length (int): Number of bytes to write
+            value (int): Byte value to write
+            stride (int): Address step, any VERA increment (including 40/80/160/320/640)
+            port (int): Data port / address pointer to use (0 or 1)
+        '''
+        if value < 0 or value > 0xff:
+            raise ValueError(value)
+        self.set_address_and_increment(address, stride, port)
+        self.bus.fill(VERA_DATA_1 if port else VERA_DATA_0, value, length)
+
+    def fill_rect(self, base: int, width: int, height: int, pitch: int, value: int, port: int = 0) -> None:
+        '''
+        Fill a rectangle of `height` rows of `width` bytes, rows `pitch` bytes apart. The rectangle
+        is walked by rows or, when `pitch` is a VERA increment, by columns, whichever needs fewer
+        address pointer setups.
+        '''
+        if width == pitch:
+            self.fill(base, width * height, value, 1, port)
+        elif pitch in increment_map and width < height:
+            for x in range(width):
+                self.fill(base + x, height, value, pitch, port)
+        else:
+            for y in range(height):
+                self.fill(base + y * pitch, width, value, 1, port)
+
+    # Bytes read from DATA0 before they are written back to DATA1 by copy()
+    COPY_CHUNK = 256
+
+    def copy(self, src: int, dst: int, length: int, src_stride: int = 1, dst_stride: int = 1) -> None:
+        '''
+        Copy VRAM to VRAM. Address pointer 0 walks the source and is read through DATA0, pointer 1
+        walks the destination and is written through DATA1; both auto-increment, so each byte costs
+        one read and one write. Overlapping sequential copies behave like memmove.
+
+        Args:
+            src (int): Source VRAM address
+            dst (int): Destination VRAM address
+            length (int): Number of bytes to copy
+            src_stride (int): Source address step, any VERA increment
+            dst_stride (int): Destination address step, any VERA increment
+        '''
+        if length <= 0:
+            return
+        if src_stride == dst_stride == 1 and src < dst < src + length:
+            # Walk backwards so the overlapping source is read before it is overwritten
+            src, dst = src + length - 1, dst + length - 1
+            src_stride = dst_stride = -1
+        with self.batch():
+            self.set_address_and_increment(src, src_stride, 0)
+            self.set_address_and_increment(dst, dst_stride, 1)
+        for start in range(0, length, self.COPY_CHUNK):
+            chunk = self._read_data(VERA_DATA_0, min(self.COPY_CHUNK, length - start))
+            self.bus.write_stream(VERA_DATA_1, chunk)
+
+    def copy_rect(self, src: int, dst: int, width: int, height: int, src_pitch: int, dst_pitch: int) -> None:
+        '''
+        Copy a rectangle of `height` rows of `width` bytes. Works by columns using the pitch
+        increments when both pitches are VERA increments and that needs fewer pointer setups,
+        otherwise by rows. The source and destination rectangles must not overlap.
+        '''
+        if width == src_pitch == dst_pitch:
+            self.copy(src, dst, width * height)
+        elif src_pitch in increment_map and dst_pitch in increment_map and width < height:
+            for x in range(width):
+                self.copy(src + x, dst + x, height, src_pitch, dst_pitch)
+        else:
+            for y in range(height):
+                self.copy(src + y * src_pitch, dst + y * dst_pitch, width)
     
     def set_interrupt_enables(self, aflow = None, sprcol = None, line = None, vsync = None):
-        self.update_register_bits(VERA.IEN, bit3=aflow, bit2=sprcol, bit1=line, bit0=vsync)
+        self.update_register_bits(VERA_IEN, bit3=aflow, bit2=sprcol, bit1=line, bit0=vsync)
 
     def set_ctrl(self, addrsel=None, dcsel=None, reset=None):
-        self.update_register_bits(self, bit7=reset, bit1=dcsel, bit0=addrsel)
+        self.update_register_bits(VERA_CTRL, bit7=reset, bit1=dcsel, bit0=addrsel)
     
     def configure_display(self, hscale: int = 1, vscale: int = 1, bordercol: int = 0, hstart: int = 0, hstop: int = 640, vstart: int = 0, vstop: int = 480):
-        self.DCSEL = 0
-        self.DC_HSCALE = round(128 / hscale)
-        self.DC_VSCALE = round(128 / vscale)
-        self.DC_BORDER = bordercol
-        self.DC_HSTART = hstart >> 2
-        self.DC_HSTOP = hstop >> 2
-        self.DC_VSTART = vstart >> 1
-        self.DC_VSTOP = vstop >> 1
+        with self.batch():
+            self.DCSEL = 0
+            self.DC_HSCALE = round(128 / hscale)
+            self.DC_VSCALE = round(128 / vscale)
+            self.DC_BORDER = bordercol
+            self.DC_HSTART = hstart >> 2
+            self.DC_HSTOP = hstop >> 2
+            self.DC_VSTART = vstart >> 1
+            self.DC_VSTOP = vstop >> 1
 
     def configure_layer(self, layer_index: int, map_height: int, map_width: int,
                         t256c: bool, bitmap_mode: bool, bpp: int, map_base: int,
                         tile_base: int, tile_height: int, tile_width: int):
-        h = tile_dimensions_map[map_height]
-        w = tile_dimensions_map[map_width]
-        t = 1 if t256c else 0
-        b = 1 if bitmap_mode else 0
-        d = depth_map[bpp]
-        layer_config = (h << 6) | (w << 4) | (t << 3) | (b << 2) | d
-        t_map_base = map_base >> 9
-        t_base = tile_base >> 11
-        t_height = (tile_height / 8) - 1
-        t_width = (tile_width / 8) - 1
-
-        if layer_index == 0:
-            self.L0_CONFIG = layer_config
-            self.L0_MAPBASE = t_map_base
-            self.L0_TILEBASE = (t_base << 2) | t_height | t_width
-            self.L0_HSCROLL_H = 0
-            self.L0_HSCROLL_L = 0
-            self.L0_VSCROLL_H = 0
-            self.L0_VSCROLL_L = 0
-        else:
-            self.L1_CONFIG = layer_config
-            self.L1_MAPBASE = t_map_base
-            self.L1_TILEBASE = (t_base << 2) | t_height | t_width
-            self.L1_HSCROLL_H = 0
-            self.L1_HSCROLL_L = 0
-            self.L1_VSCROLL_H = 0
-            self.L1_VSCROLL_L = 0
+        layer_config, t_map_base, t_tile_base = encode_layer(map_height, map_width, t256c, bitmap_mode, bpp,
+                                                            map_base, tile_base, tile_height, tile_width)
+
+        with self.batch():
+            if layer_index == 0:
+                self.L0_CONFIG = layer_config
+                self.L0_MAPBASE = t_map_base
+                self.L0_TILEBASE = t_tile_base
+                self.L0_HSCROLL_H = 0
+                self.L0_HSCROLL_L = 0
+                self.L0_VSCROLL_H = 0
+                self.L0_VSCROLL_L = 0
+            else:
+                self.L1_CONFIG = layer_config
+                self.L1_MAPBASE = t_map_base
+                self.L1_TILEBASE = t_tile_base
+                self.L1_HSCROLL_H = 0
+                self.L1_HSCROLL_L = 0
+                self.L1_VSCROLL_H = 0
+                self.L1_VSCROLL_L = 0
 
     def start_display(self, layer0_en: bool = False, layer1_en: bool = False, sprite_en: bool = False):
-        self.SPRITE_EN = 1 if sprite_en else 0
-        self.L1_EN = 1 if layer1_en else 0
-        self.L0_EN = 1 if layer0_en else 1
-        self.output_mode = 1 # VGA
+        with self.batch():
+            self.SPRITE_EN = 1 if sprite_en else 0
+            self.L1_EN = 1 if layer1_en else 0
+            self.L0_EN = 1 if layer0_en else 0
+            self.output_mode = 1 # VGA
     
     def stop_display(self):
         self.output_mode = 0